@@ -0,0 +1,295 @@
+"""Retrieval microbenchmarks on synthetic judgment-like corpora.
+
+Synthetic documents are sampled from the character frequencies and document
+lengths of the real corpora under ``data/``, so index statistics (vocabulary
+size, postings lengths, document lengths) resemble the real data at any
+scale.  Each corpus size is benchmarked in a fresh process:
+
+* index build time (streaming builder) and index file size
+* ``load_index`` time and resident memory after loading
+* single query latency p50/p95/p99 and QPS, and batch query QPS
+
+Results are written as JSON; ``--compare`` checks them against an earlier run.
+
+Usage::
+
+    python bench_retrieval.py --sizes 1000,10000,100000 --out bench.json
+    python bench_retrieval.py --sizes 1000,10000 --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from corpus_io import iter_corpus
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover - optional dependency
+    np = None
+
+DATA_ROOT = Path("data")
+
+# metrics where a larger value is a regression (the rest are throughputs)
+LOWER_IS_BETTER = (
+    "build_s",
+    "index_mb",
+    "open_ms",
+    "load_ms",
+    "rss_mb",
+    "query_p50_ms",
+    "query_p95_ms",
+    "query_p99_ms",
+)
+HIGHER_IS_BETTER = ("query_qps", "batch_qps")
+
+
+def corpus_statistics(data_root=DATA_ROOT) -> Dict[str, object]:
+    """Character frequencies, document lengths and query lengths of ``data_root``."""
+    chars = Counter()
+    doc_lens: List[int] = []
+    query_lens: List[int] = []
+    for category in sorted(p.parent.name for p in Path(data_root).glob("*/format")):
+        for doc in iter_corpus(Path(data_root) / category):
+            text = "".join(doc["text"].split())
+            chars.update(text)
+            doc_lens.append(len(text))
+        queries = Path(data_root) / category / "format" / "queries.json"
+        if queries.exists():
+            with open(queries, "r", encoding="utf-8") as f:
+                query_lens += [len("".join(q["text"].split())) for q in json.load(f)]
+    if not doc_lens:
+        raise FileNotFoundError(f"no corpora found under {data_root}")
+    terms, counts = zip(*chars.most_common())
+    return {
+        "chars": "".join(terms),
+        "counts": list(counts),
+        "doc_lens": doc_lens,
+        "query_lens": query_lens or [32],
+    }
+
+
+class TextSampler:
+    """Sample character sequences with the frequencies of ``stats``."""
+
+    def __init__(self, stats, seed: int = 0):
+        self.chars = stats["chars"]
+        self.rng = random.Random(seed)
+        if np is not None:
+            weights = np.asarray(stats["counts"], dtype=np.float64)
+            self._p = weights / weights.sum()
+            self._codes = np.array([ord(c) for c in self.chars], dtype=np.uint32)
+            self._np_rng = np.random.default_rng(seed)
+        else:
+            total = 0
+            self._cum = []
+            for count in stats["counts"]:
+                total += count
+                self._cum.append(total)
+
+    def text(self, length: int) -> str:
+        if np is not None:
+            codes = self._codes[self._np_rng.choice(len(self._codes), size=length, p=self._p)]
+            return codes.tobytes().decode("utf-32-le" if sys.byteorder == "little" else "utf-32-be")
+        return "".join(self.rng.choices(self.chars, cum_weights=self._cum, k=length))
+
+
+def synthetic_corpus(n_docs: int, stats, seed: int = 0) -> Iterator[Dict[str, object]]:
+    """Yield ``n_docs`` synthetic ``{"id", "text"}`` records."""
+    sampler = TextSampler(stats, seed)
+    for doc_id in range(n_docs):
+        yield {"id": doc_id, "text": sampler.text(sampler.rng.choice(stats["doc_lens"]))}
+
+
+def synthetic_queries(n_queries: int, stats, seed: int = 1) -> List[str]:
+    sampler = TextSampler(stats, seed)
+    return [sampler.text(sampler.rng.choice(stats["query_lens"])) for _ in range(n_queries)]
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (peak RSS where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):  # pragma: no cover - non-Linux
+        import resource
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 2**20 if sys.platform == "darwin" else rss / 1024
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[k]
+
+
+def bench_size(n_docs: int, args) -> Dict[str, object]:
+    """Benchmark one corpus size; runs in its own process."""
+    from bm25_retrieval import create_retriever, load_index
+    from build_bm25_index import build_index_streaming
+
+    stats = corpus_statistics(args.data_root)
+    queries = synthetic_queries(args.queries, stats, seed=args.seed + 1)
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp:
+        path = Path(tmp) / "bench_index.bin"
+        start = time.perf_counter()
+        build_index_streaming(synthetic_corpus(n_docs, stats, args.seed), path)
+        build_s = time.perf_counter() - start
+
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        bm25 = create_retriever(load_index(path), backend=args.backend)
+        open_ms = (time.perf_counter() - start) * 1000
+        rss_open_mb = current_rss_mb()
+        bm25.query(queries[0], args.top_k)  # include lazily built structures
+        load_ms = (time.perf_counter() - start) * 1000
+        rss_mb = current_rss_mb()
+
+        latencies = []
+        for text in queries:
+            start = time.perf_counter()
+            bm25.query(text, args.top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+
+        start = time.perf_counter()
+        for i in range(0, len(queries), args.batch_size):
+            bm25.query_batch(queries[i : i + args.batch_size], args.top_k)
+        batch_s = time.perf_counter() - start
+
+        return {
+            "docs": n_docs,
+            "terms": len(bm25.vocab),
+            "build_s": build_s,
+            "index_mb": path.stat().st_size / 2**20,
+            "open_ms": open_ms,
+            "load_ms": load_ms,
+            "rss_open_mb": rss_open_mb - rss_before,
+            "rss_mb": rss_mb,
+            "rss_index_mb": rss_mb - rss_before,
+            "query_p50_ms": percentile(latencies, 50),
+            "query_p95_ms": percentile(latencies, 95),
+            "query_p99_ms": percentile(latencies, 99),
+            "query_qps": len(latencies) / (sum(latencies) / 1000),
+            "batch_qps": len(queries) / batch_s,
+        }
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        )
+        return out.stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(args) -> Dict[str, object]:
+    results = []
+    ctx = get_context("spawn")
+    for n_docs in args.sizes:
+        # a fresh process per size keeps RSS and caches independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            result = pool.submit(bench_size, n_docs, args).result()
+        print(
+            f"{n_docs:>9} docs  build {result['build_s']:.2f}s  "
+            f"index {result['index_mb']:.1f}MB  open {result['open_ms']:.1f}ms  "
+            f"load {result['load_ms']:.1f}ms  "
+            f"rss {result['rss_mb']:.0f}MB  p50 {result['query_p50_ms']:.2f}ms  "
+            f"p99 {result['query_p99_ms']:.2f}ms  qps {result['query_qps']:.0f}  "
+            f"batch qps {result['batch_qps']:.0f}",
+            flush=True,
+        )
+        results.append(result)
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": getattr(np, "__version__", None),
+            "backend": args.backend,
+            "queries": args.queries,
+            "top_k": args.top_k,
+            "batch_size": args.batch_size,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, tolerance: float) -> List[str]:
+    """Return the metrics of ``current`` that regressed by more than ``tolerance``."""
+    old = {r["docs"]: r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        ref = old.get(result["docs"])
+        if ref is None:
+            continue
+        for key in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            if not ref.get(key) or key not in result:
+                continue
+            ratio = result[key] / ref[key]
+            worse = ratio > 1 + tolerance if key in LOWER_IS_BETTER else ratio < 1 - tolerance
+            mark = "  REGRESSION" if worse else ""
+            print(f"{result['docs']:>9} {key:<14} {ref[key]:>12.3f} -> {result[key]:>12.3f} ({ratio:.2f}x){mark}")
+            if worse:
+                regressions.append(f"{result['docs']}:{key}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark BM25 indexing and retrieval")
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000,100000",
+        type=lambda s: [int(x) for x in s.split(",") if x],
+        help="comma separated corpus sizes (e.g. 1000,10000,100000,1000000)",
+    )
+    parser.add_argument("--queries", type=int, default=200, help="queries per size")
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--backend", choices=["auto", "python", "sparse"], default="auto")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-root", default=str(DATA_ROOT))
+    parser.add_argument("--tmp-dir", default=None, help="directory for temporary indexes")
+    parser.add_argument("--out", default=None, help="write results to this JSON file")
+    parser.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed relative slowdown for --compare"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = run_benchmarks(args)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
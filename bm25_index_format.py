@@ -0,0 +1,250 @@
+"""Versioned binary on-disk format for BM25 indexes.
+
+The file starts with a fixed-size header followed by 8-byte aligned sections
+of fixed-width little-endian arrays::
+
+    header      magic, version, corpus statistics, section table
+    doc_ids     int64[N]     external document id of every document
+    doc_len     uint32[N]    number of tokens per document
+    vocab_ptr   uint64[V+1]  offsets of each term inside vocab_blob
+    vocab_blob  bytes        UTF-8 encoded terms, in term id order
+    df          uint32[V]    document frequency per term
+    idf         float64[V]   idf per term
+    post_ptr    uint64[V+1]  start of each term's postings
+    post_docs   uint32[P]    document indexes, ascending within a term
+    post_tfs    uint32[P]    term frequencies matching post_docs
+
+:class:`BinaryIndex` maps the file with ``mmap`` and exposes the sections as
+zero-copy ``memoryview`` arrays, so opening an index costs O(vocabulary)
+regardless of the corpus size.
+"""
+import mmap
+import struct
+import sys
+from array import array
+from collections import Counter
+from collections.abc import Sequence
+from pathlib import Path
+
+from tokenizer import Vocabulary
+
+MAGIC = b"Q2DBM25\x00"
+VERSION = 1
+
+SECTIONS = (
+    ("doc_ids", "q"),
+    ("doc_len", "I"),
+    ("vocab_ptr", "Q"),
+    ("vocab_blob", "B"),
+    ("df", "I"),
+    ("idf", "d"),
+    ("post_ptr", "Q"),
+    ("post_docs", "I"),
+    ("post_tfs", "I"),
+)
+
+# magic, version, section count, N, V, postings, total tokens, avgdl
+_HEADER = struct.Struct("<8sIIQQQQd")
+_SECTION = struct.Struct("<QQ")
+HEADER_SIZE = _HEADER.size + _SECTION.size * len(SECTIONS)
+
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def _align(n, size=8):
+    return (n + size - 1) // size * size
+
+
+def is_binary_index(path) -> bool:
+    """Return True if ``path`` starts with the binary index magic."""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class IndexFileWriter:
+    """Write a binary index section by section.
+
+    Sections may be written in any order and in several chunks, which lets
+    callers stream large arrays to disk; the header is patched in
+    :meth:`close` once all offsets are known.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._f = open(self.path, "wb")
+        self._f.write(b"\0" * _align(HEADER_SIZE))
+        self._sections = {}
+        self._current = None
+
+    def begin_section(self, name):
+        if self._current is not None:
+            raise RuntimeError(f"section {self._current} is still open")
+        if name in self._sections or name not in dict(SECTIONS):
+            raise ValueError(f"invalid or duplicate section: {name}")
+        pad = _align(self._f.tell()) - self._f.tell()
+        self._f.write(b"\0" * pad)
+        self._current = name
+        self._sections[name] = [self._f.tell(), 0]
+
+    def write(self, data):
+        """Append an ``array`` (or bytes) to the open section."""
+        if isinstance(data, array):
+            if data.typecode != dict(SECTIONS)[self._current]:
+                raise TypeError(f"{self._current} expects typecode {dict(SECTIONS)[self._current]}")
+            if not _LITTLE_ENDIAN:
+                data = array(data.typecode, data)
+                data.byteswap()
+            data = data.tobytes()
+        self._f.write(data)
+        self._sections[self._current][1] += len(data)
+
+    def end_section(self):
+        self._current = None
+
+    def write_section(self, name, data):
+        self.begin_section(name)
+        self.write(data)
+        self.end_section()
+
+    def write_vocabulary(self, terms):
+        """Write the ``vocab_ptr`` and ``vocab_blob`` sections."""
+        blobs = [w.encode("utf-8") for w in terms]
+        vocab_ptr = array("Q", [0])
+        for blob in blobs:
+            vocab_ptr.append(vocab_ptr[-1] + len(blob))
+        self.write_section("vocab_ptr", vocab_ptr)
+        self.write_section("vocab_blob", b"".join(blobs))
+
+    def abort(self):
+        """Close and remove a partially written file."""
+        self._f.close()
+        self.path.unlink(missing_ok=True)
+
+    def close(self, n_docs, n_terms, n_postings, total_len, avgdl):
+        missing = [name for name, _ in SECTIONS if name not in self._sections]
+        if missing:
+            raise RuntimeError(f"missing index sections: {', '.join(missing)}")
+        self._f.seek(0)
+        self._f.write(
+            _HEADER.pack(
+                MAGIC, VERSION, len(SECTIONS), n_docs, n_terms, n_postings, total_len, avgdl
+            )
+        )
+        for name, _ in SECTIONS:
+            self._f.write(_SECTION.pack(*self._sections[name]))
+        self._f.close()
+
+
+def write_index_file(index, path):
+    """Write an in-memory index (as returned by ``build_index``) to ``path``.
+
+    Term ids are taken from the index vocabulary, which numbers terms in
+    order of first occurrence, so the output is reproducible byte for byte.
+    """
+    idf = index["idf"]
+    vocab = index["vocab"]
+    if "postings" in index:
+        # postings already built (e.g. by the parallel builder)
+        post_docs = [docs for docs, _ in index["postings"]]
+        post_tfs = [tfs for _, tfs in index["postings"]]
+        doc_len = index["doc_len"]
+    else:
+        post_docs = [array("I") for _ in range(len(vocab))]
+        post_tfs = [array("I") for _ in range(len(vocab))]
+        doc_len = array("I")
+        for idx, doc in enumerate(index["docs"]):
+            doc_len.append(len(doc))
+            for tid, tf in Counter(doc).items():
+                post_docs[tid].append(idx)
+                post_tfs[tid].append(tf)
+
+    writer = IndexFileWriter(path)
+    try:
+        writer.write_section("doc_ids", array("q", (int(d) for d in index["doc_ids"])))
+        writer.write_section("doc_len", doc_len)
+        writer.write_vocabulary(vocab.terms)
+        writer.write_section("df", array("I", (len(p) for p in post_docs)))
+        writer.write_section("idf", array("d", idf))
+        post_ptr = array("Q", [0])
+        for p in post_docs:
+            post_ptr.append(post_ptr[-1] + len(p))
+        writer.write_section("post_ptr", post_ptr)
+        writer.begin_section("post_docs")
+        for p in post_docs:
+            writer.write(p)
+        writer.end_section()
+        writer.begin_section("post_tfs")
+        for p in post_tfs:
+            writer.write(p)
+        writer.end_section()
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close(len(doc_len), len(vocab), post_ptr[-1], sum(doc_len), float(index["avgdl"]))
+
+
+class _PostingsView(Sequence):
+    """Read-only ``term id -> (doc_indexes, term_freqs)`` view of an index."""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __getitem__(self, tid):
+        return self._index.term_postings(tid)
+
+    def __len__(self):
+        return self._index.n_terms
+
+
+class BinaryIndex:
+    """Memory-mapped binary BM25 index.
+
+    ``vocab`` is the interned :class:`~tokenizer.Vocabulary`; ``postings``
+    (``term id -> (doc_indexes, term_freqs)``) and ``idf`` are indexed by
+    term id and read directly from the mapped file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < HEADER_SIZE:
+            raise ValueError(f"{self.path} is not a binary BM25 index")
+        magic, version, n_sections, n_docs, n_terms, n_postings, total_len, avgdl = (
+            _HEADER.unpack_from(self._mmap, 0)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a binary BM25 index")
+        if version != VERSION or n_sections != len(SECTIONS):
+            raise ValueError(
+                f"unsupported BM25 index version {version} (expected {VERSION})"
+            )
+        self.N = n_docs
+        self.n_terms = n_terms
+        self.n_postings = n_postings
+        self.total_len = total_len
+        self.avgdl = avgdl
+
+        buf = memoryview(self._mmap)
+        for i, (name, code) in enumerate(SECTIONS):
+            offset, nbytes = _SECTION.unpack_from(self._mmap, _HEADER.size + i * _SECTION.size)
+            view = buf[offset : offset + nbytes]
+            if code != "B":
+                if _LITTLE_ENDIAN:
+                    view = view.cast(code)
+                else:  # pragma: no cover - big-endian hosts copy the array
+                    view = array(code, view.tobytes())
+                    view.byteswap()
+            setattr(self, name, view)
+
+        ptr = self.vocab_ptr
+        blob = self.vocab_blob
+        self.vocab = Vocabulary(
+            bytes(blob[ptr[i] : ptr[i + 1]]).decode("utf-8") for i in range(n_terms)
+        )
+        self.postings = _PostingsView(self)
+
+    def term_postings(self, tid):
+        """Return zero-copy ``(doc_indexes, term_freqs)`` of term id ``tid``."""
+        start, end = self.post_ptr[tid], self.post_ptr[tid + 1]
+        return self.post_docs[start:end], self.post_tfs[start:end]
@@ -6,56 +6,324 @@ Usage:
 INDEX_FILE should be built with build_bm25_index.py.
 """
 import json
+import heapq
+from bisect import bisect_left
 from collections import Counter
 import sys
+from array import array
+from functools import cached_property
 from pathlib import Path  # 加入缺少的 import
+try:
+    import numpy as np
+except Exception:  # pragma: no cover - optional dependency
+    np = None
+
+import metrics
+from bm25_index_format import BinaryIndex, is_binary_index
+from corpus_io import load_corpus  # noqa: F401 - re-exported for callers
+from tokenizer import Vocabulary, tokenize
 
 
 class BM25Retriever:
     def __init__(self, index, k1=1.5, b=0.75):
-        self.doc_ids = index["doc_ids"]
-        self.docs = index["docs"]
-        # ensure idf values are floats
-        self.idf = {k: float(v) for k, v in index["idf"].items()}
-        self.avgdl = index["avgdl"]
-        self.N = len(self.docs)  # 加入缺少的 N 屬性
-
         self.k1 = k1
         self.b = b
 
+        if hasattr(index, "snapshot"):
+            # segmented index: search a point-in-time view of live segments
+            index = index.snapshot()
+        if not isinstance(index, dict):
+            # BinaryIndex (zero-copy views into the memory-mapped file) or a
+            # segment snapshot, both indexed by term id
+            self._binary = index if isinstance(index, BinaryIndex) else None
+            self.doc_ids = index.doc_ids
+            self.vocab = index.vocab
+            self.idf = index.idf
+            self.avgdl = index.avgdl
+            self.postings = index.postings
+            self.doc_len = index.doc_len
+        else:
+            self._binary = None
+            self.doc_ids = index["doc_ids"]
+            self.avgdl = index["avgdl"]
+            if "vocab" not in index:
+                # legacy JSON index: character lists and a term -> idf dict
+                self.vocab = Vocabulary(index["idf"])
+                self.idf = array("d", (float(v) for v in index["idf"].values()))
+                self._build_postings(
+                    [self.vocab.encode_tokens(doc) for doc in index["docs"]]
+                )
+            else:
+                self.vocab = index["vocab"]
+                self.idf = index["idf"]
+                if "postings" in index:
+                    self.postings = index["postings"]
+                    self.doc_len = index["doc_len"]
+                else:
+                    self._build_postings(index["docs"])
+        self.N = len(self.doc_ids)  # 加入缺少的 N 屬性
+
+    def _build_postings(self, docs):
+        """Build the inverted index from documents encoded as term ids.
+
+        ``postings[tid]`` holds two parallel arrays ``(doc_indexes,
+        term_freqs)`` sorted by document index, so a query only has to touch
+        the postings of its own terms.
+        """
+        postings = [(array("I"), array("I")) for _ in range(len(self.vocab))]
+        for idx, doc in enumerate(docs):
+            for tid, tf in Counter(doc).items():
+                entry = postings[tid]
+                entry[0].append(idx)
+                entry[1].append(tf)
+        self.postings = postings
+        self.doc_len = array("I", (len(doc) for doc in docs))
+
+    @cached_property
+    def norms(self):
+        """Length normalisation part of the BM25 denominator per document."""
+        k1, b, avgdl = self.k1, self.b, self.avgdl
+        if np is not None:
+            dl = np.frombuffer(self.doc_len, dtype=np.uint32)
+            return array("d", (k1 * (1 - b + b * dl / avgdl)).tobytes())
+        return array("d", (k1 * (1 - b + b * dl / avgdl) for dl in self.doc_len))
+
+    def set_statistics(self, idf, avgdl):
+        """Replace idf (indexed by term id) and avgdl, e.g. with corpus-wide values."""
+        self.idf = idf
+        self.avgdl = avgdl
+        self.__dict__.pop("norms", None)
+
     @staticmethod
     def _tokenize(text):
-        # simple character based tokenizer, remove spaces and line breaks
-        return [ch for ch in text if not ch.isspace()]
+        return tokenize(text)
 
     def score(self, query_tokens, index):
-        doc = self.docs[index]
-        freqs = Counter(doc)
+        """Score a single document (reference implementation)."""
         score = 0.0
-        for w in query_tokens:
-            if w not in self.idf:
-                continue
-            df = freqs.get(w, 0)
-            denom = df + self.k1 * (1 - self.b + self.b * len(doc) / self.avgdl)
-            score += self.idf[w] * df * (self.k1 + 1) / (denom + 1e-8)
+        for t in self.vocab.encode_tokens(query_tokens):
+            docs, tfs = self.postings[t]
+            pos = bisect_left(docs, index)
+            df = tfs[pos] if pos < len(docs) and docs[pos] == index else 0
+            denom = df + self.k1 * (1 - self.b + self.b * self.doc_len[index] / self.avgdl)
+            score += self.idf[t] * df * (self.k1 + 1) / (denom + 1e-8)
         return score
 
+    def score_all(self, term_ids):
+        """Return BM25 scores of every document using term-at-a-time accumulation.
+
+        Query term ids are processed in order (duplicates included) so each
+        document accumulates exactly the same sum as :meth:`score`.
+        """
+        scores = [0.0] * self.N
+        norms = self.norms
+        k1p1 = self.k1 + 1
+        if metrics.enabled():
+            metrics.inc("bm25_postings_scanned", sum(len(self.postings[t][0]) for t in term_ids))
+        for t in term_ids:
+            idf = self.idf[t]
+            for idx, tf in zip(*self.postings[t]):
+                scores[idx] += idf * tf * k1p1 / (tf + norms[idx] + 1e-8)
+        return scores
+
+    def query(self, text, top_k=5):
+        scores = self.score_all(self.vocab.encode(text))
+        # nlargest() is equivalent to a stable sort, so ties keep corpus order
+        ranked = heapq.nlargest(top_k, range(self.N), key=scores.__getitem__)
+        return [(scores[idx], self.doc_ids[idx]) for idx in ranked]
+
+    def query_batch(self, texts, top_k=5):
+        """Run :meth:`query` for every text and return the list of results."""
+        return [self.query(text, top_k) for text in texts]
+
+
+def csr_postings(bm25):
+    """Return the postings of ``bm25`` as CSR arrays ``(indptr, doc_indexes, tfs)``.
+
+    ``indptr`` (int64) is indexed by term id; ``doc_indexes`` and ``tfs`` are
+    uint32.  For binary indexes both are views of the memory-mapped file, so
+    only ``indptr`` (one entry per term) is copied.
+    """
+    binary = bm25._binary
+    if binary is not None:
+        # the binary index already stores postings in CSR layout
+        indptr = np.frombuffer(binary.post_ptr, dtype=np.uint64).astype(np.int64)
+        indices = np.frombuffer(binary.post_docs, dtype=np.uint32)
+        tfs = np.frombuffer(binary.post_tfs, dtype=np.uint32)
+        return indptr, indices, tfs
+    lengths = np.fromiter(
+        (len(docs) for docs, _ in bm25.postings), dtype=np.int64, count=len(bm25.postings)
+    )
+    indptr = np.zeros(len(bm25.postings) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    flat_docs, flat_tfs = array("I"), array("I")
+    for docs, tfs in bm25.postings:
+        flat_docs.extend(docs)
+        flat_tfs.extend(tfs)
+    return indptr, np.array(flat_docs, dtype=np.uint32), np.array(flat_tfs, dtype=np.uint32)
+
+
+class SparseBM25Retriever(BM25Retriever):
+    """BM25 backend scoring over the CSR postings of the index (requires NumPy).
+
+    A query is a sparse vector of term counts, so a batch of queries is scored
+    with a single sparse-dense product.  The BM25 weights of a term are
+    computed from its (memory-mapped) postings the first time a query uses
+    it and cached, so opening an index costs time and memory per term, not
+    per posting.
+    """
+
+    # upper bounds on the dense (queries x documents) block scored at once and
+    # on the postings it gathers; larger blocks only add memory traffic
+    max_block = 1 << 24
+    max_postings = 1 << 18
+
+    def __init__(self, index, k1=1.5, b=0.75):
+        if np is None:
+            raise RuntimeError("numpy is required for the sparse BM25 backend")
+        super().__init__(index, k1, b)
+        self._build_matrix()
+
+    def _build_matrix(self):
+        self.indptr, self.indices, self.tfs = csr_postings(self)
+        self._lengths = np.diff(self.indptr)
+        self._weights = {}
+
+    def set_statistics(self, idf, avgdl):
+        super().set_statistics(idf, avgdl)
+        self._weights = {}
+
+    def _term_weights(self, tid):
+        """Return ``(doc_indexes, bm25_weights)`` of term ``tid``, computed once."""
+        entry = self._weights.get(tid)
+        if entry is None:
+            start, end = self.indptr[tid], self.indptr[tid + 1]
+            docs = self.indices[start:end]
+            tfs = self.tfs[start:end].astype(np.float64)
+            norms = np.frombuffer(self.norms, dtype=np.float64)[docs]
+            weights = self.idf[tid] * tfs * (self.k1 + 1) / (tfs + norms + 1e-8)
+            entry = self._weights[tid] = (docs, weights)
+        return entry
+
+    def _query_terms(self, id_lists):
+        """Return ``(rows, term_ids, counts)`` triples of the query matrix."""
+        rows, cols, counts = [], [], []
+        for row, term_ids in enumerate(id_lists):
+            freqs = Counter(term_ids)
+            for tid, count in freqs.items():
+                rows.append(row)
+                cols.append(tid)
+                counts.append(count)
+        return (
+            np.asarray(rows, dtype=np.int64),
+            np.asarray(cols, dtype=np.int64),
+            np.asarray(counts, dtype=np.float64),
+        )
+
+    def _score_matrix(self, id_lists):
+        """Return a dense ``len(id_lists) x N`` array of BM25 scores."""
+        n_rows = len(id_lists)
+        rows, tids, counts = self._query_terms(id_lists)
+        if not len(tids):
+            return np.zeros((n_rows, self.N))
+        entries = [self._term_weights(tid) for tid in tids.tolist()]
+        lengths = np.fromiter((len(docs) for docs, _ in entries), dtype=np.int64, count=len(entries))
+        metrics.inc("bm25_postings_scanned", int(lengths.sum()))
+        docs = np.concatenate([docs for docs, _ in entries])
+        weights = np.repeat(counts, lengths) * np.concatenate([w for _, w in entries])
+        flat = np.repeat(rows, lengths) * self.N + docs
+        scores = np.bincount(flat, weights=weights, minlength=n_rows * self.N)
+        return scores.reshape(n_rows, self.N)
+
+    def _top_k(self, scores, top_k):
+        """Return indexes of the ``top_k`` best scores, ties in corpus order."""
+        k = min(top_k, self.N)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if k < self.N:
+            cand = np.argpartition(-scores, k - 1)[:k]
+            cutoff = scores[cand].min()
+            above = np.flatnonzero(scores > cutoff)
+            ties = np.flatnonzero(scores == cutoff)[: k - len(above)]
+            cand = np.concatenate([above, ties])
+        else:
+            cand = np.arange(self.N)
+        return cand[np.lexsort((cand, -scores[cand]))]
+
+    def score_all(self, term_ids):
+        return self._score_matrix([term_ids])[0].tolist()
+
     def query(self, text, top_k=5):
-        q_tokens = self._tokenize(text)
-        scores = []
-        for idx in range(self.N):
-            scores.append((self.score(q_tokens, idx), self.doc_ids[idx]))
-        scores.sort(key=lambda x: x[0], reverse=True)
-        return scores[:top_k]
+        return self.query_batch([text], top_k)[0]
+
+    def _blocks(self, id_lists):
+        """Split queries into blocks bounded by ``max_block`` and ``max_postings``."""
+        max_rows = max(1, self.max_block // max(self.N, 1))
+        block, block_postings = [], 0
+        for term_ids in id_lists:
+            tids = np.unique(np.asarray(term_ids, dtype=np.int64))
+            postings = int(self._lengths[tids].sum())
+            if block and (len(block) == max_rows or block_postings + postings > self.max_postings):
+                yield block
+                block, block_postings = [], 0
+            block.append(term_ids)
+            block_postings += postings
+        if block:
+            yield block
+
+    def query_batch(self, texts, top_k=5):
+        id_lists = [self.vocab.encode(text) for text in texts]
+        results = []
+        blocks = [id_lists] if len(id_lists) == 1 else self._blocks(id_lists)
+        for block_ids in blocks:
+            block = self._score_matrix(block_ids)
+            for scores in block:
+                results.append(
+                    [
+                        (float(scores[idx]), self.doc_ids[idx])
+                        for idx in self._top_k(scores, top_k)
+                    ]
+                )
+        return results
+
+
+def create_retriever(index, backend="auto", **kwargs):
+    """Return a retriever for ``index`` using the requested scoring backend.
+
+    ``backend`` is ``"python"``, ``"sparse"`` or ``"auto"``; the latter picks
+    the sparse backend whenever NumPy is installed.
+    """
+    if backend == "auto":
+        backend = "sparse" if np is not None else "python"
+    if backend == "sparse":
+        return SparseBM25Retriever(index, **kwargs)
+    if backend == "python":
+        return BM25Retriever(index, **kwargs)
+    raise ValueError(f"unknown BM25 backend: {backend}")
 
 def load_index(index_file):
+    """Open a binary index (memory-mapped) or load a legacy JSON index.
+
+    A directory is opened as a :class:`~segment_index.SegmentedIndex`.
+    """
+    if Path(index_file).is_dir():
+        from segment_index import SegmentedIndex
+
+        return SegmentedIndex(index_file)
+    if is_binary_index(index_file):
+        return BinaryIndex(index_file)
     with open(index_file, 'r', encoding='utf-8') as f:
         return json.load(f)
 
-def load_corpus(data_dir):
-    path = Path(data_dir) / "format" / "corpus.json"
-    with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+
+def default_index_path(name, directory="."):
+    """Return ``<name>_index.bin``, or the legacy ``.json`` index if only that exists."""
+    path = Path(directory) / f"{name}_index.bin"
+    legacy = path.with_suffix(".json")
+    if not path.exists() and legacy.exists():
+        return legacy
+    return path
+
 
 def main():
     if len(sys.argv) < 3:
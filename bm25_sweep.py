@@ -0,0 +1,365 @@
+"""BM25 hyperparameter sweep over (k1, b) and IDF variants.
+
+For every category the postings of the query terms are gathered once into
+flat arrays (query row, document, tf, term, query term count) together with
+the document lengths and document frequencies.  A configuration then costs
+one vectorized pass: recompute the length norms and weights, accumulate the
+scores with ``bincount`` and rank only the judged documents, which gives
+MRR, Recall@k and nDCG@k without sorting any result list.  Scores and tie
+order match :class:`~bm25_retrieval.BM25Retriever`.
+
+Configurations come from a grid or a random search and are spread over a
+process pool; the output is a leaderboard per category plus the best
+configurations on average over all categories.
+
+Usage::
+
+    python bm25_sweep.py --k1 0.4:2.0:0.2 --b 0:1:0.1 --idf bm25,robertson
+    python bm25_sweep.py --random 500 --categories fraud,snatch --out sweep.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from bm25_retrieval import BM25Retriever, csr_postings, load_index
+from federated_search import DATA_ROOT, discover_categories, ensure_shard_index
+from score import load_graded_qrels
+
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+
+
+def _idf_bm25(df, n):
+    # the formula used when building indexes
+    return np.log(1 + (n - df + 0.5) / (df + 0.5))
+
+
+def _idf_robertson(df, n):
+    # Robertson/Sparck Jones; negative for terms in more than half the docs
+    return np.log((n - df + 0.5) / (df + 0.5))
+
+
+def _idf_robertson_floor(df, n):
+    return np.maximum(_idf_robertson(df, n), 0.0)
+
+
+def _idf_classic(df, n):
+    return np.log(n / df)
+
+
+def _idf_none(df, n):
+    return np.ones_like(df)
+
+
+IDF_VARIANTS = {
+    "bm25": _idf_bm25,
+    "robertson": _idf_robertson,
+    "robertson_floor": _idf_robertson_floor,
+    "classic": _idf_classic,
+    "none": _idf_none,
+}
+
+
+class SweepData:
+    """Precomputed statistics of one category for fast re-scoring.
+
+    Queries are scored in blocks of at most ``max_block`` query x document
+    cells; every block keeps the gathered postings of its queries.
+    """
+
+    max_block = 1 << 24
+
+    def __init__(self, bm25: BM25Retriever, queries, qrels, ks=(1, 5, 10)):
+        self.ks = sorted(ks)
+        self.N = bm25.N
+        self.doc_len = np.asarray(bm25.doc_len, dtype=np.float64)
+        self.avgdl = bm25.avgdl
+        indptr, indices, tfs = csr_postings(bm25)
+        self.df = np.diff(indptr).astype(np.float64)
+
+        doc_index = {doc_id: i for i, doc_id in enumerate(bm25.doc_ids)}
+        queries = [q for q in queries if any(g > 0 for g in qrels.get(q["id"], {}).values())]
+        self.qids = [q["id"] for q in queries]
+        self.n_relevant = np.array(
+            [sum(g > 0 for g in qrels[qid].values()) for qid in self.qids], dtype=np.float64
+        )
+        # judged (relevant) documents found in the index
+        j_rows, j_docs, j_grades = [], [], []
+        for row, qid in enumerate(self.qids):
+            for doc_id, grade in qrels[qid].items():
+                if grade > 0 and doc_id in doc_index:
+                    j_rows.append(row)
+                    j_docs.append(doc_index[doc_id])
+                    j_grades.append(grade)
+        self.j_rows = np.asarray(j_rows, dtype=np.int64)
+        self.j_docs = np.asarray(j_docs, dtype=np.int64)
+        self.j_gain = 2.0 ** np.asarray(j_grades, dtype=np.float64) - 1
+        # share of relevant judgments whose document is in the index
+        total = self.n_relevant.sum()
+        self.coverage = len(j_rows) / total if total else 0.0
+        discounts = 1 / np.log2(np.arange(2, self.ks[-1] + 2))
+        ideal = np.zeros((len(self.qids), self.ks[-1]))
+        for row, qid in enumerate(self.qids):
+            grades = sorted((g for g in qrels[qid].values() if g > 0), reverse=True)[: self.ks[-1]]
+            ideal[row, : len(grades)] = grades
+        ideal_dcg = np.cumsum((2.0**ideal - 1) * discounts, axis=1)
+        self.idcg = {k: ideal_dcg[:, k - 1] for k in self.ks}
+
+        self.blocks = []
+        rows_per_block = max(1, self.max_block // max(self.N, 1))
+        for start in range(0, len(queries), rows_per_block):
+            block = queries[start : start + rows_per_block]
+            rows, tids, counts = [], [], []
+            for row, q in enumerate(block):
+                for tid, count in Counter(bm25.vocab.encode(q["text"])).items():
+                    rows.append(row)
+                    tids.append(tid)
+                    counts.append(count)
+            tids = np.asarray(tids, dtype=np.int64)
+            starts = indptr[tids]
+            lengths = indptr[tids + 1] - starts
+            ends = np.cumsum(lengths)
+            pos = (
+                np.arange(int(lengths.sum()))
+                - np.repeat(ends - lengths, lengths)
+                + np.repeat(starts, lengths)
+            )
+            docs = indices[pos].astype(np.int64)
+            self.blocks.append(
+                {
+                    "start": start,
+                    "rows": len(block),
+                    "flat": np.repeat(np.asarray(rows, dtype=np.int64), lengths) * self.N + docs,
+                    "docs": docs,
+                    "tfs": tfs[pos].astype(np.float64),
+                    "tids": np.repeat(tids, lengths),
+                    "counts": np.repeat(np.asarray(counts, dtype=np.float64), lengths),
+                }
+            )
+
+    @classmethod
+    def from_category(cls, category: str, data_root=DATA_ROOT, index_dir=".", ks=(1, 5, 10)):
+        fmt = Path(data_root) / category / "format"
+        with open(fmt / "queries.json", "r", encoding="utf-8") as f:
+            queries = json.load(f)
+        qrels = load_graded_qrels(str(fmt / "qrels.json"))
+        bm25 = BM25Retriever(load_index(ensure_shard_index(category, data_root, index_dir)))
+        return cls(bm25, queries, qrels, ks)
+
+    def _judged_ranks(self, k1: float, b: float, idf: np.ndarray) -> np.ndarray:
+        """Return the 1-based rank of every judged document (ties in corpus order)."""
+        norms = k1 * (1 - b + b * self.doc_len / self.avgdl)
+        ranks = np.empty(len(self.j_rows), dtype=np.int64)
+        for block in self.blocks:
+            weights = (
+                idf[block["tids"]]
+                * block["counts"]
+                * block["tfs"]
+                * (k1 + 1)
+                / (block["tfs"] + norms[block["docs"]] + 1e-8)
+            )
+            scores = np.bincount(block["flat"], weights=weights, minlength=block["rows"] * self.N)
+            scores = scores.reshape(block["rows"], self.N)
+            sel = (self.j_rows >= block["start"]) & (self.j_rows < block["start"] + block["rows"])
+            rows = self.j_rows[sel] - block["start"]
+            docs = self.j_docs[sel]
+            row_scores = scores[rows]
+            own = row_scores[np.arange(len(rows)), docs][:, None]
+            before = np.arange(self.N)[None, :] < docs[:, None]
+            ranks[sel] = (
+                (row_scores > own).sum(axis=1) + ((row_scores == own) & before).sum(axis=1) + 1
+            )
+        return ranks
+
+    def evaluate(
+        self, k1: float, b: float, idf_variant: str = "bm25", depth: int = 10
+    ) -> Dict[str, float]:
+        """Return MRR@depth, Recall@k and nDCG@k averaged over the judged queries."""
+        idf = IDF_VARIANTS[idf_variant](np.maximum(self.df, 1.0), float(self.N))
+        ranks = self._judged_ranks(k1, b, idf)
+        n_queries = len(self.qids)
+        if not n_queries:
+            return {}
+        rr = np.zeros(n_queries)
+        np.maximum.at(rr, self.j_rows, np.where(ranks <= depth, 1.0 / ranks, 0.0))
+        result = {f"MRR@{depth}": float(rr.mean())}
+        for k in self.ks:
+            hit = ranks <= k
+            found = np.bincount(self.j_rows, weights=hit.astype(np.float64), minlength=n_queries)
+            result[f"Recall@{k}"] = float((found / self.n_relevant).mean())
+        for k in self.ks:
+            gains = np.where(ranks <= k, self.j_gain / np.log2(ranks + 1), 0.0)
+            dcg = np.bincount(self.j_rows, weights=gains, minlength=n_queries)
+            result[f"nDCG@{k}"] = float((dcg / self.idcg[k]).mean())
+        return result
+
+
+def parse_range(text: str) -> List[float]:
+    """Parse ``"a,b,c"`` or an inclusive ``"start:stop:step"`` range."""
+    if ":" in text:
+        start, stop, step = (float(x) for x in text.split(":"))
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        return [round(start + i * step, 10) for i in range(count)]
+    return [float(x) for x in text.split(",") if x]
+
+
+def build_configs(args) -> List[Tuple[float, float, str]]:
+    k1s, bs = parse_range(args.k1), parse_range(args.b)
+    idfs = [v for v in args.idf.split(",") if v]
+    unknown = [v for v in idfs if v not in IDF_VARIANTS]
+    if unknown:
+        raise SystemExit(f"unknown IDF variants: {', '.join(unknown)}; expected {list(IDF_VARIANTS)}")
+    if args.random:
+        rng = random.Random(args.seed)
+        configs = [
+            (
+                round(rng.uniform(min(k1s), max(k1s)), 4),
+                round(rng.uniform(min(bs), max(bs)), 4),
+                rng.choice(idfs),
+            )
+            for _ in range(args.random)
+        ]
+    else:
+        configs = [(k1, b, idf) for idf in idfs for k1 in k1s for b in bs]
+    if (DEFAULT_K1, DEFAULT_B, "bm25") not in configs:
+        configs.append((DEFAULT_K1, DEFAULT_B, "bm25"))  # always report the default
+    return configs
+
+
+# per-process datasets of the pool workers
+_DATA: Dict[str, SweepData] = {}
+
+
+def _init_worker(data):
+    _DATA.update(data)
+
+
+def _evaluate_chunk(category, configs, depth):
+    data = _DATA[category]
+    return [(config, data.evaluate(*config, depth=depth)) for config in configs]
+
+
+def run_sweep(data: Dict[str, SweepData], configs, depth=10, workers=1, chunk_size=64):
+    """Evaluate ``configs`` on every category; returns ``category -> [(config, metrics)]``."""
+    tasks = [
+        (category, configs[i : i + chunk_size])
+        for category in data
+        for i in range(0, len(configs), chunk_size)
+    ]
+    results: Dict[str, list] = {category: [] for category in data}
+    if workers <= 1:
+        _DATA.update(data)
+        for category, chunk in tasks:
+            results[category] += _evaluate_chunk(category, chunk, depth)
+        return results
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(data,)) as pool:
+        futures = [(c, pool.submit(_evaluate_chunk, c, chunk, depth)) for c, chunk in tasks]
+        for category, future in futures:
+            results[category] += future.result()
+    return results
+
+
+def leaderboard(rows, metric: str):
+    return sorted(rows, key=lambda r: (-r[1].get(metric, 0.0), r[0]))
+
+
+def _format_row(rank, config, metrics, columns):
+    k1, b, idf = config
+    default = " *" if config == (DEFAULT_K1, DEFAULT_B, "bm25") else ""
+    values = "".join(f"{metrics.get(c, 0.0):>11.4f}" for c in columns)
+    return f"{rank:>5}  {k1:>6.3f} {b:>6.3f}  {idf:<16}{values}{default}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep BM25 k1, b and IDF variants")
+    parser.add_argument("--categories", default=None, help="comma separated categories")
+    parser.add_argument("--data-root", default=str(DATA_ROOT))
+    parser.add_argument("--index-dir", default=".")
+    parser.add_argument("--k1", default="0.2:3.0:0.2", help="list a,b,c or range start:stop:step")
+    parser.add_argument("--b", default="0:1:0.05", help="list a,b,c or range start:stop:step")
+    parser.add_argument("--idf", default="bm25", help=f"comma separated from {','.join(IDF_VARIANTS)}")
+    parser.add_argument("--random", type=int, default=0, help="sample N configs in the k1/b bounds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--depth", type=int, default=10, help="MRR cutoff")
+    parser.add_argument("--k", default="1,5,10", help="Recall/nDCG cutoffs")
+    parser.add_argument("--metric", default=None, help="leaderboard metric (default MRR@depth)")
+    parser.add_argument("--top", type=int, default=10, help="leaderboard rows per category")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--out", default=None, help="write every result to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.categories:
+        categories = args.categories.split(",")
+    else:
+        categories = discover_categories(args.data_root)
+    ks = [int(k) for k in args.k.split(",") if k]
+    metric = args.metric or f"MRR@{args.depth}"
+    configs = build_configs(args)
+
+    start = time.perf_counter()
+    data = {
+        c: SweepData.from_category(c, args.data_root, args.index_dir, ks)
+        for c in categories
+        if (Path(args.data_root) / c / "format" / "qrels.json").exists()
+    }
+    prepared = time.perf_counter()
+    results = run_sweep(data, configs, args.depth, args.workers)
+    elapsed = time.perf_counter() - prepared
+    print(
+        f"{len(configs)} configs x {len(data)} categories in {elapsed:.2f}s "
+        f"(precompute {prepared - start:.2f}s, {args.workers} workers)"
+    )
+
+    columns = [f"MRR@{args.depth}"] + [f"Recall@{k}" for k in ks] + [f"nDCG@{ks[-1]}"]
+    header = f"{'rank':>5}  {'k1':>6} {'b':>6}  {'idf':<16}" + "".join(f"{c:>11}" for c in columns)
+    for category, rows in results.items():
+        ranked = leaderboard(rows, metric)
+        print(
+            f"\n{category} ({len(data[category].qids)} queries, "
+            f"qrels coverage {data[category].coverage:.0%}, by {metric}; * = default)"
+        )
+        print(header)
+        for rank, (config, metrics) in enumerate(ranked[: args.top], 1):
+            print(_format_row(rank, config, metrics, columns))
+        for rank, (config, metrics) in enumerate(ranked, 1):
+            if config == (DEFAULT_K1, DEFAULT_B, "bm25") and rank > args.top:
+                print(_format_row(rank, config, metrics, columns))
+
+    # configurations are shared by all categories: rank them by the mean over
+    # the categories whose judged documents are indexed
+    covered = [c for c in results if data[c].coverage > 0]
+    mean_rows = []
+    for i, config in enumerate(configs):
+        per_category = [results[c][i][1] for c in covered]
+        means = {c: sum(m.get(c, 0.0) for m in per_category) / len(per_category) for c in columns}
+        mean_rows.append((config, means))
+    if len(covered) > 1:
+        print(f"\nmean over {len(covered)} categories: {', '.join(covered)} (by {metric})")
+        print(header)
+        for rank, (config, metrics) in enumerate(leaderboard(mean_rows, metric)[: args.top], 1):
+            print(_format_row(rank, config, metrics, columns))
+
+    if args.out:
+        report = {
+            "metric": metric,
+            "configs": len(configs),
+            "results": {
+                c: [{"k1": k1, "b": b, "idf": idf, **m} for (k1, b, idf), m in rows]
+                for c, rows in results.items()
+            },
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
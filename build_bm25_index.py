@@ -1,56 +1,352 @@
 """Build BM25 index for dataset.
 
 Usage:
-    python build_bm25_index.py DATA_DIR OUTPUT_INDEX
+    python build_bm25_index.py SOURCE OUTPUT_INDEX [--format {binary,json}] [--vocab FILE]
+                               [--workers N] [--stream [--run-size N]]
 
-DATA_DIR should contain format/corpus.json.
+SOURCE is a dataset directory (format/corpus.json, or the raw sample_500.json
+/ *_judgment_summary.json when no corpus.json exists) or a corpus file
+(JSON array or JSON Lines).  The index is written in the memory-mapped
+binary format unless OUTPUT_INDEX ends with ``.json`` or ``--format json`` is
+given.  ``--vocab`` reuses (and extends) a persisted
+vocabulary so term ids stay stable across builds.  ``--workers`` tokenizes
+the corpus in a process pool; the output is byte-identical to a
+single-process build.  ``--stream`` indexes with bounded memory: documents
+are read one at a time, postings are spilled to disk in sorted runs and
+merged at the end.
 """
+import argparse
+import heapq
 import json
 import math
+import os
+import struct
+import tempfile
+from array import array
 from collections import Counter
-import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from bm25_index_format import IndexFileWriter, write_index_file
+from corpus_io import iter_corpus, load_corpus
+from tokenizer import Vocabulary, tokenize  # noqa: F401 - tokenize re-exported
 
-def tokenize(text):
-    """Very simple character tokenizer."""
-    return [ch for ch in text if not ch.isspace()]
 
+def build_index(corpus, vocab=None, workers=1, keep_docs=True):
+    """Build an in-memory index with documents stored as term id arrays.
 
-def load_corpus(data_dir: str):
-    path = Path(data_dir) / "format" / "corpus.json"
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
-def build_index(corpus):
+    ``idf`` is an ``array('d')`` indexed by term id of ``vocab`` (a fresh
+    :class:`Vocabulary` unless one is given).  With ``workers > 1`` the
+    corpus is indexed by :func:`build_index_parallel`.
+    """
+    if workers > 1:
+        return build_index_parallel(corpus, vocab, workers, keep_docs)
+    vocab = Vocabulary() if vocab is None else vocab
     doc_ids = [doc["id"] for doc in corpus]
-    docs = [tokenize(doc["text"]) for doc in corpus]
+    docs = [vocab.encode(doc["text"], add=True) for doc in corpus]
     N = len(docs)
     avgdl = sum(len(d) for d in docs) / N
-    df = Counter()
+    df = array("I", bytes(4 * len(vocab)))
     for doc in docs:
-        for w in set(doc):
-            df[w] += 1
-    idf = {w: math.log(1 + (N - df_w + 0.5) / (df_w + 0.5)) for w, df_w in df.items()}
+        for t in set(doc):
+            df[t] += 1
+    idf = array("d", (math.log(1 + (N - df_w + 0.5) / (df_w + 0.5)) for df_w in df))
     return {
         "doc_ids": doc_ids,
+        "vocab": vocab,
         "docs": docs,
         "idf": idf,
         "avgdl": avgdl,
     }
 
 
+def _index_chunk(args):
+    """Worker: tokenize a contiguous chunk into chunk-local term ids.
+
+    Returns the chunk vocabulary (in first-occurrence order), postings with
+    global document indexes, document lengths and, optionally, the encoded
+    documents.
+    """
+    texts, base, keep_docs = args
+    vocab = Vocabulary()
+    postings = []
+    doc_len = array("I")
+    docs = []
+    for offset, text in enumerate(texts):
+        doc = vocab.encode(text, add=True)
+        doc_len.append(len(doc))
+        if keep_docs:
+            docs.append(doc)
+        for tid, tf in Counter(doc).items():
+            if tid == len(postings):
+                postings.append((array("I"), array("I")))
+            entry = postings[tid]
+            entry[0].append(base + offset)
+            entry[1].append(tf)
+    return vocab.terms, postings, doc_len, docs
+
+
+def build_index_parallel(corpus, vocab=None, workers=None, keep_docs=True):
+    """Build the index of :func:`build_index` across a process pool.
+
+    The corpus is split into contiguous chunks; each worker tokenizes its
+    chunk and builds partial postings and document frequencies.  Chunks are
+    merged in corpus order, which assigns global term ids in first-occurrence
+    order exactly like a single-process build.
+    """
+    workers = workers or os.cpu_count() or 1
+    vocab = Vocabulary() if vocab is None else vocab
+    doc_ids = [doc["id"] for doc in corpus]
+    N = len(corpus)
+    size = max(1, -(-N // (workers * 4)))
+    tasks = [
+        ([doc["text"] for doc in corpus[start : start + size]], start, keep_docs)
+        for start in range(0, N, size)
+    ]
+
+    postings = [(array("I"), array("I")) for _ in range(len(vocab))]
+    doc_len = array("I")
+    docs = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for terms, part, part_len, part_docs in pool.map(_index_chunk, tasks):
+            table = [vocab.add(w) for w in terms]
+            while len(postings) < len(vocab):
+                postings.append((array("I"), array("I")))
+            for local, (part_docs_idx, part_tfs) in enumerate(part):
+                entry = postings[table[local]]
+                entry[0].extend(part_docs_idx)
+                entry[1].extend(part_tfs)
+            doc_len.extend(part_len)
+            docs.extend(array("I", map(table.__getitem__, doc)) for doc in part_docs)
+
+    avgdl = sum(doc_len) / N
+    idf = array(
+        "d",
+        (math.log(1 + (N - len(p[0]) + 0.5) / (len(p[0]) + 0.5)) for p in postings),
+    )
+    index = {
+        "doc_ids": doc_ids,
+        "vocab": vocab,
+        "idf": idf,
+        "avgdl": avgdl,
+        "postings": postings,
+        "doc_len": doc_len,
+    }
+    if keep_docs:
+        index["docs"] = docs
+    return index
+
+
+# run files: (term id, postings count) followed by doc indexes and tfs
+_RUN_HEADER = struct.Struct("=II")
+
+
+def _spill_run(postings, path):
+    """Write buffered postings, sorted by term id, as one run file."""
+    with open(path, "wb") as f:
+        for tid in sorted(postings):
+            docs, tfs = postings[tid]
+            f.write(_RUN_HEADER.pack(tid, len(docs)))
+            docs.tofile(f)
+            tfs.tofile(f)
+
+
+def _iter_run(path):
+    """Yield ``(term id, doc indexes, tfs)`` blocks of a run file."""
+    with open(path, "rb") as f:
+        while True:
+            head = f.read(_RUN_HEADER.size)
+            if not head:
+                return
+            tid, n = _RUN_HEADER.unpack(head)
+            docs, tfs = array("I"), array("I")
+            docs.fromfile(f, n)
+            tfs.fromfile(f, n)
+            yield tid, docs, tfs
+
+
+def _copy_section(writer, name, path, typecode, chunk=1 << 20):
+    """Stream a temporary array file into an index section."""
+    writer.begin_section(name)
+    with open(path, "rb") as f:
+        while True:
+            data = array(typecode)
+            try:
+                data.fromfile(f, chunk)
+            except EOFError:
+                pass
+            if not data:
+                break
+            writer.write(data)
+    writer.end_section()
+
+
+def build_index_streaming(records, out_file, vocab=None, run_size=1_000_000, tmp_dir=None):
+    """Write a binary index from a record stream with bounded memory.
+
+    At most ``run_size`` postings are buffered; each full buffer is spilled to
+    a temporary run file sorted by term id and all runs are k-way merged at
+    the end.  Only the vocabulary and per-term counters stay in memory, and
+    the output is byte-identical to ``save_index(build_index(...))``.
+    """
+    vocab = Vocabulary() if vocab is None else vocab
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        tmp = Path(tmp)
+        runs = []
+        postings = {}
+        buffered = 0
+        ids_buf, len_buf = array("q"), array("I")
+        n_docs = 0
+        total_len = 0
+
+        with open(tmp / "doc_ids", "wb") as ids_f, open(tmp / "doc_len", "wb") as len_f:
+
+            def spill():
+                nonlocal postings, buffered
+                if postings:
+                    runs.append(tmp / f"run{len(runs):05d}")
+                    _spill_run(postings, runs[-1])
+                ids_buf.tofile(ids_f)
+                len_buf.tofile(len_f)
+                del ids_buf[:], len_buf[:]
+                postings = {}
+                buffered = 0
+
+            for record in records:
+                doc = vocab.encode(record["text"], add=True)
+                ids_buf.append(int(record["id"]))
+                len_buf.append(len(doc))
+                for tid, tf in Counter(doc).items():
+                    entry = postings.get(tid)
+                    if entry is None:
+                        entry = postings[tid] = (array("I"), array("I"))
+                    entry[0].append(n_docs)
+                    entry[1].append(tf)
+                    buffered += 1
+                n_docs += 1
+                total_len += len(doc)
+                if buffered >= run_size or len(ids_buf) >= run_size:
+                    spill()
+            spill()
+        if n_docs == 0:
+            raise ValueError("cannot index an empty corpus")
+
+        # merge runs term by term; equal term ids come out in run (= doc) order
+        df = array("I", bytes(4 * len(vocab)))
+        with open(tmp / "post_docs", "wb") as docs_f, open(tmp / "post_tfs", "wb") as tfs_f:
+            merged = heapq.merge(*(_iter_run(path) for path in runs), key=lambda run: run[0])
+            for tid, docs, tfs in merged:
+                df[tid] += len(docs)
+                docs.tofile(docs_f)
+                tfs.tofile(tfs_f)
+
+        N = n_docs
+        idf = array("d", (math.log(1 + (N - df_w + 0.5) / (df_w + 0.5)) for df_w in df))
+        post_ptr = array("Q", [0])
+        for df_w in df:
+            post_ptr.append(post_ptr[-1] + df_w)
+        writer = IndexFileWriter(out_file)
+        try:
+            _copy_section(writer, "doc_ids", tmp / "doc_ids", "q")
+            _copy_section(writer, "doc_len", tmp / "doc_len", "I")
+            writer.write_vocabulary(vocab.terms)
+            writer.write_section("df", df)
+            writer.write_section("idf", idf)
+            writer.write_section("post_ptr", post_ptr)
+            _copy_section(writer, "post_docs", tmp / "post_docs", "I")
+            _copy_section(writer, "post_tfs", tmp / "post_tfs", "I")
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close(N, len(vocab), post_ptr[-1], total_len, total_len / N)
+    return vocab
+
+
+def to_legacy_json(index):
+    """Convert an index to the original JSON layout (character lists, idf dict)."""
+    vocab = index["vocab"]
+    seen = set()
+    for doc in index["docs"]:
+        seen.update(doc)
+    return {
+        "doc_ids": index["doc_ids"],
+        "docs": [vocab.decode(doc) for doc in index["docs"]],
+        "idf": {vocab.terms[t]: index["idf"][t] for t in sorted(seen)},
+        "avgdl": index["avgdl"],
+    }
+
+
+def save_index(index, out_file, fmt=None):
+    """Write ``index`` as ``binary`` or legacy ``json`` (chosen by suffix if unset)."""
+    if fmt is None:
+        fmt = "json" if Path(out_file).suffix == ".json" else "binary"
+    if fmt == "json":
+        with open(out_file, "w", encoding="utf-8") as f:
+            json.dump(to_legacy_json(index), f, ensure_ascii=False)
+    elif fmt == "binary":
+        write_index_file(index, out_file)
+    else:
+        raise ValueError(f"unknown index format: {fmt}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build a BM25 index for a dataset")
+    parser.add_argument("source", help="dataset directory or corpus file (.json / .jsonl)")
+    parser.add_argument("out_file", help="path of the index file to write")
+    parser.add_argument(
+        "--format",
+        choices=["binary", "json"],
+        default=None,
+        help="index file format (default: json for *.json, otherwise binary)",
+    )
+    parser.add_argument(
+        "--vocab",
+        default=None,
+        help="vocabulary file to reuse and update with new terms",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes (0 = one per CPU core)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="index with bounded memory by spilling sorted postings runs to disk",
+    )
+    parser.add_argument(
+        "--run-size",
+        type=int,
+        default=1_000_000,
+        help="postings buffered in memory before a run is spilled (with --stream)",
+    )
+    return parser.parse_args()
+
+
 def main():
-    if len(sys.argv) < 3:
-        print(__doc__)
-        return
-    data_dir, out_file = sys.argv[1], sys.argv[2]
-    corpus = load_corpus(data_dir)
-    index = build_index(corpus)
-    with open(out_file, "w", encoding="utf-8") as f:
-        json.dump(index, f, ensure_ascii=False)
-    print(f"Index saved to {out_file}")
+    args = parse_args()
+    vocab = None
+    if args.vocab and Path(args.vocab).exists():
+        vocab = Vocabulary.load(args.vocab)
+    fmt = args.format
+    if fmt is None:
+        fmt = "json" if Path(args.out_file).suffix == ".json" else "binary"
+    if args.stream:
+        if fmt != "binary":
+            raise SystemExit("--stream only writes the binary index format")
+        vocab = build_index_streaming(
+            iter_corpus(args.source), args.out_file, vocab, run_size=args.run_size
+        )
+    else:
+        corpus = load_corpus(args.source)
+        workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+        index = build_index(corpus, vocab, workers=workers, keep_docs=fmt == "json")
+        save_index(index, args.out_file, fmt)
+        vocab = index["vocab"]
+    if args.vocab:
+        vocab.save(args.vocab)
+    print(f"Index saved to {args.out_file}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,258 @@
+"""Streaming readers for the dataset files.
+
+All readers yield one record at a time and never hold the whole file in
+memory, so corpora can grow well beyond RAM.  :func:`iter_corpus` accepts
+``format/corpus.json``, JSON Lines files and the raw ``sample_500.json`` /
+``*_judgment_summary.json`` dumps, and normalises every record to
+``{"id": int, "text": str}``.
+"""
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+# fields holding the full judgment text in the raw dumps ("judgement" in fraud)
+TEXT_FIELDS = ("text", "judgment", "judgement")
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+# sidecar offset index: magic, source size, source mtime_ns, record count,
+# followed by (start, end) byte offsets of every record as uint64 pairs
+OFFSETS_SUFFIX = ".offsets"
+_OFFSETS_MAGIC = b"Q2DOFF1\x00"
+_OFFSETS_HEADER = struct.Struct("<8sQQQ")
+_STRUCTURE = re.compile(rb'[\[\]{}"]')
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+
+
+def iter_json_array(path, chunk_size: int = 1 << 16) -> Iterator[object]:
+    """Yield the elements of a top-level JSON array without loading the file."""
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        eof = False
+        started = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos >= len(buf):
+                if eof:
+                    raise ValueError(f"{path}: unexpected end of JSON array")
+                fill()
+                continue
+            ch = buf[pos]
+            if not started:
+                if ch != "[":
+                    raise ValueError(f"{path}: expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if ch == "]":
+                return
+            if ch == ",":
+                pos += 1
+                continue
+            try:
+                value, end = _DECODER.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if end == len(buf) and not eof:
+                # a scalar may continue in the next chunk; decode it again
+                fill()
+                continue
+            pos = end
+            yield value
+
+
+def iter_jsonl(path) -> Iterator[object]:
+    """Yield the records of a JSON Lines file."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def normalize_record(record: Dict[str, object], position: int) -> Dict[str, object]:
+    """Return ``{"id", "text"}`` for a corpus or raw judgment record."""
+    doc_id = record.get("id", position)
+    if isinstance(doc_id, str) and doc_id.isdigit():
+        doc_id = int(doc_id)
+    for field in TEXT_FIELDS:
+        if field in record:
+            return {"id": doc_id, "text": record[field] or ""}
+    raise KeyError(f"record {doc_id} has none of the text fields {TEXT_FIELDS}")
+
+
+def resolve_corpus_path(source) -> Path:
+    """Return the corpus file for a dataset directory or file path.
+
+    A dataset directory resolves to ``format/corpus.json`` if present, then
+    ``sample_500.json``, then the ``*_judgment_summary.json`` file.
+    """
+    path = Path(source)
+    if not path.is_dir():
+        return path
+    candidates = [path / "format" / "corpus.json", path / "sample_500.json"]
+    candidates += sorted(path.glob("*_judgment_summary.json"))
+    for candidate in candidates:
+        if candidate.exists():
+            return candidate
+    raise FileNotFoundError(f"no corpus file found in {path}")
+
+
+def iter_corpus(source) -> Iterator[Dict[str, object]]:
+    """Stream ``{"id", "text"}`` records from a dataset directory or file."""
+    path = resolve_corpus_path(source)
+    records = iter_jsonl(path) if path.suffix == ".jsonl" else iter_json_array(path)
+    for position, record in enumerate(records):
+        yield normalize_record(record, position)
+
+
+def load_corpus(source) -> List[Dict[str, object]]:
+    """Materialize :func:`iter_corpus` as a list."""
+    return list(iter_corpus(source))
+
+
+def scan_record_offsets(path) -> array:
+    """Return flat ``(start, end)`` byte offsets of the records of ``path``.
+
+    ``path`` is a JSON array of objects/arrays or a JSON Lines file.  The scan
+    only tracks brackets and skips string literals, so it never decodes the
+    records themselves.
+    """
+    offsets = array("Q")
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return offsets
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if Path(path).suffix == ".jsonl":
+                start = 0
+                size = len(data)
+                while start < size:
+                    end = data.find(b"\n", start)
+                    end = size if end < 0 else end
+                    if data[start:end].strip():
+                        offsets.extend((start, end))
+                    start = end + 1
+                return offsets
+            pos = data.find(b"[")
+            if pos < 0:
+                raise ValueError(f"{path}: expected a JSON array")
+            pos += 1
+            depth = 0
+            start = 0
+            while True:
+                m = _STRUCTURE.search(data, pos)
+                if m is None:
+                    raise ValueError(f"{path}: unexpected end of JSON array")
+                ch = m.group()
+                if ch == b'"':
+                    string = _STRING.match(data, m.start())
+                    if string is None:
+                        raise ValueError(f"{path}: unterminated string")
+                    pos = string.end()
+                    continue
+                pos = m.end()
+                if ch in b"[{":
+                    if depth == 0:
+                        start = m.start()
+                    depth += 1
+                elif depth == 0:
+                    return offsets  # closing bracket of the top-level array
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        offsets.extend((start, pos))
+
+
+class RecordFile:
+    """Random access to the records of a JSON array / JSON Lines file.
+
+    Record byte offsets are kept in a sidecar ``<file>.offsets`` written once
+    and rebuilt when the source file changes, so :meth:`read` seeks to and
+    decodes only the requested records and ``len()`` is O(1).
+    """
+
+    def __init__(self, path, sidecar=None):
+        self.path = Path(path)
+        self.sidecar = Path(sidecar) if sidecar else self.path.with_name(self.path.name + OFFSETS_SUFFIX)
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._offsets = array("Q")
+
+    def _source_stamp(self):
+        st = os.stat(self.path)
+        return st.st_size, st.st_mtime_ns
+
+    def _load_sidecar(self, stamp) -> Optional[array]:
+        try:
+            with open(self.sidecar, "rb") as f:
+                magic, size, mtime_ns, count = _OFFSETS_HEADER.unpack(f.read(_OFFSETS_HEADER.size))
+                if magic != _OFFSETS_MAGIC or (size, mtime_ns) != stamp:
+                    return None
+                offsets = array("Q")
+                offsets.frombytes(f.read())
+        except (OSError, struct.error):
+            return None
+        return offsets if len(offsets) == 2 * count else None
+
+    def _write_sidecar(self, stamp, offsets) -> None:
+        tmp = self.sidecar.with_name(self.sidecar.name + ".tmp")
+        try:
+            with open(tmp, "wb") as f:
+                f.write(_OFFSETS_HEADER.pack(_OFFSETS_MAGIC, *stamp, len(offsets) // 2))
+                f.write(offsets.tobytes())
+            os.replace(tmp, self.sidecar)
+        except OSError:
+            pass  # read-only location: keep the offsets in memory only
+
+    def _current(self) -> array:
+        stamp = self._source_stamp()
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    offsets = self._load_sidecar(stamp)
+                    if offsets is None:
+                        offsets = scan_record_offsets(self.path)
+                        self._write_sidecar(stamp, offsets)
+                    self._offsets = offsets
+                    self._stamp = stamp
+        return self._offsets
+
+    def __len__(self) -> int:
+        return len(self._current()) // 2
+
+    def read(self, offset: int = 0, limit: Optional[int] = None) -> List[object]:
+        """Decode records ``offset .. offset + limit`` (all remaining if no limit)."""
+        offsets = self._current()
+        total = len(offsets) // 2
+        offset = max(offset, 0)
+        stop = total if limit is None else min(total, offset + limit)
+        if offset >= stop:
+            return []
+        base = offsets[2 * offset]
+        with open(self.path, "rb") as f:
+            f.seek(base)
+            data = f.read(offsets[2 * stop - 1] - base)
+        return [
+            json.loads(data[offsets[2 * i] - base : offsets[2 * i + 1] - base])
+            for i in range(offset, stop)
+        ]
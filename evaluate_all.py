@@ -0,0 +1,239 @@
+"""Evaluate BM25 on every dataset category and write one consolidated report.
+
+Categories are the ``data/*/format`` directories.  Each category runs in its
+own worker process: it builds its index if missing (from ``corpus.json`` or,
+for fraud and forgery, the ``*_judgment_summary.json`` dump), runs all
+queries as one batch and scores them with :mod:`evaluation`.  The report
+holds per-category metrics, qrels coverage (share of relevant documents
+present in the indexed corpus), timings and macro averages, as JSON and
+Markdown.
+
+Usage::
+
+    python evaluate_all.py --out reports/bm25 --workers 4
+"""
+import argparse
+import json
+import os
+import platform
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+from bm25_retrieval import create_retriever, default_index_path, load_index
+from corpus_io import resolve_corpus_path
+from evaluation import Evaluator
+from federated_search import DATA_ROOT, discover_categories, ensure_shard_index
+from score import load_graded_qrels
+
+DEFAULT_KS = (1, 5, 10)
+
+
+def evaluate_category(
+    category: str,
+    data_root=DATA_ROOT,
+    index_dir=".",
+    top_k: int = 10,
+    ks=DEFAULT_KS,
+    backend: str = "auto",
+    rebuild: bool = False,
+    runs_dir=None,
+) -> Dict[str, object]:
+    """Build or load the index of ``category`` and evaluate all its queries."""
+    data_dir = Path(data_root) / category
+    fmt = data_dir / "format"
+    timings = {}
+
+    start = time.perf_counter()
+    Path(index_dir).mkdir(parents=True, exist_ok=True)
+    stale = default_index_path(category, index_dir)
+    if rebuild and stale.exists():
+        stale.unlink()
+    built = not stale.exists()
+    # a removed legacy .json index is rebuilt as .bin, so use the returned path
+    index_path = ensure_shard_index(category, data_root, index_dir)
+    timings["index_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bm25 = create_retriever(load_index(index_path), backend=backend)
+    timings["load_s"] = time.perf_counter() - start
+
+    with open(fmt / "queries.json", "r", encoding="utf-8") as f:
+        queries = json.load(f)
+    graded = load_graded_qrels(str(fmt / "qrels.json"))
+
+    start = time.perf_counter()
+    batch = bm25.query_batch([q["text"] for q in queries], top_k)
+    timings["query_s"] = time.perf_counter() - start
+    run = {q["id"]: [doc_id for _, doc_id in results] for q, results in zip(queries, batch)}
+
+    start = time.perf_counter()
+    # Success@top_k is the legacy Accuracy
+    ks = sorted(set(ks) | {top_k})
+    means = Evaluator(graded, ks).evaluate({"bm25": run}, depth=top_k).means()["bm25"]
+    timings["score_s"] = time.perf_counter() - start
+
+    indexed = set(bm25.doc_ids)
+    relevant = [(qid, d) for qid, docs in graded.items() for d, g in docs.items() if g > 0]
+    found = sum(d in indexed for _, d in relevant)
+
+    if runs_dir is not None:
+        Path(runs_dir).mkdir(parents=True, exist_ok=True)
+        with open(Path(runs_dir) / f"{category}.json", "w", encoding="utf-8") as f:
+            json.dump([{"qid": qid, "docids": docs} for qid, docs in run.items()], f)
+
+    return {
+        "category": category,
+        "corpus": str(resolve_corpus_path(data_dir)),
+        "index": str(index_path),
+        "index_built": built,
+        "docs": bm25.N,
+        "queries": len(queries),
+        "relevant": len(relevant),
+        "qrels_coverage": found / len(relevant) if relevant else 0.0,
+        "metrics": means,
+        "timings": timings,
+        "qps": len(queries) / timings["query_s"] if timings["query_s"] else 0.0,
+    }
+
+
+def _safe_evaluate(category, kwargs):
+    try:
+        return evaluate_category(category, **kwargs)
+    except Exception as e:
+        return {
+            "category": category,
+            "error": f"{type(e).__name__}: {e}",
+            "trace": traceback.format_exc(),
+        }
+
+
+def run_all(categories: List[str], workers: int, **kwargs) -> List[Dict[str, object]]:
+    """Evaluate ``categories`` in parallel; failures are reported, not raised."""
+    if workers <= 1 or len(categories) <= 1:
+        return [_safe_evaluate(c, kwargs) for c in categories]
+    with ProcessPoolExecutor(min(workers, len(categories))) as pool:
+        futures = [pool.submit(_safe_evaluate, c, kwargs) for c in categories]
+        return [f.result() for f in futures]
+
+
+def macro_average(results: List[Dict[str, object]]) -> Dict[str, float]:
+    if not results:
+        return {}
+    names = results[0]["metrics"]
+    return {m: sum(r["metrics"][m] for r in results) / len(results) for m in names}
+
+
+def build_report(results, args, elapsed: float) -> Dict[str, object]:
+    ok = [r for r in results if "error" not in r]
+    covered = [r for r in ok if r["qrels_coverage"] >= 1.0]
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "backend": args.backend,
+            "top_k": args.top_k,
+            "workers": args.workers,
+            "elapsed_s": elapsed,
+        },
+        "categories": {r["category"]: r for r in results},
+        "macro": macro_average(ok),
+        # categories whose qrels point outside the indexed corpus drag the
+        # plain macro average down, so report the fully covered ones as well
+        "macro_covered": macro_average(covered),
+        "covered_categories": [r["category"] for r in covered],
+    }
+
+
+def to_markdown(report: Dict[str, object]) -> str:
+    categories = report["categories"]
+    ok = [r for r in categories.values() if "error" not in r]
+    metric_names = list(ok[0]["metrics"]) if ok else []
+    lines = [
+        "# BM25 evaluation",
+        "",
+        f"{report['meta']['timestamp']} · backend `{report['meta']['backend']}` · "
+        f"top_k {report['meta']['top_k']} · {report['meta']['workers']} workers · "
+        f"{report['meta']['elapsed_s']:.2f}s",
+        "",
+        "| category | docs | queries | coverage | "
+        + " | ".join(metric_names)
+        + " | index s | query s | qps |",
+        "|---" * (len(metric_names) + 7) + "|",
+    ]
+    for r in ok:
+        values = " | ".join(f"{r['metrics'][m]:.4f}" for m in metric_names)
+        t = r["timings"]
+        built = " (built)" if r["index_built"] else ""
+        lines.append(
+            f"| {r['category']} | {r['docs']} | {r['queries']} | {r['qrels_coverage']:.0%} "
+            f"| {values} | {t['index_s']:.2f}{built} | {t['query_s']:.3f} | {r['qps']:.0f} |"
+        )
+    for label, key in (("macro", "macro"), ("macro (covered)", "macro_covered")):
+        if report[key]:
+            values = " | ".join(f"{report[key][m]:.4f}" for m in metric_names)
+            lines.append(f"| **{label}** | | | | {values} | | | |")
+    partial = [r for r in ok if r["qrels_coverage"] < 1.0]
+    if partial:
+        lines += ["", "Categories with qrels outside the indexed corpus:", ""]
+        for r in partial:
+            lines.append(
+                f"- {r['category']}: {r['qrels_coverage']:.0%} of {r['relevant']} relevant "
+                f"documents in `{r['corpus']}` ({r['docs']} docs)"
+            )
+    failed = [r for r in categories.values() if "error" in r]
+    if failed:
+        lines += ["", "Failed categories:", ""]
+        lines += [f"- {r['category']}: {r['error']}" for r in failed]
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate BM25 on every dataset category")
+    parser.add_argument("--categories", default=None, help="comma separated (default: all)")
+    parser.add_argument("--data-root", default=str(DATA_ROOT))
+    parser.add_argument("--index-dir", default=".")
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--k", default=",".join(map(str, DEFAULT_KS)), help="metric cutoffs")
+    parser.add_argument("--backend", choices=["auto", "python", "sparse"], default="auto")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--rebuild", action="store_true", help="rebuild every index")
+    parser.add_argument("--runs-dir", default=None, help="also write a run file per category")
+    parser.add_argument("--out", default="evaluation_report", help="writes OUT.json and OUT.md")
+    args = parser.parse_args(argv)
+
+    if args.categories:
+        categories = args.categories.split(",")
+    else:
+        categories = discover_categories(args.data_root)
+    ks = [int(k) for k in args.k.split(",") if k]
+
+    start = time.perf_counter()
+    results = run_all(
+        categories,
+        args.workers,
+        data_root=args.data_root,
+        index_dir=args.index_dir,
+        top_k=args.top_k,
+        ks=ks,
+        backend=args.backend,
+        rebuild=args.rebuild,
+        runs_dir=args.runs_dir,
+    )
+    report = build_report(results, args, time.perf_counter() - start)
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out.with_suffix(".json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    markdown = to_markdown(report)
+    with open(out.with_suffix(".md"), "w", encoding="utf-8") as f:
+        f.write(markdown)
+    print(markdown)
+    return 1 if any("error" in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,8 +3,9 @@ from pathlib import Path
 from typing import List, Dict
 import argparse
 
-from bm25_retrieval import BM25Retriever, load_index
-from score import load_qrels, compute_scores
+from bm25_retrieval import create_retriever, load_index
+from federated_search import ensure_shard_index
+from score import load_graded_qrels, load_qrels, compute_scores
 
 
 def load_queries(path: str) -> List[Dict[str, object]]:
@@ -13,34 +14,50 @@ def load_queries(path: str) -> List[Dict[str, object]]:
 
 
 def parse_args():
-    parser = argparse.ArgumentParser(description="Evaluate BM25 on the fraud dataset")
+    parser = argparse.ArgumentParser(description="Evaluate BM25 on one dataset category")
     parser.add_argument(
         "--top_k",
         type=int,
         default=10,
         help="number of documents to retrieve for each query",
     )
+    parser.add_argument(
+        "--category",
+        default="fraud",
+        help="dataset category under data/ (index is built if missing)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["auto", "python", "sparse"],
+        default="auto",
+        help="BM25 scoring backend (sparse requires numpy)",
+    )
+    parser.add_argument(
+        "--run-out",
+        default=None,
+        help="write the ranking as a run file for evaluation.py",
+    )
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
 
-    data_dir = Path('data') / 'fraud'
-    index_file = 'fraud_index.json'
+    data_dir = Path('data') / args.category
+    index_file = ensure_shard_index(args.category)
 
     queries_path = data_dir / 'format' / 'queries.json'
     qrels_path = data_dir / 'format' / 'qrels.json'
 
     # load index
     index = load_index(index_file)
-    bm25 = BM25Retriever(index)
+    bm25 = create_retriever(index, backend=args.backend)
     queries = load_queries(str(queries_path))
 
     top_k = args.top_k
     preds = []
-    for q in queries:
-        results = bm25.query(q["text"], top_k=top_k)
+    batch = bm25.query_batch([q["text"] for q in queries], top_k=top_k)
+    for q, results in zip(queries, batch):
         doc_ids = [doc_id for score, doc_id in results]
         preds.append({"qid": q["id"], "docids": doc_ids})
 
@@ -53,6 +70,16 @@ def main():
     print(f"Accuracy: {accuracy:.4f}")
     print(f"MRR: {mrr:.4f}")
 
+    from evaluation import Evaluator
+
+    ks = sorted({1, 5, top_k})
+    means = Evaluator(load_graded_qrels(str(qrels_path)), ks).evaluate({"bm25": preds_map}).means()
+    print("  ".join(f"{m}: {v:.4f}" for m, v in means["bm25"].items() if not m.startswith("Success")))
+
+    if args.run_out:
+        with open(args.run_out, 'w', encoding='utf-8') as f:
+            json.dump(preds, f, ensure_ascii=False, indent=2)
+
     # print top-k results with ground truth for each query
     for q in queries:
         qid = q["id"]
@@ -63,6 +90,8 @@ def main():
 
 "python evaluate_bm25.py"
 "python evaluate_bm25.py --top_k 20"
+"python evaluate_bm25.py --category snatch"
+"python evaluate_bm25.py --run-out runs/bm25.json"
 
 if __name__ == '__main__':
     main()
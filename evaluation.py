@@ -0,0 +1,307 @@
+"""Vectorized retrieval evaluation over graded qrels and many runs.
+
+All runs are encoded into one ``runs x queries x depth`` array of relevance
+grades, and every metric is computed with NumPy over that array at once:
+
+* ``P@k``, ``Recall@k``, ``nDCG@k`` (gain ``2^rel - 1``) and ``Success@k``
+  for every cutoff in ``ks``
+* ``MAP`` and ``MRR`` over the full run depth
+
+Only queries with at least one relevant judgment are evaluated; a query
+missing from a run scores zero.  :meth:`EvalResult.compare` reports
+per-query deltas against a baseline with a paired randomization test, a
+sign test and Holm-adjusted p-values.
+
+Usage::
+
+    python evaluation.py data/fraud/format/qrels.json run_a.json run_b.json --baseline run_a
+"""
+import argparse
+import json
+import math
+from itertools import chain
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from score import load_graded_qrels, load_preds
+
+DEFAULT_KS = (1, 5, 10, 20, 100)
+# (query index, doc id) pairs are packed into one int64 key
+_DOC_STRIDE = 1 << 40
+
+
+def load_run(path: str) -> Dict[int, List[int]]:
+    """Load a run in the JSON predictions format or the TREC run format.
+
+    TREC lines are ``qid Q0 docid rank score tag`` and are ranked by score.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(1)
+        while head.isspace():
+            head = f.read(1)
+    if head == "[":
+        return load_preds(path)
+    scored: Dict[int, List[tuple]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 5:
+                rank, docid = int(parts[3]), int(parts[2])
+                scored.setdefault(int(parts[0]), []).append((-float(parts[4]), rank, docid))
+    return {qid: [doc for _, _, doc in sorted(rows)] for qid, rows in scored.items()}
+
+
+def paired_permutation_pvalues(
+    deltas: np.ndarray, n_permutations: int = 10000, seed: int = 0
+) -> np.ndarray:
+    """Two-sided randomization test of ``mean(delta) != 0`` for every row.
+
+    Each permutation flips the sign of every per-query delta at random; the
+    same sign matrix is shared by all rows, so the test is one matrix product.
+    """
+    deltas = np.atleast_2d(np.asarray(deltas, dtype=np.float64))
+    n_queries = deltas.shape[1]
+    if n_queries == 0:
+        return np.ones(len(deltas))
+    observed = np.abs(deltas.sum(axis=1))
+    rng = np.random.default_rng(seed)
+    exceed = np.zeros(len(deltas), dtype=np.int64)
+    # bounded blocks keep the sign matrix small for large query sets
+    block = max(1, min(n_permutations, 2**22 // n_queries))
+    done = 0
+    while done < n_permutations:
+        size = min(block, n_permutations - done)
+        signs = rng.integers(0, 2, size=(size, n_queries), dtype=np.int8) * 2 - 1
+        stats = np.abs(deltas @ signs.T.astype(np.float64))
+        exceed += (stats >= observed[:, None] - 1e-12).sum(axis=1)
+        done += size
+    return (exceed + 1) / (n_permutations + 1)
+
+
+def sign_test_pvalue(wins: int, losses: int) -> float:
+    """Two-sided exact binomial sign test; ties are dropped by the caller."""
+    n = wins + losses
+    if n == 0:
+        return 1.0
+    tail = sum(math.comb(n, i) for i in range(min(wins, losses) + 1)) / 2**n
+    return min(1.0, 2 * tail)
+
+
+def holm_adjust(pvalues: Sequence[float]) -> List[float]:
+    """Holm-Bonferroni adjusted p-values, in input order."""
+    m = len(pvalues)
+    order = sorted(range(m), key=lambda i: pvalues[i])
+    adjusted = [0.0] * m
+    running = 0.0
+    for rank, i in enumerate(order):
+        running = max(running, min(1.0, (m - rank) * pvalues[i]))
+        adjusted[i] = running
+    return adjusted
+
+
+class EvalResult:
+    """Per-query metric arrays of several runs over the same queries."""
+
+    def __init__(self, names: List[str], qids: List[int], per_query: Dict[str, np.ndarray]):
+        self.names = names
+        self.qids = qids
+        # metric -> array of shape (len(names), len(qids))
+        self.per_query = per_query
+
+    @property
+    def metrics(self) -> List[str]:
+        return list(self.per_query)
+
+    def means(self) -> Dict[str, Dict[str, float]]:
+        """Return ``run -> metric -> mean over queries``."""
+        n = max(len(self.qids), 1)
+        means = {m: values.sum(axis=1) / n for m, values in self.per_query.items()}
+        return {
+            name: {m: float(means[m][i]) for m in self.per_query}
+            for i, name in enumerate(self.names)
+        }
+
+    def deltas(self, baseline: str, metric: str) -> np.ndarray:
+        """Per-query ``run - baseline`` differences of ``metric`` for every run."""
+        values = self.per_query[metric]
+        return values - values[self.names.index(baseline)]
+
+    def compare(
+        self, baseline: str, metric: str, n_permutations: int = 10000, seed: int = 0
+    ) -> List[Dict[str, object]]:
+        """Compare every other run with ``baseline`` on ``metric``."""
+        if baseline not in self.names:
+            raise ValueError(f"unknown baseline run: {baseline}")
+        if metric not in self.per_query:
+            raise ValueError(f"unknown metric: {metric}; expected one of {self.metrics}")
+        deltas = self.deltas(baseline, metric)
+        others = [i for i, name in enumerate(self.names) if name != baseline]
+        p_perm = paired_permutation_pvalues(deltas[others], n_permutations, seed)
+        means = self.means()
+        rows = []
+        for i, p in zip(others, p_perm):
+            wins = int((deltas[i] > 0).sum())
+            losses = int((deltas[i] < 0).sum())
+            rows.append(
+                {
+                    "run": self.names[i],
+                    "metric": metric,
+                    "mean": means[self.names[i]][metric],
+                    "baseline": means[baseline][metric],
+                    "delta": float(deltas[i].mean()) if self.qids else 0.0,
+                    "wins": wins,
+                    "losses": losses,
+                    "ties": len(self.qids) - wins - losses,
+                    "p_permutation": float(p),
+                    "p_sign": sign_test_pvalue(wins, losses),
+                }
+            )
+        for row, adjusted in zip(rows, holm_adjust([r["p_permutation"] for r in rows])):
+            row["p_holm"] = adjusted
+        return rows
+
+
+class Evaluator:
+    """Evaluate runs against graded qrels (``qid -> {docid: grade}``)."""
+
+    def __init__(self, qrels: Dict[int, Dict[int, int]], ks: Sequence[int] = DEFAULT_KS):
+        self.ks = sorted(set(int(k) for k in ks))
+        if not self.ks or self.ks[0] < 1:
+            raise ValueError("cutoffs must be positive")
+        self.qids = sorted(q for q, docs in qrels.items() if any(g > 0 for g in docs.values()))
+        keys, key_grades, grade_lists = [], [], []
+        for q, qid in enumerate(self.qids):
+            docs = {d: g for d, g in qrels[qid].items() if g > 0}
+            if any(not 0 <= d < _DOC_STRIDE for d in docs):
+                raise ValueError(f"doc ids must be in [0, 2**40) (query {qid})")
+            keys += [q * _DOC_STRIDE + d for d in docs]
+            key_grades += docs.values()
+            grade_lists.append(sorted(docs.values(), reverse=True))
+        # sorted (query index, doc id) keys of every relevant judgment
+        order = np.argsort(np.asarray(keys, dtype=np.int64), kind="stable")
+        self._keys = np.asarray(keys, dtype=np.int64)[order]
+        self._key_grades = np.asarray(key_grades, dtype=np.float64)[order]
+        self.n_relevant = np.array([len(g) for g in grade_lists], dtype=np.float64)
+
+        max_k = self.ks[-1]
+        ideal = np.zeros((len(self.qids), max_k))
+        for q, grades in enumerate(grade_lists):
+            ideal[q, : min(len(grades), max_k)] = grades[:max_k]
+        ideal_gain = (2.0**ideal - 1) / np.log2(np.arange(2, max_k + 2))
+        self._ideal_dcg = np.cumsum(ideal_gain, axis=1)
+
+    def _encode(self, runs: List[Dict[int, List[int]]], depth: int) -> np.ndarray:
+        """Return ``runs x queries x depth`` relevance grades of the ranked docs."""
+        grades = np.zeros((len(runs), len(self.qids), depth), dtype=np.float64)
+        if not len(self._keys) or not depth:
+            return grades
+        for r, run in enumerate(runs):
+            rankings = [run.get(qid, ()) for qid in self.qids]
+            if any(len(ranking) > depth for ranking in rankings):
+                rankings = [ranking[:depth] for ranking in rankings]
+            lengths = np.fromiter(map(len, rankings), dtype=np.int64, count=len(rankings))
+            total = int(lengths.sum())
+            docs = np.fromiter(chain.from_iterable(rankings), dtype=np.int64, count=total)
+            rows = np.repeat(np.arange(len(self.qids), dtype=np.int64), lengths)
+            cols = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            keys = rows * _DOC_STRIDE + docs
+            pos = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+            match = (self._keys[pos] == keys) & (docs >= 0)
+            grades[r, rows[match], cols[match]] = self._key_grades[pos[match]]
+        return grades
+
+    def evaluate(self, runs: Dict[str, Dict[int, List[int]]], depth: int | None = None) -> EvalResult:
+        """Evaluate every run in one vectorized pass.
+
+        ``depth`` truncates the rankings (default: the longest ranking).
+        """
+        names = list(runs)
+        if depth is None:
+            depth = max((len(r) for run in runs.values() for r in run.values()), default=0)
+        grades = self._encode([runs[n] for n in names], depth)
+        relevant = grades > 0
+        positions = np.arange(1, depth + 1, dtype=np.float64)
+        hits = np.cumsum(relevant, axis=2)
+        gain = (2.0**grades - 1) / np.log2(positions + 1)
+        dcg = np.cumsum(gain, axis=2)
+
+        per_query: Dict[str, np.ndarray] = {}
+        for k in self.ks:
+            cut = min(k, depth)
+            hits_k = hits[:, :, cut - 1] if cut else np.zeros(grades.shape[:2])
+            dcg_k = dcg[:, :, cut - 1] if cut else np.zeros(grades.shape[:2])
+            per_query[f"P@{k}"] = hits_k / k
+            per_query[f"Recall@{k}"] = hits_k / self.n_relevant
+            per_query[f"nDCG@{k}"] = dcg_k / self._ideal_dcg[:, k - 1]
+            per_query[f"Success@{k}"] = (hits_k > 0).astype(np.float64)
+
+        per_query["MAP"] = (relevant * hits / positions).sum(axis=2) / self.n_relevant
+        first = np.argmax(relevant, axis=2) if depth else np.zeros(grades.shape[:2], dtype=np.int64)
+        found = relevant.any(axis=2)
+        per_query["MRR"] = np.where(found, 1.0 / (first + 1), 0.0)
+        return EvalResult(names, self.qids, per_query)
+
+
+def _format_table(means: Dict[str, Dict[str, float]], metrics: List[str]) -> str:
+    width = max([len("run")] + [len(n) for n in means])
+    lines = ["run".ljust(width) + "".join(f"{m:>12}" for m in metrics)]
+    for name, values in means.items():
+        lines.append(name.ljust(width) + "".join(f"{values[m]:>12.4f}" for m in metrics))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate retrieval runs with graded qrels")
+    parser.add_argument("qrels", help="qrels in JSON or TREC format")
+    parser.add_argument("runs", nargs="+", help="run files (JSON predictions or TREC)")
+    parser.add_argument("--k", default=",".join(map(str, DEFAULT_KS)), help="cutoffs")
+    parser.add_argument("--depth", type=int, default=None, help="truncate rankings")
+    parser.add_argument("--baseline", default=None, help="run name to compare against")
+    parser.add_argument("--metric", default="nDCG@10", help="metric for --baseline tests")
+    parser.add_argument("--permutations", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="write means, tests and per-query values")
+    args = parser.parse_args(argv)
+
+    ks = [int(k) for k in args.k.split(",") if k]
+    evaluator = Evaluator(load_graded_qrels(args.qrels), ks)
+    runs = {Path(p).stem: load_run(p) for p in args.runs}
+    if len(runs) != len(args.runs):
+        raise SystemExit("run file names must have distinct stems")
+    result = evaluator.evaluate(runs, args.depth)
+    means = result.means()
+
+    shown = [f"{m}@{k}" for m in ("P", "Recall", "nDCG") for k in ks] + ["MAP", "MRR"]
+    print(f"{len(result.qids)} queries with relevant documents")
+    print(_format_table(means, shown))
+
+    comparisons = []
+    if args.baseline:
+        comparisons = result.compare(args.baseline, args.metric, args.permutations, args.seed)
+        print(f"\n{args.metric} vs {args.baseline}")
+        for row in comparisons:
+            print(
+                f"{row['run']:<24} delta {row['delta']:+.4f}  "
+                f"W/L/T {row['wins']}/{row['losses']}/{row['ties']}  "
+                f"p_perm {row['p_permutation']:.4f}  p_sign {row['p_sign']:.4f}  "
+                f"p_holm {row['p_holm']:.4f}"
+            )
+
+    if args.out:
+        report = {
+            "qids": result.qids,
+            "means": means,
+            "comparisons": comparisons,
+            "per_query": {
+                name: {m: result.per_query[m][i].tolist() for m in result.metrics}
+                for i, name in enumerate(result.names)
+            },
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Persistent SQLite cache of LLM query expansions.
+
+Entries are keyed by model name, prompt template and query, so changing the
+model or the prompt never returns a stale expansion.  Together with the
+replay mode of ``mcp_server.expand_search`` (``Q2D_EXPANSION_MODE=replay``)
+this makes tuning and evaluation runs repeatable offline.
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS expansions (
+    model TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    query TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (model, prompt, query)
+)
+"""
+
+
+class ExpansionCache:
+    """Thread-safe ``(model, prompt, query) -> expansion`` store."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model: str, prompt: str, query: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM expansions WHERE model = ? AND prompt = ? AND query = ?",
+                (model, prompt, query),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, model: str, prompt: str, query: str, response: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO expansions VALUES (?, ?, ?, ?, ?)",
+                (model, prompt, query, response, time.time()),
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM expansions").fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
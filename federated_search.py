@@ -0,0 +1,202 @@
+"""Federated BM25 search across the crime categories under ``data/``.
+
+Every category is an independent shard with its own index.  A query is fanned
+out to the shards in parallel (threads or processes) and the per-shard top-k
+lists are merged into a global top-k.  With ``global_idf=True`` every shard
+scores with corpus-wide N, df and avgdl, which makes the scores comparable
+across shards and identical to a single index over all categories.
+
+Usage::
+
+    python federated_search.py "騙取金錢" --top_k 10 --categories fraud,snatch
+"""
+import argparse
+import heapq
+import math
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+from bm25_retrieval import create_retriever, default_index_path, load_index
+from build_bm25_index import build_index_streaming
+from corpus_io import iter_corpus
+
+DATA_ROOT = Path("data")
+
+
+def discover_categories(data_root=DATA_ROOT) -> List[str]:
+    """Return the dataset categories (directories with a ``format/`` folder)."""
+    return sorted(p.parent.name for p in Path(data_root).glob("*/format") if p.is_dir())
+
+
+def ensure_shard_index(category: str, data_root=DATA_ROOT, index_dir=".") -> Path:
+    """Return the index path of ``category``, building it if it does not exist."""
+    path = default_index_path(category, index_dir)
+    if not path.exists():
+        build_index_streaming(iter_corpus(Path(data_root) / category), path)
+    return path
+
+
+def _global_statistics(retrievers):
+    """Compute corpus-wide ``term -> df``, N and avgdl over all shards."""
+    df: Dict[str, int] = {}
+    n_docs = 0
+    total_len = 0
+    for bm25 in retrievers:
+        n_docs += bm25.N
+        total_len += sum(bm25.doc_len)
+        for term, (docs, _) in zip(bm25.vocab.terms, bm25.postings):
+            df[term] = df.get(term, 0) + len(docs)
+    avgdl = total_len / n_docs if n_docs else 0.0
+    return df, n_docs, avgdl
+
+
+class ShardedRetriever:
+    """Query several BM25 shards in parallel and merge their results.
+
+    ``shards`` maps a category name to an index (anything accepted by
+    :func:`~bm25_retrieval.create_retriever`) or an index path.  The process
+    executor reopens the indexes in every worker and therefore needs paths.
+    Results are ``(score, category, doc_id)`` tuples; ties keep shard order.
+    """
+
+    def __init__(
+        self,
+        shards: Dict[str, object],
+        global_idf: bool = False,
+        executor: str | None = "thread",
+        max_workers: int | None = None,
+        backend: str = "auto",
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        if executor not in (None, "thread", "process"):
+            raise ValueError(f"unknown executor: {executor}")
+        self.categories = list(shards)
+        self.global_idf = global_idf
+        self.shards = {}
+        for category, index in shards.items():
+            if isinstance(index, (str, Path)):
+                index = load_index(index)
+            self.shards[category] = create_retriever(index, backend=backend, k1=k1, b=b)
+        if global_idf:
+            self._apply_global_statistics()
+
+        workers = max_workers or len(self.shards)
+        self._pool = None
+        if executor == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=workers)
+        elif executor == "process":
+            if not all(isinstance(p, (str, Path)) for p in shards.values()):
+                raise ValueError("the process executor needs index paths")
+            paths = {c: str(p) for c, p in shards.items()}
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(paths, global_idf, backend, k1, b),
+            )
+
+    @classmethod
+    def from_data_dir(cls, data_root=DATA_ROOT, index_dir=".", categories=None, **kwargs):
+        """Open (building if needed) one shard per category under ``data_root``."""
+        categories = categories or discover_categories(data_root)
+        shards = {c: ensure_shard_index(c, data_root, index_dir) for c in categories}
+        return cls(shards, **kwargs)
+
+    def _apply_global_statistics(self):
+        df, n_docs, avgdl = _global_statistics(self.shards.values())
+        for bm25 in self.shards.values():
+            idf = array(
+                "d",
+                (math.log(1 + (n_docs - df[t] + 0.5) / (df[t] + 0.5)) for t in bm25.vocab.terms),
+            )
+            bm25.set_statistics(idf, avgdl)
+
+    def _select(self, categories):
+        if categories is None:
+            return self.categories
+        if isinstance(categories, str):
+            categories = [c for c in categories.split(",") if c]
+        unknown = [c for c in categories if c not in self.shards]
+        if unknown:
+            raise ValueError(f"unknown categories: {', '.join(unknown)}")
+        # keep shard order so merged ties are deterministic
+        return [c for c in self.categories if c in categories]
+
+    def _search_shard(self, category, texts, top_k):
+        return self.shards[category].query_batch(texts, top_k)
+
+    def query_batch(
+        self, texts: Sequence[str], top_k: int = 5, categories=None
+    ) -> List[List[Tuple[float, str, object]]]:
+        """Return the merged global top-k for every query text."""
+        selected = self._select(categories)
+        if self._pool is None or len(selected) == 1:
+            per_shard = [self._search_shard(c, texts, top_k) for c in selected]
+        else:
+            fn = self._search_shard if isinstance(self._pool, ThreadPoolExecutor) else _worker_search
+            futures = [self._pool.submit(fn, c, list(texts), top_k) for c in selected]
+            per_shard = [f.result() for f in futures]
+
+        merged = []
+        for i in range(len(texts)):
+            lists = [
+                [(score, category, doc_id) for score, doc_id in shard[i]]
+                for category, shard in zip(selected, per_shard)
+            ]
+            best = heapq.merge(*lists, key=lambda r: -r[0])
+            merged.append([r for r, _ in zip(best, range(top_k))])
+        return merged
+
+    def query(self, text: str, top_k: int = 5, categories=None):
+        return self.query_batch([text], top_k, categories)[0]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# per-process shard set of the process executor
+_WORKER = None
+
+
+def _init_worker(paths, global_idf, backend, k1, b):
+    global _WORKER
+    _WORKER = ShardedRetriever(paths, global_idf, executor=None, backend=backend, k1=k1, b=b)
+
+
+def _worker_search(category, texts, top_k):
+    return _WORKER._search_shard(category, texts, top_k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search all categories with BM25")
+    parser.add_argument("query")
+    parser.add_argument("--top_k", type=int, default=5)
+    parser.add_argument("--categories", default=None, help="comma separated categories")
+    parser.add_argument("--data-root", default=str(DATA_ROOT))
+    parser.add_argument("--index-dir", default=".")
+    parser.add_argument("--global-idf", action="store_true", help="use corpus-wide statistics")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    args = parser.parse_args()
+
+    with ShardedRetriever.from_data_dir(
+        args.data_root,
+        args.index_dir,
+        global_idf=args.global_idf,
+        executor=args.executor,
+    ) as searcher:
+        for score, category, doc_id in searcher.query(args.query, args.top_k, args.categories):
+            print(f"{category}\t{doc_id}\t{score:.4f}")
+
+
+if __name__ == "__main__":
+    main()
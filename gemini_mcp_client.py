@@ -1,16 +1,36 @@
 import json
 import os
 from typing import Dict, Any
-import google.generativeai as genai
+try:
+    import google.generativeai as genai
+except Exception:  # pragma: no cover - optional dependency
+    genai = None
 
+import metrics
 from mcp_client import MCPClient
 
+# 搜尋工具只回傳顯示用的片段與標示位置
+SNIPPET_ARGS = {
+    "fields": ["doc_id", "score", "snippet", "highlights", "truncated"],
+    "snippet_len": 200,
+}
 
 
 class GeminiMCPAgent:
     """使用 Gemini 的智能 MCP 代理"""
     
-    def __init__(self, api_key: str, mcp_client: MCPClient):
+    def __init__(self, api_key: str, mcp_client: MCPClient, model=None):
+        """``model`` 可注入任何具有 ``generate_content`` 的物件 (例如 ``stub_model.StubModel``)"""
+        self.mcp_client = mcp_client
+        self.conversation_history = []
+        self.model = model
+        if self.model is None:
+            self._init_gemini(api_key)
+        self.available_tools = self._tool_descriptions()
+
+    def _init_gemini(self, api_key: str):
+        if genai is None:
+            raise RuntimeError("google-generativeai 未安裝")
         genai.configure(api_key=api_key)
         
         # 嘗試不同的模型名稱，優先使用最新的 gemini-2.0-flash
@@ -54,12 +74,11 @@ class GeminiMCPAgent:
         
         if not self.model:
             raise RuntimeError("無法找到可用的 Gemini 模型")
-        
-        self.mcp_client = mcp_client
-        self.conversation_history = []
-        
-        # 可用的工具描述
-        self.available_tools = {
+
+    @staticmethod
+    def _tool_descriptions() -> Dict[str, Any]:
+        """可用的工具描述"""
+        return {
             "test": {
                 "description": "測試伺服器是否正常運行",
                 "parameters": {}
@@ -85,6 +104,10 @@ class GeminiMCPAgent:
                     "limit": "最多返回的筆數，預設為全部"
                 }
             },
+            "count_fraud_data": {
+                "description": "回傳詐欺判決摘要資料集的總筆數",
+                "parameters": {}
+            },
             "read_fraud_queries": {
                 "description": "讀取詐欺查詢資料，可指定 offset 與 limit",
                 "parameters": {
@@ -110,7 +133,7 @@ class GeminiMCPAgent:
         # 將 JSON 範例分開處理，避免 f-string 中的大括號問題
         json_example_1 = '{"action": "use_tool", "tool": "工具名稱", "args": {"參數名": "參數值"}, "reasoning": "使用原因"}'
         json_example_2 = '{"action": "respond", "response": "你的回答"}'
-        json_example_3 = '{"action": "use_tool", "tool": "read_fraud_data", "args": {"offset": 0, "limit": 0}, "reasoning": "需要讀取資料集來計算筆數"}'
+        json_example_3 = '{"action": "use_tool", "tool": "count_fraud_data", "args": {}, "reasoning": "需要取得資料集筆數"}'
         json_example_4 = '{"action": "respond", "response": "詐欺是指..."}'
         json_example_5 = '{"action": "use_tool", "tool": "read_fraud_queries", "args": {"offset": 0, "limit": 5}, "reasoning": "查看範例查詢"}'
 
@@ -158,15 +181,13 @@ class GeminiMCPAgent:
         
         try:
             # 使用更安全的生成配置
-            generation_config = genai.types.GenerationConfig(
-                temperature=0.1,
-                max_output_tokens=1000,
-            )
+            generation_config = {"temperature": 0.1, "max_output_tokens": 1000}
             
-            response = self.model.generate_content(
-                prompt,
-                generation_config=generation_config
-            )
+            with metrics.timer("agent_llm", call="analyze"):
+                response = self.model.generate_content(
+                    prompt,
+                    generation_config=generation_config
+                )
             
             # 檢查回應是否有內容
             if not response or not hasattr(response, 'text') or not response.text:
@@ -213,9 +234,29 @@ class GeminiMCPAgent:
                 "response": f"抱歉，我在處理您的請求時遇到了問題：{str(e)}"
             }
     
+    @staticmethod
+    def _format_hit(i: int, item: Dict[str, Any]) -> str:
+        """以【】標示片段中與查詢相符的文字"""
+        snippet = item.get("snippet", "")
+        marked, last = [], 0
+        for start, end in item.get("highlights", []):
+            marked.append(snippet[last:start] + "【" + snippet[start:end] + "】")
+            last = end
+        marked.append(snippet[last:])
+        if item.get("truncated"):
+            marked.append("...")
+        return (
+            f"\n{i}. 文件ID: {item['doc_id']}"
+            f"\n   相關度: {item['score']:.4f}"
+            f"\n   內容: {''.join(marked)}\n"
+        )
+
     def _execute_tool(self, tool_name: str, args: Dict[str, Any]) -> str:
         """執行 MCP 工具並格式化結果"""
         try:
+            if tool_name in ("search", "expand_search"):
+                # 只取回顯示所需的片段，避免傳送完整判決全文
+                args = {**SNIPPET_ARGS, **args}
             response = self.mcp_client.call_tool(tool_name, args)
             
             if "error" in response:
@@ -233,14 +274,7 @@ class GeminiMCPAgent:
 
                 formatted_results = ["🔍 搜尋結果："]
                 for i, item in enumerate(result[:5], 1):
-                    text_preview = item['text'][:200]
-                    if len(item['text']) > 200:
-                        text_preview += '...'
-                    formatted_results.append(
-                        f"\n{i}. 文件ID: {item['doc_id']}"
-                        f"\n   相關度: {item['score']:.4f}"
-                        f"\n   內容: {text_preview}\n"
-                    )
+                    formatted_results.append(self._format_hit(i, item))
                 return "\n".join(formatted_results)
 
             elif tool_name == "expand_search":
@@ -251,14 +285,7 @@ class GeminiMCPAgent:
 
                 formatted_results = [f"🔍 擴充後查詢：{expanded_query}"]
                 for i, item in enumerate(results[:5], 1):
-                    text_preview = item['text'][:200]
-                    if len(item['text']) > 200:
-                        text_preview += '...'
-                    formatted_results.append(
-                        f"\n{i}. 文件ID: {item['doc_id']}"
-                        f"\n   相關度: {item['score']:.4f}"
-                        f"\n   內容: {text_preview}\n"
-                    )
+                    formatted_results.append(self._format_hit(i, item))
                 return "\n".join(formatted_results)
             
             elif tool_name == "read_fraud_data":
@@ -312,7 +339,8 @@ class GeminiMCPAgent:
                     print(f"💭 原因: {reasoning}")
                 
                 # 執行工具
-                tool_result = self._execute_tool(tool_name, args)
+                with metrics.timer("agent_tool", tool=tool_name):
+                    tool_result = self._execute_tool(tool_name, args)
                 
                 # 讓 Gemini 解釋結果
                 explain_prompt = f"""
@@ -325,7 +353,8 @@ class GeminiMCPAgent:
 """
                 
                 try:
-                    explanation = self.model.generate_content(explain_prompt)
+                    with metrics.timer("agent_llm", call="explain"):
+                        explanation = self.model.generate_content(explain_prompt)
                     final_response = f"{tool_result}\n\n💡 {explanation.text}"
                 except Exception as e:
                     print(f"🔧 解釋結果時發生錯誤: {str(e)}")
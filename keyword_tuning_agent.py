@@ -1,56 +1,170 @@
-"""Autonomous keyword tuning agent using the MCP server tools.
-
-This script demonstrates a very small loop where an "agent" observes the
-retrieval results of the first three test queries and repeatedly tries to
-improve them using the ``search`` and ``expand_search`` tools exposed by the
-MCP server.  Accuracy and MRR are measured after every attempt and the query is
-updated whenever an expansion yields a better score.
+"""Autonomous keyword tuning agent.
+
+For every query of a dataset the agent repeatedly asks the LLM to expand the
+current best query and keeps an expansion whenever it improves MRR (ties are
+broken by accuracy), stopping at the first attempt that does not help.
+
+All queries are refined concurrently on one ``asyncio`` event loop.  BM25
+runs in-process on the category index; only LLM calls leave the process, and
+they go through :class:`LLMScheduler`, which caps the calls in flight, paces
+them with a :class:`TokenBucket` and packs the expansions requested at the
+same time into batch prompts.  Cached expansions bypass all three.  Each
+finished query is appended to a JSONL checkpoint so an interrupted run
+resumes where it stopped.
 """
 
+import argparse
+import asyncio
 import json
+import os
 import sys
-
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
-from mcp_client import MCPClient
+from bm25_retrieval import create_retriever, load_index
+from federated_search import DATA_ROOT, ensure_shard_index
+from query_expansion import BATCH_SIZE, QueryExpander, expansion_mode, load_cache, load_model
 from score import load_qrels, compute_scores
 
-DATA_DIR = Path("data") / "fraud" / "format"
-QUERIES_PATH = DATA_DIR / "queries.json"
-QRELS_PATH = DATA_DIR / "qrels.json"
-
 TOP_K = 5
-NUM_QUERIES = 3
-
-
-def load_queries() -> List[Dict[str, object]]:
-    with open(QUERIES_PATH, "r", encoding="utf-8") as f:
+MAX_ITER = 3
+
+
+class TokenBucket:
+    """``asyncio`` token bucket: ``rate`` tokens per second, up to ``burst`` saved.
+
+    Waiters are served in arrival order.  A ``rate`` of 0 disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class LLMScheduler:
+    """Run blocking expansion calls from coroutines under a rate and concurrency limit.
+
+    With ``batch_size`` > 1, queries requested within ``linger`` seconds of
+    each other are expanded together by :meth:`QueryExpander.expand_batch`.
+    A batch holds one slot; each of its model calls, including the retries
+    of split batches, takes a token and counts in :attr:`calls`.
+    """
+
+    def __init__(
+        self,
+        expander: QueryExpander,
+        rate: float,
+        burst: Optional[float],
+        concurrency: int,
+        batch_size: int = 1,
+        linger: float = 0.01,
+    ):
+        self.expander = expander
+        self.bucket = TokenBucket(rate, burst)
+        self.batch_size = batch_size
+        self.linger = linger
+        self._slots = asyncio.Semaphore(concurrency)
+        self._executor = ThreadPoolExecutor(concurrency, thread_name_prefix="q2d-llm")
+        self._waiting: List[Tuple[str, asyncio.Future]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._batches = set()
+        self.calls = 0
+        self.cache_hits = 0
+        self.failures = 0
+
+    async def expand(self, query: str) -> str:
+        cached = self.expander.cached(query)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+        if self.batch_size > 1:
+            future = asyncio.get_running_loop().create_future()
+            self._waiting.append((query, future))
+            if self._flusher is None or self._flusher.done():
+                self._flusher = asyncio.create_task(self._flush())
+            return await future
+        async with self._slots:
+            await self.bucket.acquire()
+            self.calls += 1
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._executor, self.expander.generate, query)
+            except Exception:
+                self.failures += 1
+                raise
+
+    async def _flush(self) -> None:
+        await asyncio.sleep(self.linger)
+        while self._waiting:
+            chunk = self._waiting[: self.batch_size]
+            del self._waiting[: self.batch_size]
+            task = asyncio.create_task(self._send(chunk))
+            # keep a reference until done so the task is not garbage collected
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _take_token(self) -> None:
+        await self.bucket.acquire()
+        self.calls += 1
+
+    async def _send(self, chunk: List[Tuple[str, asyncio.Future]]) -> None:
+        queries = [query for query, _ in chunk]
+        loop = asyncio.get_running_loop()
+
+        def before_call():
+            # runs on the executor thread; blocks it until the loop hands out a token
+            asyncio.run_coroutine_threadsafe(self._take_token(), loop).result()
+
+        async with self._slots:
+            try:
+                # expand() already looked these queries up in the cache
+                expansions, errors = await loop.run_in_executor(
+                    self._executor,
+                    partial(
+                        self.expander.expand_batch,
+                        queries,
+                        self.batch_size,
+                        before_call=before_call,
+                        lookup=False,
+                    ),
+                )
+            except Exception as e:
+                expansions, errors = [None] * len(queries), {q: str(e) for q in queries}
+        for (query, future), expanded in zip(chunk, expansions):
+            if expanded is not None:
+                future.set_result(expanded)
+            else:
+                self.failures += 1
+                future.set_exception(RuntimeError(errors[query]))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+def load_queries(data_dir: Path) -> List[Dict[str, object]]:
+    with open(data_dir / "queries.json", "r", encoding="utf-8") as f:
         return json.load(f)
 
 
-def run_search(client: MCPClient, query: str) -> List[int]:
-    resp = client.call_tool("search", {"query": query, "top_k": TOP_K})
-    if "error" in resp:
-        raise RuntimeError(resp["error"])
-    return [item["doc_id"] for item in resp["result"]]
-
-
-def run_expand_search(client: MCPClient, query: str) -> Tuple[str, List[int]]:
-    resp = client.call_tool("expand_search", {"query": query, "top_k": TOP_K})
-    if "error" in resp:
-        # Gemini might be unavailable; fall back to original query
-        print(f"Expansion failed: {resp['error']}", file=sys.stderr)
-
-        expanded_query = query
-        docs = run_search(client, query)
-    else:
-        result = resp["result"]
-        expanded_query = result.get("expanded_query", query)
-        docs = [item["doc_id"] for item in result.get("results", [])]
-    return expanded_query, docs
-
-
 def evaluate_single(qid: int, rel_doc: int, docs: List[int]) -> Tuple[float, float]:
     """Return accuracy and MRR for one query."""
     qrels = {qid: rel_doc}
@@ -58,17 +172,37 @@ def evaluate_single(qid: int, rel_doc: int, docs: List[int]) -> Tuple[float, flo
     return compute_scores(qrels, preds)
 
 
-def refine_query(
-    client: MCPClient, qid: int, query: str, rel_doc: int, max_iter: int = 3
-) -> Tuple[str, List[int]]:
-    """Iteratively expand the query if it improves MRR."""
+def search(bm25, query: str, top_k: int) -> List[int]:
+    return [doc_id for _, doc_id in bm25.query(query, top_k)]
+
 
+async def refine_query(
+    scheduler: LLMScheduler,
+    bm25,
+    qid: int,
+    query: str,
+    rel_doc: int,
+    docs: List[int],
+    top_k: int = TOP_K,
+    max_iter: int = MAX_ITER,
+) -> Tuple[str, List[int], int]:
+    """Iteratively expand the query if it improves MRR.
+
+    Returns the best query, its results and the number of expansion attempts.
+    """
     best_query = query
-    docs = run_search(client, query)
     best_acc, best_mrr = evaluate_single(qid, rel_doc, docs)
 
+    attempts = 0
     for _ in range(max_iter):
-        expanded, new_docs = run_expand_search(client, best_query)
+        attempts += 1
+        try:
+            expanded = await scheduler.expand(best_query)
+        except Exception as e:
+            # Gemini might be unavailable; keep the current query
+            print(f"Expansion failed for query {qid}: {e}", file=sys.stderr)
+            break
+        new_docs = search(bm25, expanded, top_k)
         acc, mrr = evaluate_single(qid, rel_doc, new_docs)
         if mrr > best_mrr or (mrr == best_mrr and acc > best_acc):
             best_query = expanded
@@ -77,37 +211,151 @@ def refine_query(
         else:
             break
 
-    return best_query, docs
-
-
-def main() -> None:
-    queries = load_queries()
-    qrels = load_qrels(str(QRELS_PATH))
+    return best_query, docs, attempts
 
-    preds_before: Dict[int, List[int]] = {}
-    preds_after: Dict[int, List[int]] = {}
-    expansions: Dict[int, Tuple[str, str]] = {}
 
-    with MCPClient("mcp_server.py") as client:
-        for q in queries[:NUM_QUERIES]:
-            qid = q["id"]
-            text = q["text"]
+def load_checkpoint(path: Path) -> Dict[int, Dict[str, object]]:
+    """Return the finished queries recorded in ``path`` (a torn last line is ignored)."""
+    done = {}
+    if not path.exists():
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[record["qid"]] = record
+    return done
+
+
+async def tune(
+    queries: List[Dict[str, object]],
+    qrels: Dict[int, int],
+    bm25,
+    scheduler: LLMScheduler,
+    checkpoint: Path,
+    top_k: int = TOP_K,
+    max_iter: int = MAX_ITER,
+) -> Dict[int, Dict[str, object]]:
+    """Refine all ``queries`` concurrently; return ``qid -> record`` including resumed ones."""
+    done = load_checkpoint(checkpoint)
+    pending = [q for q in queries if q["id"] not in done]
+    if done:
+        print(f"Resuming: {len(done)} queries already tuned, {len(pending)} left")
+
+    batch = bm25.query_batch([q["text"] for q in pending], top_k)
+    checkpoint.parent.mkdir(parents=True, exist_ok=True)
+    # a run killed mid-write leaves a torn last line; start on a fresh one
+    torn = checkpoint.exists() and checkpoint.read_bytes()[-1:] not in (b"", b"\n")
+    with open(checkpoint, "a", encoding="utf-8") as out:
+        if torn:
+            out.write("\n")
+
+        async def run(q, results):
+            qid, text = q["id"], q["text"]
+            before = [doc_id for _, doc_id in results]
             rel_doc = qrels.get(qid)
-
-            preds_before[qid] = run_search(client, text)
-
             if rel_doc is None:
-                preds_after[qid] = preds_before[qid]
-                expansions[qid] = (text, text)
-                continue
+                tuned, after, attempts = text, before, 0
+            else:
+                tuned, after, attempts = await refine_query(
+                    scheduler, bm25, qid, text, rel_doc, before, top_k, max_iter
+                )
+            record = {
+                "qid": qid,
+                "original": text,
+                "tuned": tuned,
+                "before": before,
+                "after": after,
+                "attempts": attempts,
+            }
+            # written from the event loop thread only, one complete line per query
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            done[qid] = record
+
+        await asyncio.gather(*(run(q, results) for q, results in zip(pending, batch)))
+    return done
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tune dataset queries with LLM expansions")
+    parser.add_argument("--category", default="fraud")
+    parser.add_argument("--data-root", default=str(DATA_ROOT))
+    parser.add_argument("--index-dir", default=".")
+    parser.add_argument("--limit", type=int, default=None, help="only tune the first N queries")
+    parser.add_argument("--top_k", type=int, default=TOP_K)
+    parser.add_argument("--max-iter", type=int, default=MAX_ITER)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=float(os.getenv("Q2D_LLM_RATE", "5")),
+        help="LLM calls per second (0: unlimited; default Q2D_LLM_RATE or 5)",
+    )
+    parser.add_argument("--burst", type=float, default=None, help="token bucket size")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("Q2D_LLM_CONCURRENCY", "8")),
+        help="LLM calls in flight (default Q2D_LLM_CONCURRENCY or 8)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="queries per LLM prompt (1: one prompt per query; default Q2D_EXPANSION_BATCH or 20)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help="JSONL progress file (default keyword_tuning_<category>.jsonl)",
+    )
+    parser.add_argument("--restart", action="store_true", help="discard the checkpoint")
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="only use cached expansions and the local stub model (no network)",
+    )
+    return parser.parse_args()
 
-            tuned_query, docs = refine_query(client, qid, text, rel_doc)
-            preds_after[qid] = docs
-            expansions[qid] = (text, tuned_query)
 
+def main() -> None:
+    args = parse_args()
+    if args.replay:
+        os.environ["Q2D_EXPANSION_MODE"] = "replay"
+    mode = expansion_mode()
+    data_dir = Path(args.data_root) / args.category / "format"
+    checkpoint = Path(args.checkpoint or f"keyword_tuning_{args.category}.jsonl")
+    if args.restart and checkpoint.exists():
+        checkpoint.unlink()
+
+    queries = load_queries(data_dir)[: args.limit]
+    qrels = load_qrels(str(data_dir / "qrels.json"))
+    index_path = ensure_shard_index(args.category, args.data_root, args.index_dir)
+    bm25 = create_retriever(load_index(index_path))
+    expander = QueryExpander(load_model(mode), load_cache(mode), mode)
+
+    async def run():
+        scheduler = LLMScheduler(
+            expander, args.rate, args.burst, args.concurrency, args.batch_size
+        )
+        try:
+            return scheduler, await tune(
+                queries, qrels, bm25, scheduler, checkpoint, args.top_k, args.max_iter
+            )
+        finally:
+            scheduler.close()
+
+    start = time.perf_counter()
+    scheduler, records = asyncio.run(run())
+    elapsed = time.perf_counter() - start
 
     # Only evaluate the queries we processed
-    subset_qrels = {qid: qrels[qid] for qid in preds_before.keys() if qid in qrels}
+    qids = [q["id"] for q in queries]
+    subset_qrels = {qid: qrels[qid] for qid in qids if qid in qrels}
+    preds_before = {qid: records[qid]["before"] for qid in qids}
+    preds_after = {qid: records[qid]["after"] for qid in qids}
 
     acc_before, mrr_before = compute_scores(subset_qrels, preds_before)
     acc_after, mrr_after = compute_scores(subset_qrels, preds_after)
@@ -116,11 +364,18 @@ def main() -> None:
     print(f"  Accuracy: {acc_before:.4f}, MRR: {mrr_before:.4f}")
     print("Expanded metrics:")
     print(f"  Accuracy: {acc_after:.4f}, MRR: {mrr_after:.4f}")
+    print(
+        f"{len(qids)} queries in {elapsed:.2f}s: {scheduler.calls} LLM calls, "
+        f"{scheduler.cache_hits} cache hits, {scheduler.failures} failures"
+    )
     print()
-    for qid, (orig, expanded) in expansions.items():
+    for qid in qids:
+        record = records[qid]
+        if record["tuned"] == record["original"]:
+            continue
         print(f"Query {qid}")
-        print(f"  Original : {orig}")
-        print(f"  Expanded : {expanded}")
+        print(f"  Original : {record['original']}")
+        print(f"  Expanded : {record['tuned']}")
         print("-" * 40)
 
 
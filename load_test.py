@@ -0,0 +1,391 @@
+"""End-to-end load generator for ``web_server.py`` and the MCP pipeline.
+
+No Gemini traffic is involved: the agent answers with
+:func:`stub_model.agent_responder` (``Q2D_LLM=stub``) and query expansion
+runs in replay mode, both after ``--llm-latency`` seconds.  Targets:
+
+* ``mcp``: direct tool calls through an :class:`~mcp_client.MCPClientPool`
+* ``agent``: ``GeminiMCPAgent.chat`` in-process over an MCP pool (no HTTP)
+* ``http``: ``POST /api/chat`` against ``--url`` or a server started with
+  ``--spawn-web``
+
+Workers run a closed loop (optionally paced to ``--rate`` requests per
+second) until ``--requests`` or ``--duration`` is reached.  The report has
+throughput, error rate, latency percentiles and a histogram per operation.
+
+Usage::
+
+    python load_test.py mcp --concurrency 8 --duration 30
+    python load_test.py http --spawn-web --concurrency 16 --requests 500 --llm-latency 0.2
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from bench_retrieval import percentile
+
+# upper bounds (ms) of the latency histogram buckets; the last bucket is open
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+DEFAULT_MCP_MIX = "search=6,read_fraud_data=2,count_fraud_data=1,test=1"
+DEFAULT_CHAT_MIX = "search=6,count_fraud_data=1,read_fraud_queries=1,respond=2"
+QUERIES_PATH = Path("data/fraud/format/queries.json")
+FALLBACK_QUERIES = ["詐欺集團 提供帳戶", "冒用公務員名義詐取財物", "網路購物詐騙 匯款"]
+
+
+def load_queries(path=QUERIES_PATH) -> List[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [q["text"] for q in json.load(f)] or FALLBACK_QUERIES
+    except (OSError, ValueError, KeyError):
+        return FALLBACK_QUERIES
+
+
+def parse_mix(text: str) -> List[Tuple[str, float]]:
+    """Parse ``"name=weight,..."`` into ``[(name, weight), ...]``."""
+    mix = []
+    for item in text.split(","):
+        if not item:
+            continue
+        name, _, weight = item.partition("=")
+        mix.append((name.strip(), float(weight or 1)))
+    if not mix:
+        raise ValueError("empty operation mix")
+    return mix
+
+
+class OpStats:
+    """Latencies and errors of one operation; thread-safe."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.error_samples: List[str] = []
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms: float, error: str | None = None) -> None:
+        with self._lock:
+            self.latencies.append(latency_ms)
+            if error is not None:
+                self.errors += 1
+                if len(self.error_samples) < 3:
+                    self.error_samples.append(error[:200])
+
+    def summary(self, elapsed: float) -> Dict[str, object]:
+        with self._lock:
+            values = sorted(self.latencies)
+            errors = self.errors
+            samples = list(self.error_samples)
+        counts = [0] * (len(BUCKETS_MS) + 1)
+        bucket = 0
+        for value in values:
+            while bucket < len(BUCKETS_MS) and value > BUCKETS_MS[bucket]:
+                bucket += 1
+            counts[bucket] += 1
+        n = len(values)
+        return {
+            "requests": n,
+            "errors": errors,
+            "error_rate": errors / n if n else 0.0,
+            "throughput": n / elapsed if elapsed else 0.0,
+            "mean_ms": sum(values) / n if n else 0.0,
+            "p50_ms": percentile(values, 50),
+            "p90_ms": percentile(values, 90),
+            "p99_ms": percentile(values, 99),
+            "max_ms": values[-1] if values else 0.0,
+            "histogram": {
+                (f"<={b}ms" if i < len(BUCKETS_MS) else f">{BUCKETS_MS[-1]}ms"): c
+                for i, (b, c) in enumerate(zip(BUCKETS_MS + (None,), counts))
+            },
+            "error_samples": samples,
+        }
+
+
+def run_load(
+    operations: List[Tuple[str, float, Callable[[random.Random], str | None]]],
+    concurrency: int,
+    requests: int | None,
+    duration: float | None,
+    rate: float | None = None,
+    seed: int = 0,
+) -> Dict[str, object]:
+    """Drive ``operations`` from ``concurrency`` threads and collect statistics.
+
+    Each operation is ``(name, weight, fn)``; ``fn(rng)`` returns an error
+    message or None, and exceptions count as errors.
+    """
+    names = [name for name, _, _ in operations]
+    weights = [weight for _, weight, _ in operations]
+    fns = {name: fn for name, _, fn in operations}
+    stats = {name: OpStats() for name in names}
+    ticket = itertools.count()
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+
+    def worker(worker_id):
+        rng = random.Random(seed * 1000 + worker_id)
+        while True:
+            i = next(ticket)
+            if requests is not None and i >= requests:
+                return
+            if rate:
+                # open-loop pacing: request i is due at start + i / rate
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            name = rng.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                error = fns[name](rng)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            stats[name].record((time.perf_counter() - t0) * 1000, error)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    per_op = {name: s.summary(elapsed) for name, s in stats.items() if s.latencies}
+    total = OpStats()
+    for s in stats.values():
+        total.latencies += s.latencies
+        total.errors += s.errors
+    return {"elapsed_s": elapsed, "total": total.summary(elapsed), "operations": per_op}
+
+
+# -- targets -----------------------------------------------------------------
+
+
+def _tool_error(resp) -> str | None:
+    if "error" in resp:
+        return str(resp["error"])
+    if "result" not in resp:
+        return f"malformed response: {resp}"
+    return None
+
+
+def mcp_operations(pool, mix, queries, timeout):
+    """Direct tool calls; every tool in ``mix`` gets generated arguments."""
+    n_records = pool.call_tool("count_fraud_data").get("result") or 1
+
+    def args_for(tool, rng):
+        if tool in ("search", "search_all", "expand_search"):
+            return {"query": rng.choice(queries), "top_k": 5}
+        if tool in ("read_fraud_data", "read_fraud_queries"):
+            return {"offset": rng.randrange(max(n_records - 10, 1)), "limit": 10}
+        if tool == "evaluate_fraud":
+            return {"top_k": 10}
+        return {}
+
+    def make(tool):
+        def call(rng):
+            with pool.client(timeout) as client:
+                return _tool_error(client.call_tool(tool, args_for(tool, rng), timeout))
+
+        return call
+
+    return [(tool, weight, make(tool)) for tool, weight in mix]
+
+
+def chat_message(kind: str, rng: random.Random, queries: List[str]) -> str:
+    """A user message that makes the stub agent pick tool ``kind``."""
+    if kind in ("search", "expand_search"):
+        return ("擴充" if kind == "expand_search" else "搜尋") + rng.choice(queries)
+    if kind == "count_fraud_data":
+        return "詐欺資料集有多少筆資料？"
+    if kind == "read_fraud_queries":
+        return "可以列出查詢範例嗎？"
+    if kind == "evaluate_fraud":
+        return "評估一下搜尋系統的效能"
+    return "什麼是詐欺？"
+
+
+def _chat_error(text: str) -> str | None:
+    return text if text.startswith("❌") else None
+
+
+def agent_operations(pool, mix, queries):
+    """``GeminiMCPAgent.chat`` in-process with one agent (history) per thread."""
+    from gemini_mcp_client import GeminiMCPAgent
+    from stub_model import StubModel, agent_responder
+
+    model = StubModel(
+        responder=agent_responder, latency=float(os.getenv("Q2D_STUB_LATENCY", "0"))
+    )
+    local = threading.local()
+
+    def make(kind):
+        def call(rng):
+            agent = getattr(local, "agent", None)
+            if agent is None:
+                agent = local.agent = GeminiMCPAgent(None, pool, model=model)
+            return _chat_error(agent.chat(chat_message(kind, rng, queries)))
+
+        return call
+
+    return [(f"chat:{kind}", weight, make(kind)) for kind, weight in mix]
+
+
+def http_operations(url, mix, queries, timeout):
+    """``POST {url}/api/chat``; non-200 answers and ``❌`` replies are errors."""
+    endpoint = url.rstrip("/") + "/api/chat"
+
+    def make(kind):
+        def call(rng):
+            body = json.dumps({"message": chat_message(kind, rng, queries)}).encode("utf-8")
+            req = urllib.request.Request(
+                endpoint, data=body, headers={"Content-Type": "application/json"}
+            )
+            try:
+                with urllib.request.urlopen(req, timeout=timeout) as resp:
+                    data = json.loads(resp.read())
+            except urllib.error.HTTPError as e:
+                return f"HTTP {e.code}: {e.read()[:200]!r}"
+            if "error" in data:
+                return str(data["error"])
+            return _chat_error(data.get("response", ""))
+
+        return call
+
+    return [(f"http:{kind}", weight, make(kind)) for kind, weight in mix]
+
+
+@contextlib.contextmanager
+def spawn_web_server(startup_timeout: float = 120.0):
+    """Start ``web_server.py`` with the stub LLM on a free port; yield its URL."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, Q2D_LLM="stub", Q2D_WEB_PORT=str(port))
+    proc = subprocess.Popen(
+        [sys.executable, "web_server.py"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"web_server.py exited with code {proc.returncode}")
+            try:
+                urllib.request.urlopen(url + "/", timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError("web_server.py did not start in time")
+                time.sleep(0.2)
+        yield url
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+# -- reporting ---------------------------------------------------------------
+
+
+def print_report(report: Dict[str, object]) -> None:
+    print(
+        f"\n{'operation':<24}{'reqs':>7}{'err%':>7}{'rps':>9}"
+        f"{'p50ms':>9}{'p90ms':>9}{'p99ms':>9}{'maxms':>9}"
+    )
+    rows = list(report["operations"].items()) + [("TOTAL", report["total"])]
+    for name, s in rows:
+        print(
+            f"{name:<24}{s['requests']:>7}{s['error_rate'] * 100:>7.1f}{s['throughput']:>9.1f}"
+            f"{s['p50_ms']:>9.1f}{s['p90_ms']:>9.1f}{s['p99_ms']:>9.1f}{s['max_ms']:>9.1f}"
+        )
+    for name, s in report["operations"].items():
+        print(f"\n{name} latency histogram")
+        peak = max(s["histogram"].values()) or 1
+        for bucket, count in s["histogram"].items():
+            if count:
+                print(f"  {bucket:>9} {count:>7} {'#' * max(1, round(40 * count / peak))}")
+        for sample in s["error_samples"]:
+            print(f"  error: {sample}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the chat and MCP pipeline")
+    parser.add_argument("target", choices=["mcp", "agent", "http"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=None, help="total requests")
+    parser.add_argument("--duration", type=float, default=None, help="seconds (default 10)")
+    parser.add_argument("--rate", type=float, default=None, help="target requests per second")
+    parser.add_argument("--mix", default=None, help="operation weights, e.g. search=3,test=1")
+    parser.add_argument("--pool-size", type=int, default=None, help="MCP server processes")
+    parser.add_argument("--llm-latency", type=float, default=None, help="stub LLM seconds")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="web_server URL")
+    parser.add_argument("--spawn-web", action="store_true", help="start web_server.py here")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="write the report to this JSON file")
+    args = parser.parse_args(argv)
+    if args.requests is None and args.duration is None:
+        args.duration = 10.0
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    # child servers inherit these: no network model calls anywhere
+    os.environ.setdefault("Q2D_EXPANSION_MODE", "replay")
+    if args.llm_latency is not None:
+        os.environ["Q2D_STUB_LATENCY"] = str(args.llm_latency)
+    if args.pool_size is not None:
+        os.environ["Q2D_MCP_POOL_SIZE"] = str(args.pool_size)
+    mix = parse_mix(args.mix or (DEFAULT_MCP_MIX if args.target == "mcp" else DEFAULT_CHAT_MIX))
+    queries = load_queries()
+    load = dict(
+        concurrency=args.concurrency,
+        requests=args.requests,
+        duration=args.duration,
+        rate=args.rate,
+        seed=args.seed,
+    )
+
+    if args.target == "http":
+        with contextlib.ExitStack() as stack:
+            url = stack.enter_context(spawn_web_server()) if args.spawn_web else args.url
+            report = run_load(http_operations(url, mix, queries, args.timeout), **load)
+    else:
+        from mcp_client import MCPClientPool
+
+        with MCPClientPool("mcp_server.py", health_interval=None) as pool:
+            if args.target == "mcp":
+                report = run_load(mcp_operations(pool, mix, queries, args.timeout), **load)
+            else:
+                ops = agent_operations(pool, mix, queries)
+                # the agent prints its reasoning for every message
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    report = run_load(ops, **load)
+
+    report["config"] = {k: v for k, v in vars(args).items() if k != "out"}
+    report["config"]["stub_latency"] = float(os.getenv("Q2D_STUB_LATENCY", "0"))
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if report["total"]["requests"] == 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,43 @@
 from __future__ import annotations
 
+import asyncio
+import itertools
 import json
+import os
+import queue
 import subprocess
 import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
 from dataclasses import dataclass, field
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, List, Optional
+
+import metrics
 
 
 @dataclass
 class MCPClient:
-    """Simple MCP client that communicates with the server via stdio."""
+    """Simple MCP client that communicates with the server via stdio.
+
+    Every request carries an ``id`` that the server echoes back, so many calls
+    can be in flight at once: a reader thread matches responses to pending
+    futures in whatever order they arrive.  ``call_tool`` is thread-safe.
+    Round-trip time, JSON encoding/decoding time and pipe bytes are recorded
+    per tool in :mod:`metrics`.
+    """
 
     server_script: str
     process: Optional[subprocess.Popen] = field(default=None, init=False)
+    _pending: "OrderedDict[int, Future]" = field(default_factory=OrderedDict, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    # serializes writes to stdin; never held together with ``_lock`` so the
+    # reader can drain stdout while a write blocks on a full pipe
+    _write_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    _ids: itertools.count = field(default_factory=itertools.count, init=False, repr=False)
+    _reader: Optional[threading.Thread] = field(default=None, init=False, repr=False)
 
     def start(self) -> None:
         """Launch the MCP server process."""
@@ -23,13 +48,18 @@ class MCPClient:
             [sys.executable, self.server_script],
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            # inherited: a pipe nobody reads would block the server once full
+            stderr=None,
             text=True,
             bufsize=0,
         )
 
         ready_msg = self.process.stdout.readline()
         print(f"🚀 {ready_msg.strip()}")
+        self._reader = threading.Thread(
+            target=self._read_responses, args=(self.process,), daemon=True
+        )
+        self._reader.start()
 
     def stop(self) -> None:
         """Terminate the MCP server process."""
@@ -37,6 +67,9 @@ class MCPClient:
             self.process.terminate()
             self.process.wait()
             self.process = None
+        if self._reader is not None:
+            self._reader.join()
+            self._reader = None
 
     def __enter__(self) -> "MCPClient":
         self.start()
@@ -45,14 +78,234 @@ class MCPClient:
     def __exit__(self, exc_type, exc, tb) -> None:  # pragma: no cover - cleanup
         self.stop()
 
-    def call_tool(self, tool: str, args: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """Call an MCP tool with the provided arguments."""
+    def _read_responses(self, process: subprocess.Popen) -> None:
+        """Resolve pending calls as responses arrive, in any order."""
+        for line in process.stdout:
+            if not line.strip():
+                continue
+            metrics.inc("mcp_client_received_bytes", len(line.encode("utf-8")))
+            try:
+                with metrics.timer("mcp_client_decode"):
+                    resp = json.loads(line)
+            except ValueError:
+                continue
+            req_id = resp.pop("id", None)
+            with self._lock:
+                fut = self._pending.pop(req_id, None) if req_id is not None else None
+            if fut is not None:
+                fut.set_result(resp)
+            else:
+                # guessing the caller would hand it someone else's result
+                metrics.inc("mcp_client_unmatched")
+                print(f"MCP response without a pending call: {line.strip()[:200]}", file=sys.stderr)
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for fut in pending:
+            fut.set_exception(RuntimeError("MCP server exited"))
+
+    def call_tool_nowait(self, tool: str, args: Optional[Dict[str, Any]] = None) -> Future:
+        """Send a tool call and return a future resolving to its response."""
         if not self.process or not self.process.stdin or not self.process.stdout:
             raise RuntimeError("Client is not running")
 
-        request = {"tool": tool, "args": args or {}}
-        self.process.stdin.write(json.dumps(request) + "\n")
-        self.process.stdin.flush()
+        fut: Future = Future()
+        if metrics.enabled():
+            start = time.perf_counter()
+            fut.add_done_callback(
+                lambda f: metrics.observe(
+                    "mcp_client_call", time.perf_counter() - start, tool=tool
+                )
+            )
+        with self._lock:
+            req_id = next(self._ids)
+            self._pending[req_id] = fut
+        with metrics.timer("mcp_client_encode", tool=tool):
+            line = json.dumps({"id": req_id, "tool": tool, "args": args or {}}) + "\n"
+        metrics.inc("mcp_client_sent_bytes", len(line.encode("utf-8")), tool=tool)
+        try:
+            with self._write_lock:
+                self.process.stdin.write(line)
+                self.process.stdin.flush()
+        except OSError as e:
+            with self._lock:
+                self._pending.pop(req_id, None)
+            raise RuntimeError(f"MCP server is not reachable: {e}")
+        return fut
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def call_tool(
+        self, tool: str, args: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Call an MCP tool with the provided arguments."""
+        return self.call_tool_nowait(tool, args).result(timeout)
+
+    async def call_tool_async(
+        self, tool: str, args: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """``asyncio`` variant of :meth:`call_tool`; many calls may be awaited at once."""
+        return await asyncio.wrap_future(self.call_tool_nowait(tool, args))
+
+
+class MCPClientPool:
+    """Pool of MCP server processes shared by concurrent callers.
+
+    Each caller checks out a whole server process, so calls from different
+    threads never share a pipe and run in parallel.  Dead workers are
+    restarted on checkout and checkin, and idle workers are pinged with the
+    ``test`` tool every ``health_interval`` seconds.  The pool size defaults
+    to ``Q2D_MCP_POOL_SIZE`` or the CPU count.
+    """
+
+    def __init__(
+        self,
+        server_script: str,
+        size: Optional[int] = None,
+        health_interval: Optional[float] = 30.0,
+        health_timeout: float = 5.0,
+    ):
+        if size is None:
+            size = int(os.getenv("Q2D_MCP_POOL_SIZE", str(os.cpu_count() or 1)))
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        self.server_script = server_script
+        self.size = size
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.restarts = 0
+        self._workers: List[MCPClient] = []
+        self._idle: "queue.Queue[MCPClient]" = queue.Queue()
+        self._closed = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Launch all server processes."""
+        if self._workers:
+            return
+        self._closed.clear()
+        for _ in range(self.size):
+            client = MCPClient(self.server_script)
+            client.start()
+            self._workers.append(client)
+            self._idle.put(client)
+        if self.health_interval:
+            self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+            self._monitor.start()
+
+    def stop(self) -> None:
+        """Terminate all server processes."""
+        self._closed.set()
+        if self._monitor is not None:
+            self._monitor.join()
+            self._monitor = None
+        for client in self._workers:
+            client.stop()
+        self._workers = []
+        self._idle = queue.Queue()
+
+    def __enter__(self) -> "MCPClientPool":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:  # pragma: no cover - cleanup
+        self.stop()
+
+    def _restart(self, client: MCPClient) -> None:
+        client.stop()
+        client.start()
+        self.restarts += 1
+
+    def is_healthy(self, client: MCPClient) -> bool:
+        """Return True if ``client``'s server answers the ``test`` tool."""
+        if not client.is_running():
+            return False
+        try:
+            resp = client.call_tool("test", timeout=self.health_timeout)
+        except Exception:
+            return False
+        return "result" in resp
+
+    def checkout(self, timeout: Optional[float] = None) -> MCPClient:
+        """Take an idle worker, waiting up to ``timeout`` seconds."""
+        if not self._workers:
+            raise RuntimeError("Pool is not running")
+        try:
+            client = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("no idle MCP server in the pool") from None
+        if not client.is_running():
+            try:
+                self._restart(client)
+            except BaseException:
+                self._idle.put(client)
+                raise
+        return client
+
+    def checkin(self, client: MCPClient) -> None:
+        """Return a worker to the pool, restarting it if it crashed."""
+        if self._closed.is_set():
+            return
+        if not client.is_running():
+            try:
+                self._restart(client)
+            except Exception:
+                pass  # retried on the next checkout
+        self._idle.put(client)
+
+    @contextmanager
+    def client(self, timeout: Optional[float] = None) -> Iterator[MCPClient]:
+        """Context manager around :meth:`checkout` / :meth:`checkin`."""
+        client = self.checkout(timeout)
+        try:
+            yield client
+        finally:
+            self.checkin(client)
+
+    def call_tool(self, tool: str, args: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Call a tool on any idle worker; same interface as :meth:`MCPClient.call_tool`."""
+        with self.client() as client:
+            return client.call_tool(tool, args)
+
+    def call_all(
+        self, tool: str, args: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None
+    ) -> List[Any]:
+        """Call ``tool`` on every running worker, busy or idle.
+
+        Returns one response (or the raised exception) per worker in pool
+        order; used for per-process data such as the ``metrics`` tool.
+        """
+        futures = []
+        for client in list(self._workers):
+            try:
+                futures.append(client.call_tool_nowait(tool, args))
+            except Exception as e:
+                futures.append(e)
+        results = []
+        for fut in futures:
+            if isinstance(fut, Exception):
+                results.append(fut)
+                continue
+            try:
+                results.append(fut.result(timeout))
+            except Exception as e:
+                results.append(e)
+        return results
 
-        response_line = self.process.stdout.readline()
-        return json.loads(response_line)
+    def _monitor_loop(self) -> None:
+        while not self._closed.wait(self.health_interval):
+            # ping only the workers that are idle right now
+            for _ in range(self._idle.qsize()):
+                try:
+                    client = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if not self.is_healthy(client):
+                        self._restart(client)
+                except Exception:
+                    pass
+                finally:
+                    if not self._closed.is_set():
+                        self._idle.put(client)
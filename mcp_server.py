@@ -1,28 +1,53 @@
 import json
 import os
+import pickle
+import time
 from pathlib import Path
 from typing import List, Dict
 import sys
-try:
-    import google.generativeai as genai
-except Exception:  # pragma: no cover - optional dependency
-    genai = None
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from bm25_retrieval import BM25Retriever, load_index, load_corpus
+_IMPORT_START = time.perf_counter()
+
+import metrics
+from query_cache import QueryCache, index_version, normalize_query
+from query_expansion import BATCH_SIZE, QueryExpander, expansion_mode, load_cache, load_model
+from snippets import make_snippet
 from score import load_qrels, compute_scores
 
 
+def io_bound(func):
+    """Mark a tool as I/O-bound (e.g. an LLM round trip) for the fallback server."""
+    func._io_bound = True
+    return func
+
+
 try:
     # Use the real FastMCP implementation if available so that the MCP
     # CLI can recognize this server object.
     from mcp.server.fastmcp.server import FastMCP as MCPServer
 except Exception:  # pragma: no cover - optional dependency
     class MCPServer:
-        """Minimal FastMCP-like server for demonstration."""
+        """Minimal FastMCP-like server for demonstration.
+
+        Tool calls run on worker pools: CPU-bound tools (BM25) on
+        ``Q2D_CPU_WORKERS`` threads and :func:`io_bound` tools on
+        ``Q2D_IO_WORKERS`` threads, so a slow LLM call does not block cheap
+        searches.  Responses are written as each call completes; at most
+        ``Q2D_MAX_PENDING`` calls are accepted before reading stdin pauses.
+        Queue wait, run time, serialization time and response bytes are
+        recorded per tool in :mod:`metrics`.
+        """
 
         def __init__(self, name: str):
             self.name = name
             self._tools: Dict[str, callable] = {}
+            self.cpu_workers = int(os.getenv("Q2D_CPU_WORKERS", str(os.cpu_count() or 1)))
+            self.io_workers = int(os.getenv("Q2D_IO_WORKERS", "8"))
+            self.max_pending = int(os.getenv("Q2D_MAX_PENDING", "64"))
+            self._write_lock = threading.Lock()
+            self.startup_ms = None
 
         def tool(self, name: str | None = None):
             def decorator(func):
@@ -31,52 +56,316 @@ except Exception:  # pragma: no cover - optional dependency
 
             return decorator
 
+        def _respond(self, resp, req_id, tool=None):
+            # echo the request id so clients can pipeline calls
+            if req_id is not None:
+                resp["id"] = req_id
+            with metrics.timer("tool_serialize", tool=tool):
+                line = json.dumps(resp)
+            # json.dumps escapes non-ASCII, so characters are bytes
+            metrics.inc("tool_response_bytes", len(line) + 1, tool=tool)
+            with self._write_lock:
+                print(line, flush=True)
+
+        def _call(self, tool, func, args, req_id, slots, queued):
+            start = time.perf_counter()
+            metrics.observe("tool_queue", start - queued, tool=tool)
+            try:
+                resp = {"result": func(**args)}
+            except Exception as e:
+                resp = {"error": str(e)}
+                metrics.inc("tool_errors", tool=tool)
+            finally:
+                slots.release()
+            metrics.observe("tool", time.perf_counter() - start, tool=tool)
+            self._respond(resp, req_id, tool)
+
         def run(self, transport: str = "stdio"):
             if transport != "stdio":
                 raise ValueError("Only stdio transport is supported in this demo")
-            print(f"{self.name} server ready", flush=True)
-            for line in sys.stdin:
-                try:
-                    req = json.loads(line)
-                    tool = req.get("tool")
-                    args = req.get("args", {})
-                    if tool not in self._tools:
-                        resp = {"error": f"unknown tool: {tool}"}
-                    else:
-                        result = self._tools[tool](**args)
-                        resp = {"result": result}
-                except Exception as e:
-                    resp = {"error": str(e)}
-                print(json.dumps(resp), flush=True)
+            cpu_pool = ThreadPoolExecutor(self.cpu_workers, thread_name_prefix="q2d-cpu")
+            io_pool = ThreadPoolExecutor(self.io_workers, thread_name_prefix="q2d-io")
+            slots = threading.BoundedSemaphore(self.max_pending)
+            self.startup_ms = (time.perf_counter() - _IMPORT_START) * 1000
+            print(f"{self.name} server ready in {self.startup_ms:.1f} ms", flush=True)
+            try:
+                for line in sys.stdin:
+                    req_id = None
+                    tool = None
+                    try:
+                        req = json.loads(line)
+                        req_id = req.get("id")
+                        tool = req.get("tool")
+                        args = req.get("args", {})
+                        if tool not in self._tools:
+                            raise ValueError(f"unknown tool: {tool}")
+                        func = self._tools[tool]
+                        pool = io_pool if getattr(func, "_io_bound", False) else cpu_pool
+                        slots.acquire()
+                        try:
+                            pool.submit(
+                                self._call, tool, func, args, req_id, slots, time.perf_counter()
+                            )
+                        except BaseException:
+                            slots.release()
+                            raise
+                    except Exception as e:
+                        metrics.inc("tool_errors", tool=tool)
+                        self._respond({"error": str(e)}, req_id, tool)
+            finally:
+                cpu_pool.shutdown()
+                io_pool.shutdown()
 
 
 mcp = MCPServer("q2d_search")
 
-# Preload index and corpus for the fraud dataset
-_INDEX_PATH = Path(__file__).with_name("fraud_index.json")
+# Resources are loaded on first use, or ahead of time by the warm-up thread
+# started in ``__main__``, so the ready line is printed within milliseconds.
+_UNSET = object()
+
+
+class _Lazy:
+    """Thread-safe value loaded on first :meth:`get`; records the load time."""
+
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._value = _UNSET
+        self._lock = threading.Lock()
+        self.load_ms = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not _UNSET
+
+    def get(self):
+        if self._value is _UNSET:
+            with self._lock:
+                if self._value is _UNSET:
+                    start = time.perf_counter()
+                    value = self._loader()
+                    self.load_ms = (time.perf_counter() - start) * 1000
+                    self._value = value
+        return self._value
+
+    def invalidate(self, stale) -> None:
+        """Drop the value if it is still ``stale`` so the next get reloads it."""
+        with self._lock:
+            if self._value is stale:
+                self._value = _UNSET
+
+
 _CORPUS_DIR = Path("data") / "fraud"
-_INDEX = load_index(_INDEX_PATH)
-_BM25 = BM25Retriever(_INDEX)
-_DOCS = {doc["id"]: doc["text"] for doc in load_corpus(str(_CORPUS_DIR))}
 _QUERIES_PATH = _CORPUS_DIR / "format" / "queries.json"
 _QRELS_PATH = _CORPUS_DIR / "format" / "qrels.json"
 
-# Configure Gemini model for query expansion
-_GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-_GEMINI_MODEL = None
-if _GEMINI_API_KEY and genai is not None:
+# Optional warm snapshot: parsed docs/queries/qrels pickled after the first
+# warm-up and reused by later server processes while the sources are unchanged.
+_SNAPSHOT_PATH = os.getenv("Q2D_WARM_SNAPSHOT")
+
+
+def _snapshot_sources() -> Dict[str, int]:
+    from corpus_io import resolve_corpus_path
+
+    paths = [resolve_corpus_path(_CORPUS_DIR), _QUERIES_PATH, _QRELS_PATH]
+    return {str(p): os.stat(p).st_mtime_ns for p in paths}
+
+
+def _load_snapshot() -> Dict[str, object]:
+    if not _SNAPSHOT_PATH or not os.path.exists(_SNAPSHOT_PATH):
+        return {}
     try:
-        genai.configure(api_key=_GEMINI_API_KEY)
-        _GEMINI_MODEL = genai.GenerativeModel("gemini-2.0-flash")
+        with open(_SNAPSHOT_PATH, "rb") as f:
+            snapshot = pickle.load(f)
     except Exception:
-        _GEMINI_MODEL = None
+        return {}
+    if snapshot.get("sources") != _snapshot_sources():
+        return {}
+    return snapshot
+
+
+def _save_snapshot() -> None:
+    snapshot = {
+        "sources": _snapshot_sources(),
+        "docs": _DOCS.get(),
+        "queries": _QUERIES.get(),
+        "qrels": _QRELS.get(),
+    }
+    tmp = f"{_SNAPSHOT_PATH}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, _SNAPSHOT_PATH)
+
+
+_SNAPSHOT = _Lazy("snapshot", _load_snapshot)
+
+
+def _load_fraud_index():
+    """Return ``(retriever, index path, index version)`` of the fraud index.
+
+    A missing index is built, as on the federated path.
+    """
+    from bm25_retrieval import create_retriever, load_index
+    from federated_search import ensure_shard_index
+
+    path = ensure_shard_index("fraud", _CORPUS_DIR.parent, Path(__file__).parent)
+    version = index_version(path)
+    return create_retriever(load_index(path)), path, version
+
+
+def _load_docs() -> Dict[object, str]:
+    if "docs" in _SNAPSHOT.get():
+        return _SNAPSHOT.get()["docs"]
+    from corpus_io import load_corpus
+
+    return {doc["id"]: doc["text"] for doc in load_corpus(str(_CORPUS_DIR))}
+
+
+def _load_queries() -> List[Dict[str, object]]:
+    if "queries" in _SNAPSHOT.get():
+        return _SNAPSHOT.get()["queries"]
+    with open(_QUERIES_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _load_qrels() -> Dict[int, int]:
+    if "qrels" in _SNAPSHOT.get():
+        return _SNAPSHOT.get()["qrels"]
+    return load_qrels(str(_QRELS_PATH))
+
+
+# Query expansion model and cache; Q2D_EXPANSION_MODE is described in
+# :mod:`query_expansion`.
+_EXPANSION_MODE = expansion_mode()
+
+
+def _load_expansion_cache():
+    return load_cache(_EXPANSION_MODE)
+
+
+def _load_gemini_model():
+    return load_model(_EXPANSION_MODE)
+
+
+def _load_expander():
+    return QueryExpander(_GEMINI_MODEL.get(), _EXPANSION_CACHE.get(), _EXPANSION_MODE)
+
+
+def _load_fraud_records():
+    from corpus_io import RecordFile
+
+    return RecordFile(_CORPUS_DIR / "fraud_judgment_summary.json")
+
+
+_FRAUD_INDEX = _Lazy("fraud_index", _load_fraud_index)
+_DOCS = _Lazy("docs", _load_docs)
+_QUERIES = _Lazy("queries", _load_queries)
+_QRELS = _Lazy("qrels", _load_qrels)
+_EXPANSION_CACHE = _Lazy("expansion_cache", _load_expansion_cache)
+_GEMINI_MODEL = _Lazy("gemini_model", _load_gemini_model)
+_EXPANDER = _Lazy("expander", _load_expander)
+_FRAUD_RECORDS = _Lazy("fraud_records", _load_fraud_records)
+_RESOURCES = [
+    _FRAUD_INDEX,
+    _DOCS,
+    _QUERIES,
+    _QRELS,
+    _FRAUD_RECORDS,
+    _EXPANSION_CACHE,
+    _GEMINI_MODEL,
+]
+
+# LRU cache of BM25 results, keyed by normalized query, top_k and index version
+_QUERY_CACHE = QueryCache(
+    max_size=int(os.getenv("Q2D_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("Q2D_CACHE_TTL", "300")),
+)
+
+
+def _get_bm25():
+    """Return ``(retriever, index version)``, reloading a changed index file."""
+    state = _FRAUD_INDEX.get()
+    bm25, path, version = state
+    if index_version(path) != version:
+        _FRAUD_INDEX.invalidate(state)
+        _QUERY_CACHE.clear()
+        bm25, path, version = _FRAUD_INDEX.get()
+    return bm25, version
 
-with open(_QUERIES_PATH, "r", encoding="utf-8") as f:
-    _QUERIES = json.load(f)
 
-_QRELS = load_qrels(str(_QRELS_PATH))
+def _ranked(query: str, top_k: int):
+    """Return cached ``(score, doc_id)`` results of ``query`` on the fraud index.
+
+    Concurrent requests for the same uncached query share one BM25 pass.
+    """
+    bm25, version = _get_bm25()
+    key = (normalize_query(query), top_k, version)
+    computed = False
+
+    def compute():
+        nonlocal computed
+        computed = True
+        with metrics.timer("stage", stage="bm25"):
+            return bm25.query(query, top_k)
+
+    ranked = _QUERY_CACHE.get_or_compute(key, compute)
+    metrics.inc("query_cache", result="miss" if computed else "hit")
+    return ranked
+
+
+def _warm() -> None:
+    """Load every resource in the background so the first calls are fast."""
+    for resource in _RESOURCES:
+        try:
+            resource.get()
+        except Exception as e:
+            print(f"warm-up of {resource.name} failed: {e}", file=sys.stderr, flush=True)
+    if _SNAPSHOT_PATH and not _SNAPSHOT.get():
+        try:
+            _save_snapshot()
+        except Exception as e:
+            print(f"saving warm snapshot failed: {e}", file=sys.stderr, flush=True)
+
+
+# Federated search over every category, opened on first use
+_FEDERATED = None
+_FEDERATED_LOCK = threading.Lock()
+# category -> _Lazy corpus; one loader per category even under concurrent requests
+_CATEGORY_DOCS: Dict[str, _Lazy] = {}
+_CATEGORY_DOCS_LOCK = threading.Lock()
+
+
+def _get_federated():
+    from federated_search import ShardedRetriever
+
+    global _FEDERATED
+    with _FEDERATED_LOCK:
+        if _FEDERATED is None:
+            _FEDERATED = ShardedRetriever.from_data_dir(
+                Path("data"), Path(__file__).parent, global_idf=True
+            )
+    return _FEDERATED
+
+
+def _category_docs(category: str) -> Dict[object, str]:
+    if category == "fraud":
+        return _DOCS.get()
+    with _CATEGORY_DOCS_LOCK:
+        docs = _CATEGORY_DOCS.get(category)
+        if docs is None:
+            docs = _CATEGORY_DOCS[category] = _Lazy(
+                f"docs:{category}", lambda: _load_category_docs(category)
+            )
+    return docs.get()
+
+
+def _load_category_docs(category: str) -> Dict[object, str]:
+    from corpus_io import load_corpus
+
+    return {doc["id"]: doc["text"] for doc in load_corpus(str(Path("data") / category))}
 
 @mcp.tool()
+@io_bound
 def read_fraud_data(offset: int = 0, limit: int | None = None) -> List[Dict[str, object]]:
     """Return a slice of the fraud judgment summary dataset.
 
@@ -88,15 +377,15 @@ def read_fraud_data(offset: int = 0, limit: int | None = None) -> List[Dict[str,
         Maximum number of records to return. ``None`` will return all
         records after ``offset``.
     """
-    path = _CORPUS_DIR / "fraud_judgment_summary.json"
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    if limit is not None and limit <= 0:
+        limit = None
+    return _FRAUD_RECORDS.get().read(offset, limit)
 
-    if offset < 0:
-        offset = 0
-    if limit is None or limit <= 0:
-        return data[offset:]
-    return data[offset : offset + limit]
+
+@mcp.tool()
+def count_fraud_data() -> int:
+    """Return the number of records in the fraud judgment summary dataset."""
+    return len(_FRAUD_RECORDS.get())
 
 
 @mcp.tool()
@@ -104,9 +393,10 @@ def read_fraud_queries(offset: int = 0, limit: int | None = None) -> List[Dict[s
     """Return a slice of the fraud queries dataset."""
     if offset < 0:
         offset = 0
+    queries = _QUERIES.get()
     if limit is None or limit <= 0:
-        return _QUERIES[offset:]
-    return _QUERIES[offset : offset + limit]
+        return queries[offset:]
+    return queries[offset : offset + limit]
 
 
 @mcp.tool()
@@ -115,54 +405,165 @@ def test() -> str:
     return "Q2D search server is running"
 
 
+_HIT_FIELDS = ("category", "doc_id", "score", "text", "snippet", "highlights", "truncated")
+_DEFAULT_FIELDS = ("category", "doc_id", "score", "text")
+
+
+def _format_hits(
+    hits, query: str, fields: List[str] | None, snippet_len: int
+) -> List[Dict[str, object]]:
+    """Project ``(score, category, doc_id)`` hits onto the requested ``fields``.
+
+    ``snippet``/``highlights`` are query-aware excerpts of at most
+    ``snippet_len`` characters, so callers can skip the full ``text``.
+    """
+    fields = _DEFAULT_FIELDS if fields is None else fields
+    unknown = [f for f in fields if f not in _HIT_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}; expected {_HIT_FIELDS}")
+    want_snippet = any(f in fields for f in ("snippet", "highlights", "truncated"))
+    if want_snippet and snippet_len < 1:
+        raise ValueError(f"snippet_len must be at least 1, got {snippet_len}")
+    formatted = []
+    with metrics.timer("stage", stage="format_hits"):
+        for score, category, doc_id in hits:
+            text = _category_docs(category).get(doc_id, "")
+            item = {"category": category, "doc_id": doc_id, "score": score, "text": text}
+            if want_snippet:
+                item.update(make_snippet(text, query, snippet_len))
+            formatted.append({f: item[f] for f in fields})
+    return formatted
+
+
 @mcp.tool()
-def search(query: str, top_k: int = 5) -> List[Dict[str, object]]:
-    """Return top_k search results from the fraud dataset."""
-    results = _BM25.query(query, top_k)
-    return [
-        {"doc_id": doc_id, "score": score, "text": _DOCS.get(doc_id, "")}
-        for score, doc_id in results
-    ]
+def search(
+    query: str, top_k: int = 5, fields: List[str] | None = None, snippet_len: int = 200
+) -> List[Dict[str, object]]:
+    """Return top_k search results from the fraud dataset.
+
+    ``fields`` selects the keys of each hit from ``doc_id``, ``score``,
+    ``text``, ``snippet`` and ``highlights`` (default: doc_id, score, text).
+    """
+    hits = [(score, "fraud", doc_id) for score, doc_id in _ranked(query, top_k)]
+    if fields is None:
+        fields = ["doc_id", "score", "text"]
+    return _format_hits(hits, query, fields, snippet_len)
 
 
 @mcp.tool()
-def expand_search(query: str, top_k: int = 5) -> Dict[str, object]:
-    """Expand the query using Gemini then search the fraud dataset."""
-    if not _GEMINI_MODEL:
-        raise RuntimeError("Gemini model is not configured")
-
-    prompt = (
-        "請擴充以下查詢為單行關鍵字列表，僅輸出空格分隔的關鍵字，"
-        "不要任何額外說明："
-        f"{query}"
-    )
-    try:
-        resp = _GEMINI_MODEL.generate_content(prompt)
-        expanded = resp.text.strip()
-        # 若模型仍回傳多行內容，僅取最後一行以避免額外說明
-        if "\n" in expanded:
-            expanded = expanded.splitlines()[-1].strip()
-    except Exception as e:
-        raise RuntimeError(f"Gemini expansion failed: {e}")
-
-    results = _BM25.query(expanded, top_k)
-    formatted = [
-        {"doc_id": doc_id, "score": score, "text": _DOCS.get(doc_id, "")}
-        for score, doc_id in results
-    ]
-    return {"expanded_query": expanded, "results": formatted}
+def search_all(
+    query: str,
+    top_k: int = 5,
+    categories: List[str] | None = None,
+    fields: List[str] | None = None,
+    snippet_len: int = 200,
+) -> List[Dict[str, object]]:
+    """Search every crime category (or only ``categories``) and merge the results."""
+    federated = _get_federated()
+    with metrics.timer("stage", stage="federated"):
+        hits = federated.query(query, top_k, categories)
+    return _format_hits(hits, query, fields, snippet_len)
+
+
+def _expand_query(query: str) -> str:
+    """Return the keyword expansion of ``query``, using the expansion cache."""
+    return _EXPANDER.get().expand(query)
+
+
+@mcp.tool()
+@io_bound
+def expand_search(
+    query: str, top_k: int = 5, fields: List[str] | None = None, snippet_len: int = 200
+) -> Dict[str, object]:
+    """Expand the query using Gemini then search the fraud dataset.
+
+    ``fields`` and ``snippet_len`` are the same as for :func:`search`.
+    """
+    expanded = _expand_query(query)
+    return {"expanded_query": expanded, "results": search(expanded, top_k, fields, snippet_len)}
+
+
+@mcp.tool()
+@io_bound
+def expand_search_batch(
+    queries: List[str] | None = None,
+    top_k: int = 5,
+    fields: List[str] | None = None,
+    snippet_len: int = 200,
+    batch_size: int = BATCH_SIZE,
+) -> List[Dict[str, object]]:
+    """Expand many queries with one Gemini call per batch, then search each.
+
+    ``queries`` defaults to every fraud query.  Up to ``batch_size`` uncached
+    queries share a prompt; unparsable answers are split and retried.  Each
+    item holds ``query`` with ``expanded_query`` and ``results``, or ``error``.
+    """
+    if queries is None:
+        queries = [q["text"] for q in _QUERIES.get()]
+    expansions, errors = _EXPANDER.get().expand_batch(queries, batch_size)
+    items = []
+    for query, expanded in zip(queries, expansions):
+        if expanded is None:
+            items.append({"query": query, "error": errors[query]})
+        else:
+            results = search(expanded, top_k, fields, snippet_len)
+            items.append({"query": query, "expanded_query": expanded, "results": results})
+    return items
+
+
+@mcp.tool()
+def cache_stats(clear: bool = False) -> Dict[str, object]:
+    """Return hit/miss counters of the search result cache, optionally clearing it."""
+    stats = _QUERY_CACHE.stats()
+    stats["index_version"] = list(_FRAUD_INDEX.get()[2]) if _FRAUD_INDEX.loaded else None
+    if clear:
+        _QUERY_CACHE.clear()
+    return stats
 
 
 @mcp.tool()
 def evaluate_fraud(top_k: int = 10) -> Dict[str, float]:
     """Run BM25 on fraud queries and return average scores."""
-    preds = {}
-    for q in _QUERIES:
-        res = _BM25.query(q["text"], top_k)
-        preds[q["id"]] = [doc_id for score, doc_id in res]
-    accuracy, mrr = compute_scores(_QRELS, preds)
+    bm25, _ = _get_bm25()
+    queries = _QUERIES.get()
+    batch = bm25.query_batch([q["text"] for q in queries], top_k)
+    preds = {
+        q["id"]: [doc_id for score, doc_id in res] for q, res in zip(queries, batch)
+    }
+    accuracy, mrr = compute_scores(_QRELS.get(), preds)
     return {"accuracy": accuracy, "mrr": mrr}
 
 
+@mcp.tool()
+def startup_stats() -> Dict[str, object]:
+    """Return the server startup time and the load state of lazy resources."""
+    return {
+        "startup_ms": getattr(mcp, "startup_ms", None),
+        "resources": {
+            r.name: {"loaded": r.loaded, "load_ms": r.load_ms} for r in _RESOURCES
+        },
+    }
+
+
+@mcp.tool(name="metrics")
+def metrics_tool(format: str = "json", reset: bool = False):
+    """Return the server's counters and timers as JSON or Prometheus text.
+
+    Timers cover every tool (queue wait, run time, serialization) and the
+    search stages; counters hold cache hits, postings scanned, response
+    bytes and errors.  Collection is disabled with ``Q2D_METRICS=0``.
+    """
+    if format not in ("json", "prometheus"):
+        raise ValueError("format must be 'json' or 'prometheus'")
+    snapshot = metrics.REGISTRY.snapshot()
+    if reset:
+        metrics.REGISTRY.reset()
+    if format == "prometheus":
+        return metrics.render_prometheus([(snapshot, {})])
+    return snapshot
+
+
 if __name__ == "__main__":
+    if os.getenv("Q2D_WARM", "1") != "0":
+        threading.Thread(target=_warm, name="q2d-warm", daemon=True).start()
     mcp.run(transport="stdio")
@@ -0,0 +1,170 @@
+"""In-process counters and latency histograms for the search pipeline.
+
+Instrumented code calls the module functions::
+
+    metrics.inc("tool_errors", tool="search")
+    with metrics.timer("stage", stage="bm25"):
+        ...
+
+Timers are histograms in seconds over :data:`BUCKETS`.  Metrics are on
+unless ``Q2D_METRICS=0``; when off, :func:`inc` and :func:`observe` return
+immediately and :func:`timer` hands out a shared no-op context manager.
+:func:`render_prometheus` writes snapshots in the Prometheus text format.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Dict, Iterable, List, Tuple
+
+# histogram bucket upper bounds in seconds; larger values fall into +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL_TIMER = nullcontext()
+
+
+def _key(name: str, labels: Dict[str, object]):
+    if len(labels) < 2:
+        return name, tuple(labels.items())
+    return name, tuple(sorted(labels.items()))
+
+
+def _str_labels(labels) -> Dict[str, str]:
+    return {k: str(v) for k, v in labels}
+
+
+def _sort_key(item):
+    (name, labels), _ = item
+    return name, [(k, str(v)) for k, v in labels]
+
+
+class _Timer:
+    __slots__ = ("registry", "key", "start")
+
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry._observe(self.key, time.perf_counter() - self.start)
+
+
+class Registry:
+    """Thread-safe set of labelled counters and histograms."""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._counters: Dict[tuple, float] = {}
+        # key -> [count, sum, max, bucket counts...]
+        self._timers: Dict[tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        if not self.enabled:
+            return
+        self._observe(_key(name, labels), seconds)
+
+    def _observe(self, key, seconds: float) -> None:
+        with self._lock:
+            entry = self._timers.get(key)
+            if entry is None:
+                entry = self._timers[key] = [0, 0.0, 0.0] + [0] * (len(BUCKETS) + 1)
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+            entry[3 + bisect_left(BUCKETS, seconds)] += 1
+
+    def timer(self, name: str, **labels):
+        """Context manager observing its duration under ``name``."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, _key(name, labels))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+    def snapshot(self) -> Dict[str, list]:
+        """Return a JSON-serializable copy of every metric."""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": _str_labels(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items(), key=_sort_key)
+            ]
+            timers = [
+                {
+                    "name": name,
+                    "labels": _str_labels(labels),
+                    "count": entry[0],
+                    "sum": entry[1],
+                    "max": entry[2],
+                    "buckets": entry[3:],
+                }
+                for (name, labels), entry in sorted(self._timers.items(), key=_sort_key)
+            ]
+        return {"enabled": self.enabled, "counters": counters, "timers": timers}
+
+
+REGISTRY = Registry(enabled=os.getenv("Q2D_METRICS", "1") != "0")
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+
+def enabled() -> bool:
+    return REGISTRY.enabled
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def render_prometheus(
+    sources: Iterable[Tuple[Dict[str, list], Dict[str, str]]], prefix: str = "q2d_"
+) -> str:
+    """Render ``(snapshot, extra_labels)`` pairs in the Prometheus text format.
+
+    Counters become ``<prefix><name>_total`` and timers become
+    ``<prefix><name>_seconds`` histograms.
+    """
+    families: Dict[str, Tuple[str, List[str]]] = {}
+    for snapshot, extra in sources:
+        for c in snapshot["counters"]:
+            name = f"{prefix}{c['name']}_total"
+            lines = families.setdefault(name, ("counter", []))[1]
+            lines.append(f"{name}{_labels({**c['labels'], **extra})} {c['value']}")
+        for t in snapshot["timers"]:
+            name = f"{prefix}{t['name']}_seconds"
+            lines = families.setdefault(name, ("histogram", []))[1]
+            labels = {**t["labels"], **extra}
+            cumulative = 0
+            for le, count in zip(BUCKETS + ("+Inf",), t["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {t['sum']}")
+            lines.append(f"{name}_count{_labels(labels)} {t['count']}")
+    out = []
+    for name, (kind, lines) in families.items():
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
@@ -0,0 +1,132 @@
+"""In-process LRU cache for BM25 query results.
+
+Keys are built from the normalized query text, ``top_k`` and the version of
+the index file, so a rebuilt index never serves stale results.  Entries are
+evicted in least-recently-used order once ``max_size`` is reached and expire
+after ``ttl`` seconds.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+_MISSING = object()
+
+
+def normalize_query(text: str) -> str:
+    """Drop whitespace, which the character tokenizer ignores anyway."""
+    return "".join(text.split())
+
+
+def index_version(path):
+    """Return ``(mtime_ns, size)`` of an index file or segmented index manifest."""
+    path = Path(path)
+    if path.is_dir():
+        from segment_index import MANIFEST
+
+        path = path / MANIFEST
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+class QueryCache:
+    """Thread-safe LRU cache with a time-to-live and hit/miss counters."""
+
+    def __init__(self, max_size: int = 1024, ttl: float | None = 300.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> Future of the compute() running for it
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, key):
+        """Return the live value of ``key`` or ``_MISSING``; caller holds the lock."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires is None or expires > self._clock():
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+            self.expirations += 1
+        return _MISSING
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        if self.max_size <= 0:
+            return
+        expires = None if self.ttl is None else self._clock() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value of ``key`` or store and return ``compute()``.
+
+        Concurrent misses on the same key run ``compute()`` once; the other
+        callers wait for its value (or exception) and count as hits.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+            self.put(key, value)
+            future.set_result(value)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,186 @@
+"""LLM keyword expansion of queries, shared by the MCP server and the tuning agent.
+
+``Q2D_EXPANSION_MODE`` selects "live" (cache, then Gemini), "replay" (cache,
+then the local stub model; no network) or "off" (always call Gemini).
+Expansions are cached in :class:`expansion_cache.ExpansionCache`.
+
+:meth:`QueryExpander.expand_batch` packs many queries into one prompt whose
+answer is a JSON array; a batch that cannot be parsed is split in half and
+retried, down to single-query prompts.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+MODEL_NAME = "gemini-2.0-flash"
+EXPANSION_PROMPT = (
+    "請擴充以下查詢為單行關鍵字列表，僅輸出空格分隔的關鍵字，"
+    "不要任何額外說明："
+)
+BATCH_PROMPT = (
+    "請將下列 JSON 陣列中的每個查詢擴充為單行關鍵字列表 (空格分隔的關鍵字)，"
+    "僅輸出一個長度與順序都相同的 JSON 字串陣列，不要任何額外說明："
+)
+# queries per batch prompt
+BATCH_SIZE = int(os.getenv("Q2D_EXPANSION_BATCH", "20"))
+MODES = ("live", "replay", "off")
+
+
+def expansion_mode() -> str:
+    """Return ``Q2D_EXPANSION_MODE``, validated."""
+    mode = os.getenv("Q2D_EXPANSION_MODE", "live")
+    if mode not in MODES:
+        raise ValueError(f"invalid Q2D_EXPANSION_MODE: {mode}")
+    return mode
+
+
+def load_cache(mode: str):
+    """Return the expansion cache (``Q2D_EXPANSION_CACHE``), or ``None`` when off."""
+    if mode == "off":
+        return None
+    from expansion_cache import ExpansionCache
+
+    return ExpansionCache(
+        os.getenv("Q2D_EXPANSION_CACHE", str(Path(__file__).parent / "expansion_cache.sqlite"))
+    )
+
+
+def load_model(mode: str):
+    """Return the expansion model: the stub in replay mode, else Gemini or ``None``."""
+    if mode == "replay":
+        from stub_model import StubModel
+
+        return StubModel(latency=float(os.getenv("Q2D_STUB_LATENCY", "0")))
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        return None
+    try:
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        return genai.GenerativeModel(MODEL_NAME)
+    except Exception:  # pragma: no cover - optional dependency
+        return None
+
+
+def batch_prompt(queries: List[str]) -> str:
+    """Return the prompt expanding ``queries``; the array is on the last line."""
+    return BATCH_PROMPT + "\n" + json.dumps(queries, ensure_ascii=False)
+
+
+def parse_batch(text: str, n: int) -> List[str]:
+    """Return the ``n`` expansions of a batch answer (a JSON array of strings)."""
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        raise ValueError("no JSON array in the answer")
+    items = json.loads(text[start : end + 1])
+    if not isinstance(items, list) or len(items) != n:
+        raise ValueError(f"expected a JSON array of {n} strings")
+    if not all(isinstance(x, str) for x in items):
+        raise ValueError(f"expected a JSON array of {n} strings")
+    return [" ".join(x.split()) for x in items]
+
+
+class QueryExpander:
+    """Cache-backed ``query -> keywords`` expansion through ``model``.
+
+    :meth:`cached` never calls the model, so callers can rate-limit only
+    :meth:`generate` and :meth:`expand_batch`.  All are thread-safe as long
+    as the model is.  Expansions from batch prompts are cached under
+    :data:`BATCH_PROMPT` and returned by :meth:`cached` as well.
+    """
+
+    def __init__(self, model, cache=None, mode: str = "live"):
+        self.model = model
+        self.cache = cache
+        self.mode = mode
+
+    def cached(self, query: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        cached = self.cache.get(MODEL_NAME, EXPANSION_PROMPT, query)
+        if cached is None:
+            cached = self.cache.get(MODEL_NAME, BATCH_PROMPT, query)
+        metrics.inc("expansion_cache", result="miss" if cached is None else "hit")
+        return cached
+
+    def generate(self, query: str) -> str:
+        """Ask the model for the expansion of ``query`` and cache it."""
+        if not self.model:
+            raise RuntimeError("Gemini model is not configured")
+        try:
+            with metrics.timer("stage", stage="expansion_llm"):
+                resp = self.model.generate_content(EXPANSION_PROMPT + query)
+            expanded = resp.text.strip()
+            # 若模型仍回傳多行內容，僅取最後一行以避免額外說明
+            if "\n" in expanded:
+                expanded = expanded.splitlines()[-1].strip()
+        except Exception as e:
+            raise RuntimeError(f"Gemini expansion failed: {e}")
+
+        # stub answers are not recorded so replay never pollutes the cache
+        if self.cache is not None and self.mode == "live":
+            self.cache.put(MODEL_NAME, EXPANSION_PROMPT, query, expanded)
+        return expanded
+
+    def expand(self, query: str) -> str:
+        cached = self.cached(query)
+        return cached if cached is not None else self.generate(query)
+
+    def expand_batch(
+        self,
+        queries: List[str],
+        batch_size: int = BATCH_SIZE,
+        before_call: Optional[Callable[[], None]] = None,
+        lookup: bool = True,
+    ) -> Tuple[List[Optional[str]], Dict[str, str]]:
+        """Expand ``queries`` with one model call per ``batch_size`` uncached queries.
+
+        ``before_call`` runs before every model call, including the retries
+        of split batches, so a caller can rate-limit and count them.
+        ``lookup=False`` skips the cache for callers that already checked it.
+        Returns the expansions in input order, ``None`` where expansion
+        failed, and ``query -> error message`` for those failures.
+        """
+        found: Dict[str, str] = {}
+        missing = []
+        for query in dict.fromkeys(queries):
+            cached = self.cached(query) if lookup else None
+            if cached is None:
+                missing.append(query)
+            else:
+                found[query] = cached
+        errors: Dict[str, str] = {}
+        if missing and not self.model:
+            raise RuntimeError("Gemini model is not configured")
+        batch_size = max(1, batch_size)
+        for i in range(0, len(missing), batch_size):
+            self._generate_batch(missing[i : i + batch_size], found, errors, before_call)
+        return [found.get(q) for q in queries], errors
+
+    def _generate_batch(self, chunk: List[str], found, errors, before_call) -> None:
+        if before_call is not None:
+            before_call()
+        if len(chunk) == 1:
+            try:
+                found[chunk[0]] = self.generate(chunk[0])
+            except RuntimeError as e:
+                errors[chunk[0]] = str(e)
+            return
+        try:
+            with metrics.timer("stage", stage="expansion_llm_batch"):
+                resp = self.model.generate_content(batch_prompt(chunk))
+            expansions = parse_batch(resp.text, len(chunk))
+        except Exception:
+            metrics.inc("expansion_batch_splits")
+            mid = len(chunk) // 2
+            self._generate_batch(chunk[:mid], found, errors, before_call)
+            self._generate_batch(chunk[mid:], found, errors, before_call)
+            return
+        for query, expanded in zip(chunk, expansions):
+            found[query] = expanded
+            if self.cache is not None and self.mode == "live":
+                self.cache.put(MODEL_NAME, BATCH_PROMPT, query, expanded)
@@ -3,13 +3,41 @@ import sys
 from typing import Dict, List
 
 
-def load_qrels(path: str) -> Dict[int, int]:
-    """Load qrels mapping query id to relevant doc id."""
+def load_graded_qrels(path: str) -> Dict[int, Dict[int, int]]:
+    """Load qrels mapping query id to ``{doc id: relevance grade}``.
+
+    Accepts the JSON list format (``relevance`` defaults to 1) and TREC qrels
+    lines ``qid iteration docid relevance``.  Every judgment is kept.
+    """
     with open(path, 'r', encoding='utf-8') as f:
-        qrels = json.load(f)
+        text = f.read()
+    if text.lstrip().startswith('['):
+        entries = [
+            (e['qid'], e['docid'], e.get('relevance', 1)) for e in json.loads(text)
+        ]
+    else:
+        entries = [
+            (parts[0], parts[2], parts[3])
+            for parts in (line.split() for line in text.splitlines())
+            if len(parts) >= 4
+        ]
+    graded: Dict[int, Dict[int, int]] = {}
+    for qid, docid, relevance in entries:
+        graded.setdefault(int(qid), {})[int(docid)] = int(relevance)
+    return graded
+
+
+def load_qrels(path: str) -> Dict[int, int]:
+    """Load qrels mapping query id to its most relevant doc id.
+
+    Queries judged against several documents keep the highest graded one
+    (the first on ties); use :func:`load_graded_qrels` for all judgments.
+    """
     mapping = {}
-    for entry in qrels:
-        mapping[int(entry['qid'])] = int(entry['docid'])
+    for qid, docs in load_graded_qrels(path).items():
+        docid, relevance = max(docs.items(), key=lambda item: item[1])
+        if relevance > 0:
+            mapping[qid] = docid
     return mapping
 
 
@@ -0,0 +1,456 @@
+"""Append-able BM25 index made of immutable segments.
+
+Usage:
+    python segment_index.py INDEX_DIR add SOURCE
+    python segment_index.py INDEX_DIR delete DOC_ID [DOC_ID ...]
+    python segment_index.py INDEX_DIR merge
+    python segment_index.py INDEX_DIR info
+
+An index directory holds binary segment files (see ``bm25_index_format``),
+a shared ``vocab.json`` and a ``manifest.json`` listing the live segments,
+their deleted documents and the global statistics (live document count,
+total length and per-term document frequencies).  Adding documents writes
+one new small segment, deleting only records tombstones, and both update
+the global statistics incrementally, so no operation re-reads the corpus.
+A merge policy compacts adjacent segments, optionally in a background
+thread.
+
+Searching goes through :meth:`SegmentedIndex.snapshot`, which
+:class:`~bm25_retrieval.BM25Retriever` accepts like any other index.  Live
+documents are numbered in insertion order and idf/avgdl come from the
+global statistics, so scores and rankings are identical to a fresh build
+over the live documents.
+"""
+import argparse
+import json
+import math
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover - optional dependency
+    np = None
+
+from bm25_index_format import BinaryIndex, write_index_file
+from build_bm25_index import build_index
+from corpus_io import iter_corpus
+from tokenizer import Vocabulary
+
+MANIFEST = "manifest.json"
+VOCAB = "vocab.json"
+
+
+def _write_json_atomic(path, data):
+    tmp = Path(f"{path}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class MergePolicy:
+    """Merge the cheapest window of adjacent segments once there are too many.
+
+    Only adjacent segments are merged so documents keep their insertion
+    order, which keeps tie-breaking identical to a fresh build.
+    """
+
+    def __init__(self, max_segments=8, merge_factor=4):
+        self.max_segments = max_segments
+        self.merge_factor = max(2, merge_factor)
+
+    def select(self, sizes):
+        """Return ``(start, end)`` of the segments to merge, or None."""
+        if len(sizes) <= self.max_segments:
+            return None
+        width = min(self.merge_factor, len(sizes))
+        start = min(
+            range(len(sizes) - width + 1), key=lambda i: sum(sizes[i : i + width])
+        )
+        return start, start + width
+
+
+class _Segment:
+    """An open segment file plus its deleted local document indexes."""
+
+    def __init__(self, directory, name, deleted=()):
+        self.name = name
+        self.index = BinaryIndex(Path(directory) / name)
+        self.deleted = set(deleted)
+
+    @property
+    def live_count(self):
+        return self.index.N - len(self.deleted)
+
+    def contains(self, tid, local):
+        """Return the tf of term ``tid`` in document ``local`` (0 if absent)."""
+        if tid >= self.index.n_terms:
+            return 0
+        docs, tfs = self.index.term_postings(tid)
+        pos = bisect_left(docs, local)
+        return tfs[pos] if pos < len(docs) and docs[pos] == local else 0
+
+
+class SegmentedIndex:
+    """Directory of immutable index segments with incremental statistics."""
+
+    def __init__(self, directory, merge_policy=None):
+        self.directory = Path(directory)
+        self.merge_policy = merge_policy or MergePolicy()
+        self._lock = threading.RLock()
+        # held for a whole merge so background and forced merges never overlap
+        self._merge_lock = threading.Lock()
+        self._merge_thread = None
+        manifest_path = self.directory / MANIFEST
+        if manifest_path.exists():
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            self.vocab = Vocabulary.load(self.directory / VOCAB)
+            self.generation = manifest["generation"]
+            self.next_segment = manifest["next_segment"]
+            self.n_docs = manifest["n_docs"]
+            self.total_len = manifest["total_len"]
+            self.df = array("I", manifest["df"])
+            self.segments = [
+                _Segment(self.directory, s["name"], s["deleted"]) for s in manifest["segments"]
+            ]
+        else:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.vocab = Vocabulary()
+            self.generation = 0
+            self.next_segment = 0
+            self.n_docs = 0
+            self.total_len = 0
+            self.df = array("I")
+            self.segments = []
+
+    @staticmethod
+    def is_segmented(path):
+        return (Path(path) / MANIFEST).exists()
+
+    def _commit(self):
+        """Persist the vocabulary and manifest (caller holds the lock)."""
+        self.generation += 1
+        self.vocab.save(self.directory / VOCAB)
+        _write_json_atomic(
+            self.directory / MANIFEST,
+            {
+                "generation": self.generation,
+                "next_segment": self.next_segment,
+                "n_docs": self.n_docs,
+                "total_len": self.total_len,
+                "df": list(self.df),
+                "segments": [
+                    {"name": s.name, "deleted": sorted(s.deleted)} for s in self.segments
+                ],
+            },
+        )
+
+    def _new_segment_name(self):
+        name = f"seg_{self.next_segment:06d}.bin"
+        self.next_segment += 1
+        return name
+
+    def add(self, corpus):
+        """Index ``{"id", "text"}`` records as one new segment."""
+        corpus = list(corpus)
+        if not corpus:
+            return
+        with self._lock:
+            index = build_index(corpus, self.vocab, keep_docs=True)
+            name = self._new_segment_name()
+            write_index_file(index, self.directory / name)
+            segment = _Segment(self.directory, name)
+            seg = segment.index
+            self.df.extend([0] * (len(self.vocab) - len(self.df)))
+            for tid in range(seg.n_terms):
+                self.df[tid] += seg.post_ptr[tid + 1] - seg.post_ptr[tid]
+            self.n_docs += seg.N
+            self.total_len += seg.total_len
+            self.segments.append(segment)
+            self._commit()
+        self.maybe_merge(background=True)
+
+    def delete(self, doc_ids):
+        """Delete every live document whose id is in ``doc_ids``.
+
+        Returns the number of documents deleted.
+        """
+        targets = {int(d) for d in doc_ids}
+        removed = 0
+        with self._lock:
+            for segment in self.segments:
+                seg = segment.index
+                newly = [
+                    local
+                    for local, doc_id in enumerate(seg.doc_ids)
+                    if doc_id in targets and local not in segment.deleted
+                ]
+                if not newly:
+                    continue
+                for local in newly:
+                    for tid in range(seg.n_terms):
+                        if segment.contains(tid, local):
+                            self.df[tid] -= 1
+                    self.total_len -= seg.doc_len[local]
+                segment.deleted.update(newly)
+                self.n_docs -= len(newly)
+                removed += len(newly)
+            if removed:
+                self._commit()
+        return removed
+
+    def _policy_window(self, segments):
+        return self.merge_policy.select([s.live_count for s in segments])
+
+    def maybe_merge(self, background=False):
+        """Merge until the policy is satisfied; with ``background`` in a daemon thread.
+
+        Only one background thread runs at a time.  It re-checks the policy
+        after every merge, so segments added meanwhile are merged as well.
+        """
+        if not background:
+            while self._merge_once(self._policy_window):
+                pass
+            return
+        with self._lock:
+            if self._merge_thread is not None or self._policy_window(self.segments) is None:
+                return
+            self._merge_thread = threading.Thread(target=self._merge_loop, daemon=True)
+            self._merge_thread.start()
+
+    def _merge_loop(self):
+        try:
+            while True:
+                with self._lock:
+                    # decided under the lock so maybe_merge never sees a
+                    # thread that is about to exit without merging its segments
+                    if self._policy_window(self.segments) is None:
+                        self._merge_thread = None
+                        return
+                self._merge_once(self._policy_window)
+        finally:
+            with self._lock:
+                if self._merge_thread is threading.current_thread():
+                    self._merge_thread = None
+
+    def wait_for_merges(self):
+        while True:
+            with self._lock:
+                thread = self._merge_thread
+            if thread is None:
+                return
+            thread.join()
+
+    def force_merge(self):
+        """Merge all segments into one, dropping deleted documents."""
+        self.wait_for_merges()
+
+        def everything(segments):
+            if len(segments) > 1 or any(s.deleted for s in segments):
+                return 0, len(segments)
+            return None
+
+        self._merge_once(everything)
+
+    def _merge_once(self, select):
+        """Merge the window ``select(segments)`` returns; return whether one was merged."""
+        with self._merge_lock:
+            with self._lock:
+                window = select(self.segments)
+                if window is None:
+                    return False
+            return self._merge(window)
+
+    def _merge(self, window):
+        start, end = window
+        with self._lock:
+            sources = self.segments[start:end]
+            deleted_at_start = [set(s.deleted) for s in sources]
+            vocab = Vocabulary(self.vocab.terms)
+            name = self._new_segment_name()
+
+        # build the merged segment from immutable files without the lock
+        n_terms = len(vocab)
+        postings = [(array("I"), array("I")) for _ in range(n_terms)]
+        doc_ids, doc_len = array("q"), array("I")
+        remaps = []
+        for segment, deleted in zip(sources, deleted_at_start):
+            seg = segment.index
+            remap = {}
+            for local in range(seg.N):
+                if local not in deleted:
+                    remap[local] = len(doc_ids)
+                    doc_ids.append(seg.doc_ids[local])
+                    doc_len.append(seg.doc_len[local])
+            remaps.append(remap)
+            for tid in range(seg.n_terms):
+                docs, tfs = seg.term_postings(tid)
+                entry = postings[tid]
+                for local, tf in zip(docs, tfs):
+                    new = remap.get(local)
+                    if new is not None:
+                        entry[0].append(new)
+                        entry[1].append(tf)
+        if doc_ids:
+            N = len(doc_ids)
+            write_index_file(
+                {
+                    "doc_ids": doc_ids,
+                    "vocab": vocab,
+                    "idf": array(
+                        "d",
+                        (math.log(1 + (N - len(p[0]) + 0.5) / (len(p[0]) + 0.5)) for p in postings),
+                    ),
+                    "avgdl": sum(doc_len) / N,
+                    "postings": postings,
+                    "doc_len": doc_len,
+                },
+                self.directory / name,
+            )
+
+        with self._lock:
+            current = self.segments[start:end]
+            if len(current) != len(sources) or any(a is not b for a, b in zip(current, sources)):
+                # the segment list changed under us; keep it and drop our output
+                (self.directory / name).unlink(missing_ok=True)
+                return False
+            merged = []
+            if doc_ids:
+                segment = _Segment(self.directory, name)
+                # carry over deletions that happened while merging
+                for source, before, remap in zip(sources, deleted_at_start, remaps):
+                    segment.deleted.update(remap[local] for local in source.deleted - before)
+                merged.append(segment)
+            self.segments[start:end] = merged
+            self._commit()
+        for source in sources:
+            (self.directory / source.name).unlink(missing_ok=True)
+        return True
+
+    def snapshot(self):
+        """Return a point-in-time searchable view of the live documents."""
+        with self._lock:
+            return SegmentSnapshot(
+                [(s.index, frozenset(s.deleted)) for s in self.segments],
+                Vocabulary(self.vocab.terms),
+                array("I", self.df),
+                self.n_docs,
+                self.total_len,
+            )
+
+
+class SegmentSnapshot:
+    """Read-only view over the live documents of a set of segments.
+
+    Exposes the attributes :class:`~bm25_retrieval.BM25Retriever` expects
+    (``doc_ids``, ``doc_len``, ``vocab``, ``idf``, ``avgdl`` and
+    ``postings``).  Documents are numbered in segment order, skipping deleted
+    ones; a term's postings are gathered from all segments on first use and
+    cached.
+    """
+
+    def __init__(self, segments, vocab, df, n_docs, total_len):
+        self.vocab = vocab
+        self.df = df
+        self.N = n_docs
+        self.total_len = total_len
+        self.avgdl = total_len / n_docs if n_docs else 0.0
+        self.idf = array(
+            "d", (math.log(1 + (n_docs - d + 0.5) / (d + 0.5)) for d in df)
+        )
+        self.doc_ids = array("q")
+        self.doc_len = array("I")
+        self._segments = []
+        for seg, deleted in segments:
+            base = len(self.doc_ids)
+            if deleted:
+                remap = array("q", [-1]) * seg.N
+                for local in range(seg.N):
+                    if local not in deleted:
+                        remap[local] = len(self.doc_ids)
+                        self.doc_ids.append(seg.doc_ids[local])
+                        self.doc_len.append(seg.doc_len[local])
+            else:
+                remap = None
+                self.doc_ids.frombytes(seg.doc_ids.tobytes())
+                self.doc_len.frombytes(seg.doc_len.tobytes())
+            self._segments.append((seg, base, remap))
+        self._cache = {}
+        self.postings = _SnapshotPostings(self)
+
+    def term_postings(self, tid):
+        entry = self._cache.get(tid)
+        if entry is not None:
+            return entry
+        docs, tfs = array("I"), array("I")
+        for seg, base, remap in self._segments:
+            if tid >= seg.n_terms:
+                continue
+            seg_docs, seg_tfs = seg.term_postings(tid)
+            if remap is None:
+                if np is not None:
+                    shifted = np.frombuffer(seg_docs, dtype=np.uint32) + np.uint32(base)
+                    docs.frombytes(shifted.astype(np.uint32).tobytes())
+                else:
+                    docs.extend(d + base for d in seg_docs)
+                tfs.frombytes(seg_tfs.tobytes())
+            else:
+                for local, tf in zip(seg_docs, seg_tfs):
+                    new = remap[local]
+                    if new >= 0:
+                        docs.append(new)
+                        tfs.append(tf)
+        entry = self._cache[tid] = (docs, tfs)
+        return entry
+
+
+class _SnapshotPostings:
+    """``term id -> (doc_indexes, term_freqs)`` view of a snapshot."""
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def __getitem__(self, tid):
+        return self._snapshot.term_postings(tid)
+
+    def __len__(self):
+        return len(self._snapshot.vocab)
+
+    def __iter__(self):
+        return (self[tid] for tid in range(len(self)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Maintain a segmented BM25 index")
+    parser.add_argument("index_dir", help="segmented index directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="index a corpus file or dataset directory as a new segment")
+    add.add_argument("source")
+    delete = sub.add_parser("delete", help="delete documents by id")
+    delete.add_argument("doc_ids", nargs="+", type=int)
+    sub.add_parser("merge", help="merge all segments into one")
+    sub.add_parser("info", help="print segment statistics")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    index = SegmentedIndex(args.index_dir)
+    if args.command == "add":
+        index.add(iter_corpus(args.source))
+        index.wait_for_merges()
+    elif args.command == "delete":
+        print(f"Deleted {index.delete(args.doc_ids)} documents")
+    elif args.command == "merge":
+        index.force_merge()
+    for segment in index.segments:
+        print(f"{segment.name}\tdocs: {segment.index.N}\tdeleted: {len(segment.deleted)}")
+    print(f"live documents: {index.n_docs}\tterms: {len(index.vocab)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import json
 from pathlib import Path
-from bm25_retrieval import BM25Retriever, load_index
+from bm25_retrieval import create_retriever, load_index
+from federated_search import ensure_shard_index
 from score import compute_scores, load_qrels
 
 
@@ -34,7 +35,7 @@ def main():
     data_dir = Path('data') / 'fraud' / 'format'
     queries_path = data_dir / 'queries.json'
     qrels_path = data_dir / 'qrels.json'
-    index_file = 'fraud_index.json'
+    index_file = ensure_shard_index('fraud')
     
     # 設定要測試的查詢數量
     k = 10  # 可以修改這個數字
@@ -43,7 +44,7 @@ def main():
     queries = load_queries(str(queries_path))
     qrels_map = load_qrels(str(qrels_path))
     index = load_index(index_file)
-    bm25 = BM25Retriever(index)
+    bm25 = create_retriever(index)
 
     total_accuracy = 0.0
     total_mrr = 0.0
@@ -51,11 +52,11 @@ def main():
     print(f"Testing first {k} queries...")
     print("-" * 50)
     
-    # 處理前 k 筆查詢
-    for i in range(min(k, len(queries))):
+    # 處理前 k 筆查詢，一次批次檢索
+    batch = bm25.query_batch([q['text'] for q in queries[:k]], top_k=10)
+    for i, results in enumerate(batch):
         query = queries[i]
         qid = query['id']
-        results = bm25.query(query['text'], top_k=10)
 
         # get ground truth for this query
         ground_truth = qrels_map.get(qid, [])
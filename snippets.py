@@ -0,0 +1,125 @@
+"""Query-aware snippets with highlighted matching spans.
+
+Retrieval is character based, so single characters match almost everywhere;
+a span is highlighted only where at least two consecutive characters of the
+document also appear consecutively in the query.  The snippet is the earliest
+window of ``snippet_len`` characters covering the most highlighted characters.
+"""
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover - optional dependency
+    np = None
+
+
+def query_bigrams(query: str) -> set:
+    """Return the character bigrams of ``query``, ignoring whitespace."""
+    chars = "".join(query.split())
+    return {chars[i : i + 2] for i in range(len(chars) - 1)}
+
+
+@lru_cache(maxsize=256)
+def _query_keys(query: str):
+    """Sorted ``(first << 21) | second`` code point keys of the query bigrams."""
+    bigrams = query_bigrams(query)
+    keys = np.fromiter(
+        ((ord(b[0]) << 21) | ord(b[1]) for b in bigrams), dtype=np.uint64, count=len(bigrams)
+    )
+    keys.sort()
+    return keys
+
+
+def match_spans(text: str, bigrams: set) -> List[Tuple[int, int]]:
+    """Return sorted, merged ``(start, end)`` spans of ``text`` matching the query."""
+    starts = []
+    for bigram in bigrams:
+        i = text.find(bigram)
+        while i >= 0:
+            starts.append(i)
+            i = text.find(bigram, i + 1)
+    spans: List[Tuple[int, int]] = []
+    for i in sorted(starts):
+        if spans and spans[-1][1] >= i:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], i + 2))
+        else:
+            spans.append((i, i + 2))
+    return spans
+
+
+def _best_window(spans, text_len: int, snippet_len: int) -> int:
+    """Return the earliest start of a window covering the most span characters.
+
+    Coverage only stops growing where a window starts at a span or ends at
+    the end of one, so those positions (and 0) are the only candidates.
+    """
+    last = text_len - snippet_len
+    span_starts = [s for s, _ in spans]
+    span_ends = [e for _, e in spans]
+    prefix = [0]
+    for s, e in spans:
+        prefix.append(prefix[-1] + e - s)
+
+    def coverage(begin):
+        end = begin + snippet_len
+        lo = bisect_right(span_ends, begin)
+        hi = bisect_left(span_starts, end)
+        if lo >= hi:
+            return 0
+        return (
+            prefix[hi]
+            - prefix[lo]
+            - max(0, begin - spans[lo][0])
+            - max(0, spans[hi - 1][1] - end)
+        )
+
+    candidates = {0}
+    for s, e in spans:
+        candidates.add(min(s, last))
+        candidates.add(min(max(e - snippet_len, 0), last))
+    return min(candidates, key=lambda b: (-coverage(b), b))
+
+
+def _best_window_np(text: str, query: str, snippet_len: int):
+    """Vectorized :func:`match_spans` + :func:`_best_window`."""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    keys = (codes[:-1] << np.uint64(21)) | codes[1:]
+    query_keys = _query_keys(query)
+    pos = np.minimum(np.searchsorted(query_keys, keys), len(query_keys) - 1)
+    hit = query_keys[pos] == keys
+    covered = np.zeros(len(text) + 2, dtype=np.int8)
+    covered[1:-2] |= hit
+    covered[2:-1] |= hit
+    edges = np.flatnonzero(np.diff(covered))
+    spans = [(int(s), int(e)) for s, e in zip(edges[0::2], edges[1::2])]
+    prefix = np.concatenate(([0], np.cumsum(covered[1:-1], dtype=np.int64)))
+    start = int(np.argmax(prefix[snippet_len:] - prefix[:-snippet_len]))
+    return spans, start
+
+
+def make_snippet(text: str, query: str, snippet_len: int = 200) -> Dict[str, object]:
+    """Return ``{"snippet", "start", "highlights"}`` for ``text``.
+
+    ``start`` is the snippet's offset in ``text``, ``highlights`` holds
+    ``[start, end]`` spans relative to the snippet and ``truncated`` tells
+    whether the snippet is shorter than ``text``.
+    """
+    start = 0
+    if np is not None and len(text) > snippet_len and len(_query_keys(query)):
+        spans, start = _best_window_np(text, query, snippet_len)
+    else:
+        spans = match_spans(text, query_bigrams(query))
+        if spans and len(text) > snippet_len:
+            start = _best_window(spans, len(text), snippet_len)
+    end = start + snippet_len
+    highlights = [
+        [max(s, start) - start, min(e, end) - start] for s, e in spans if e > start and s < end
+    ]
+    return {
+        "snippet": text[start:end],
+        "start": start,
+        "highlights": highlights,
+        "truncated": start > 0 or end < len(text),
+    }
@@ -0,0 +1,98 @@
+"""Offline stand-in for ``google.generativeai.GenerativeModel``.
+
+:class:`StubModel` answers ``generate_content`` locally and deterministically,
+so expansion, tuning and load tests can run without network access or an API
+key.
+"""
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+
+@dataclass
+class StubResponse:
+    """Mimics the ``.text`` attribute of a Gemini response."""
+
+    text: str
+
+
+def echo_query(prompt: str) -> str:
+    """Default responder: return the text after the last ``：`` of the prompt.
+
+    Batch expansion prompts, whose last line is a JSON array of queries, get
+    a JSON array of the echoed queries.
+    """
+    last = prompt.rsplit("\n", 1)[-1]
+    if last.startswith("["):
+        try:
+            queries = json.loads(last)
+        except ValueError:
+            queries = None
+        if isinstance(queries, list):
+            return json.dumps([" ".join(str(q).split()) for q in queries], ensure_ascii=False)
+    query = prompt.rsplit("：", 1)[-1]
+    return " ".join(query.split())
+
+
+# keyword -> (tool, args) decisions of :func:`agent_responder`, first match wins
+AGENT_RULES = (
+    ("評估", "evaluate_fraud", {"top_k": 10}),
+    ("多少筆", "count_fraud_data", {}),
+    ("查詢範例", "read_fraud_queries", {"offset": 0, "limit": 5}),
+    ("擴充", "expand_search", None),
+    ("搜尋", "search", None),
+)
+
+
+def agent_responder(prompt: str) -> str:
+    """Responder speaking the JSON action protocol of ``GeminiMCPAgent``.
+
+    Tool choice follows :data:`AGENT_RULES`; search tools get the user
+    question as their query.  Explanation prompts get a fixed short answer.
+    """
+    if "使用者最新問題：" not in prompt:
+        return "以上是工具執行結果的摘要。"
+    question = prompt.rsplit("使用者最新問題：", 1)[1].split("\n", 1)[0].strip()
+    for keyword, tool, args in AGENT_RULES:
+        if keyword in question:
+            if args is None:
+                args = {"query": question.replace(keyword, "").strip() or question, "top_k": 5}
+            return json.dumps(
+                {"action": "use_tool", "tool": tool, "args": args, "reasoning": "stub"},
+                ensure_ascii=False,
+            )
+    return json.dumps({"action": "respond", "response": f"收到：{question}"}, ensure_ascii=False)
+
+
+class StubModel:
+    """Deterministic local model with optional scripted answers and latency.
+
+    ``responses`` maps a full prompt to its answer; other prompts go through
+    ``responder``.  ``latency`` (seconds) simulates a slow remote call.
+    """
+
+    def __init__(
+        self,
+        responses: Optional[Dict[str, str]] = None,
+        responder: Callable[[str], str] = echo_query,
+        latency: float = 0.0,
+        model_name: str = "stub",
+    ):
+        self.responses = dict(responses or {})
+        self.responder = responder
+        self.latency = latency
+        self.model_name = model_name
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs) -> StubResponse:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = prompt if isinstance(prompt, str) else str(prompt)
+        if prompt in self.responses:
+            return StubResponse(self.responses[prompt])
+        return StubResponse(self.responder(prompt))
@@ -0,0 +1,64 @@
+"""Character tokenizer and interned term vocabulary shared by indexing and retrieval."""
+import json
+from array import array
+from pathlib import Path
+from typing import Iterable, List
+
+
+def tokenize(text: str) -> List[str]:
+    """Very simple character tokenizer, dropping spaces and line breaks."""
+    return [ch for ch in text if not ch.isspace()]
+
+
+class Vocabulary:
+    """Interned ``term <-> integer id`` mapping.
+
+    Term ids are assigned in order of first insertion, so encoding the same
+    corpus always yields the same ids.  Encoded documents and queries are
+    ``array('I')`` of term ids, which take 4 bytes per token instead of a
+    pointer to a one-character ``str`` object.
+    """
+
+    def __init__(self, terms: Iterable[str] = ()):
+        self.terms: List[str] = []
+        self.ids = {}
+        for term in terms:
+            self.add(term)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __contains__(self, term) -> bool:
+        return term in self.ids
+
+    def add(self, term: str) -> int:
+        """Return the id of ``term``, interning it if unseen."""
+        tid = self.ids.get(term)
+        if tid is None:
+            tid = self.ids[term] = len(self.terms)
+            self.terms.append(term)
+        return tid
+
+    def encode_tokens(self, tokens: Iterable[str], add: bool = False) -> array:
+        """Map tokens to term ids; unknown tokens are dropped unless ``add``."""
+        if add:
+            return array("I", (self.add(w) for w in tokens))
+        ids = self.ids
+        return array("I", (ids[w] for w in tokens if w in ids))
+
+    def encode(self, text: str, add: bool = False) -> array:
+        """Tokenize ``text`` and map it to term ids."""
+        return self.encode_tokens(tokenize(text), add)
+
+    def decode(self, term_ids: Iterable[int]) -> List[str]:
+        return [self.terms[t] for t in term_ids]
+
+    def save(self, path) -> None:
+        """Persist the vocabulary as a JSON list of terms in id order."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.terms, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path) -> "Vocabulary":
+        with open(Path(path), "r", encoding="utf-8") as f:
+            return cls(json.load(f))
@@ -2,21 +2,34 @@
 """Flask server providing a simple chat interface to the Gemini agent."""
 
 import os
-from flask import Flask, request, jsonify, render_template
+import time
 
+from flask import Flask, Response, request, jsonify, render_template
+
+import metrics
 from gemini_mcp_client import GeminiMCPAgent
-from mcp_client import MCPClient
+from mcp_client import MCPClientPool
 
 app = Flask(__name__)
 
-# Initialize Gemini agent and MCP server
+# Initialize Gemini agent and MCP server.  Q2D_LLM=stub answers locally with
+# stub_model.agent_responder (after Q2D_STUB_LATENCY seconds), e.g. for load tests.
+_LLM = os.getenv("Q2D_LLM", "gemini")
 _API_KEY = os.getenv("GEMINI_API_KEY")
-if not _API_KEY:
+_MODEL = None
+if _LLM == "stub":
+    from stub_model import StubModel, agent_responder
+
+    _MODEL = StubModel(
+        responder=agent_responder, latency=float(os.getenv("Q2D_STUB_LATENCY", "0"))
+    )
+elif not _API_KEY:
     raise RuntimeError("GEMINI_API_KEY environment variable is required")
 
-_MCP_CLIENT = MCPClient("mcp_server.py")
-_MCP_CLIENT.start()
-_AGENT = GeminiMCPAgent(_API_KEY, _MCP_CLIENT)
+# Each request checks out its own MCP server process (Q2D_MCP_POOL_SIZE)
+_MCP_POOL = MCPClientPool("mcp_server.py")
+_MCP_POOL.start()
+_AGENT = GeminiMCPAgent(_API_KEY, _MCP_POOL, model=_MODEL)
 
 
 @app.route('/')
@@ -26,19 +39,39 @@ def index():
 
 @app.route('/api/chat', methods=['POST'])
 def api_chat():
-    data = request.get_json(force=True)
-    message = data.get('message', '').strip()
-    if not message:
-        return jsonify({'error': 'Missing message'}), 400
+    start = time.perf_counter()
+    status = 500
     try:
-        response = _AGENT.chat(message)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    return jsonify({'response': response})
+        data = request.get_json(force=True, silent=True) or {}
+        message = data.get('message', '').strip()
+        if not message:
+            status = 400
+            return jsonify({'error': 'Missing message'}), 400
+        try:
+            response = _AGENT.chat(message)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        status = 200
+        return jsonify({'response': response})
+    finally:
+        metrics.inc('http_requests', route='/api/chat', status=status)
+        metrics.observe(
+            'http_request', time.perf_counter() - start, route='/api/chat', status=status
+        )
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics of this process and of every MCP server (label ``worker``)."""
+    sources = [(metrics.REGISTRY.snapshot(), {'process': 'web'})]
+    for i, resp in enumerate(_MCP_POOL.call_all('metrics', timeout=5)):
+        if isinstance(resp, dict) and 'result' in resp:
+            sources.append((resp['result'], {'process': 'mcp', 'worker': str(i)}))
+    return Response(metrics.render_prometheus(sources), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     try:
-        app.run(host='0.0.0.0', port=8000)
+        app.run(host='0.0.0.0', port=int(os.getenv('Q2D_WEB_PORT', '8000')), threaded=True)
     finally:
-        _MCP_CLIENT.stop()
+        _MCP_POOL.stop()
 